@@ -0,0 +1,118 @@
+"""
+Use Case: Timing the analysis code on synthetic sleep data (development only)
+  - source: synthetic session (tests.fixtures)
+  x save to logfile
+  x realtime graph (short-term)
+  x session graph (long-term)
+  x realtime analysis
+  x after-the-fact analysis
+"""
+import argparse
+from pysleep.pysleeplogging import configure_logging
+from pysleep.utils import log
+from tests import benchmarks
+
+
+def entries_kwargs(args):
+    """Only pass --entries through if it was given, so each benchmark can pick its own default session length"""
+    if args.entries:
+        return {'num_entries': args.entries}
+    return {}
+
+
+def rolling_window(args):
+    for history_size, seconds in benchmarks.benchmark_rolling_window(**entries_kwargs(args)):
+        log.info("MOVEMENT_HISTORY_SIZE %6d: %8.2f us per entry" % (history_size, seconds * 1e6))
+
+
+def store_memory(args):
+    num_entries, list_bytes, column_bytes = benchmarks.benchmark_store_memory(**entries_kwargs(args))
+    log.info("%d entries: list of SleepEntries ~%.1f MB (%d bytes per entry), SleepEntryColumns %.1f MB" %
+             (num_entries, list_bytes / 1e6, list_bytes // num_entries, column_bytes / 1e6))
+
+
+def batch_analysis(args):
+    num_entries, streaming_seconds, batch_seconds = benchmarks.benchmark_batch_analysis(**entries_kwargs(args))
+    log.info("%d entries: add_entry %.2f s, analyze_array %.2f s (%.0fx faster)" %
+             (num_entries, streaming_seconds, batch_seconds, streaming_seconds / max(batch_seconds, 1e-6)))
+
+
+def bulk_loader(args):
+    num_entries, seconds = benchmarks.benchmark_bulk_loader(**entries_kwargs(args))
+    log.info("%d entries: sleep_entry_arrays %.2f s (%.1f million rows per minute)" %
+             (num_entries, seconds, num_entries / seconds * 60 / 1e6))
+
+
+def binary_format(args):
+    results = benchmarks.benchmark_binary_format(**entries_kwargs(args))
+    log.info("%(num_entries)d entries: .slp.csv %(csv_bytes)d bytes, loaded in %(csv_seconds).3f s" % results)
+    log.info("%(num_entries)d entries: .slp.bin %(binary_bytes)d bytes, loaded in %(binary_seconds).3f s, "
+             "one entry read in %(seek_seconds).4f s" % results)
+
+
+def hub(args):
+    results = benchmarks.benchmark_hub()
+    log.info("%(devices)d devices (one unplugged, one plugged in part way through), %(sessions)d sessions: "
+             "%(readings_sent)d readings sent, %(readings_logged)d logged, using %(hub_cpu_seconds).2f s of CPU" %
+             results)
+
+
+def compressed_upload(args):
+    logfile_size, results = benchmarks.benchmark_compressed_upload(**entries_kwargs(args))
+    for compress, (bytes_sent, seconds) in sorted(results.items()):
+        log.info("%.1f MB logfile, %s: %.1f MB on the wire (%.0f%%), %.2f s" %
+                 (logfile_size / 1e6, "gzipped while uploading" if compress else "as it is", bytes_sent / 1e6,
+                  100.0 * bytes_sent / logfile_size, seconds))
+
+
+def logging(args):
+    num_entries, results = benchmarks.benchmark_logging(**entries_kwargs(args))
+    for name, seconds in sorted(results.items()):
+        log.info("%d readings, logging %s: %.2f s (%.2f us per reading)" %
+                 (num_entries, name, seconds, seconds / num_entries * 1e6))
+
+
+def startup(args):
+    results = benchmarks.benchmark_startup()
+    for entry_point, (seconds, heavy, slowest) in sorted(results.items(), key=lambda item: item[1][0]):
+        log.info("%s: %.2f s to start%s" % (entry_point, seconds,
+                                           ", imports %s" % ', '.join(heavy) if heavy else ""))
+        for module, module_seconds in slowest:
+            log.info("  import %s: %.3f s" % (module, module_seconds))
+
+
+BENCHMARKS = {
+    'rolling-window': rolling_window,
+    'store-memory': store_memory,
+    'batch-analysis': batch_analysis,
+    'bulk-loader': bulk_loader,
+    'binary-format': binary_format,
+    'hub': hub,
+    'compressed-upload': compressed_upload,
+    'logging': logging,
+    'startup': startup,
+}
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(prog='python benchmark.py',
+                                     description='Runs a benchmark of the analysis code against a synthetic session')
+    parser.add_argument('-n', '--entries',
+                        type=int,
+                        help='number of synthetic sleep entries to benchmark with (each benchmark has its own default)')
+
+    parser.add_argument('benchmark',
+                        choices=sorted(BENCHMARKS),
+                        help='which benchmark to run',
+                        nargs='+')
+    args = parser.parse_args()
+    configure_logging()
+
+    for benchmark in args.benchmark:
+        log.info("Running %s benchmark..." % benchmark)
+        BENCHMARKS[benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Use Case: Converting existing logfiles into the binary session format
+  - source: logfile
+  - save to logfile (.slp.bin)
+  x realtime graph (short-term)
+  x session graph (long-term)
+  x realtime analysis
+  x after-the-fact analysis
+"""
+import argparse
+from pysleep.pysleeplogging import configure_logging
+from pysleep.utils import convert_to_binary, log, check_correct_run_dir
+
+
+def main():
+    # Parse command line arguments
+    description = 'Converts .slp.csv logfiles into compact, memory-mappable .slp.bin session files'
+    parser = argparse.ArgumentParser(prog='python convert-logfile.py',
+                                     description=description)
+    parser.add_argument('file',
+                        help='.slp.csv logfile to convert. The .slp.bin file is written next to it.',
+                        nargs='+')
+    args = parser.parse_args()
+    configure_logging()
+
+    # Check user is in the right directory
+    check_correct_run_dir()
+
+    for file in args.file:
+        log.info("Converting %s..." % file)
+        binary_filename = convert_to_binary(file)
+        log.info("Converted %s to %s" % (file, binary_filename))
+
+
+if __name__ == "__main__":
+    main()
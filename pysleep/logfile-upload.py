@@ -1,19 +1,18 @@
 __author__ = 'dano'
-import os
-from socket import error as socket_error
-from ftplib import FTP, error_perm as permission_error
-import glob
+import argparse
 
-from pysleep.pysleeplogging import log
+from pysleep.pysleeplogging import configure_logging
+from pysleep.upload import LogfileUploader, load_credentials
 
 
-MIN_SIZE_FOR_UPLOAD = 1000000
-
-def upload_new_logfiles(hostname=None, user=None, password=None):
+def upload_new_logfiles(hostname=None, user=None, password=None, connections=LogfileUploader.CONNECTIONS,
+                        compress=True):
 
     """
     Global function which quickly scans for log files which exist locally, but not on the remote fileserver.
-    Any files which meet the criteria are uploaded, then removed locally.
+    Any files which meet the criteria are uploaded (or finished off, if an earlier upload was cut short),
+    checked against the server's copy, then removed locally. Logfiles are gzipped as they are sent unless `compress`
+    is False, and stored on the server with .gz on the end of their name.
 
     Uploaded files are sent to a remote fileserver via FTP. The credentials and hostnames are gathered in the following
     prioritized order:
@@ -21,82 +20,23 @@ def upload_new_logfiles(hostname=None, user=None, password=None):
     2.) in the file credentials.py
     3.) in the file settings.py
     """
-    if hostname is None:
-        try:
-            from settings import HOSTNAME as hostname
-        except ImportError:
-            try:
-                from default_settings import HOSTNAME as hostname
-            except ImportError:
-                log.warning("No hostname provided in function call, credentials file, or default credentials file")
-                return
-
-    if user is None:
-        try:
-            from settings import USER as user
-        except ImportError:
-            try:
-                from default_settings import USER as user
-            except ImportError:
-                log.warning("No user provided in function call, credentials file, or default credentials file")
-                return
-
-    if password is None:
-        try:
-            from settings import PASSWORD as password
-        except ImportError:
-            try:
-                from default_settings import PASSWORD as password
-            except ImportError:
-                log.warning("No password provided in function call, credentials file, or default credentials file")
-                return
-
-
-    # Setup FTP
-    log.info("Connecting to FTP site")
-    try:
-        ftp = FTP(timeout=5)
-        ftp.connect(hostname)
-        log.info("FTP Connected")
-        ftp.login(user, password)
-        ftp.cwd('logs')
-
-        sleep_logs = glob.glob('./logs/*.slp.csv')
-        log.info("Found local logfiles: %s" % sleep_logs)
-        for sleep_log in sleep_logs:
-            sleep_log_filename = os.path.basename(sleep_log)
-            if os.stat(sleep_log).st_size < MIN_SIZE_FOR_UPLOAD:
-                log.info("Skipping %s: sleeplog is < %s bytes " % (sleep_log_filename, MIN_SIZE_FOR_UPLOAD))
-                continue
-
-            # Check if file is already on the server
-            files_on_server = []
-            ftp.retrlines('LIST %s' % sleep_log_filename, files_on_server.append)
-            if files_on_server:
-                log.info("Skipping %s: sleeplog is already on server" % sleep_log_filename, MIN_SIZE_FOR_UPLOAD)
-                continue
-
-            # If not, upload it
-            log.info("Uploading %s" % sleep_log_filename)
-            opened_sleep_log = open(sleep_log)
-            transfer_cmd = 'STOR %s' % sleep_log_filename
-            upload_result = ftp.storbinary(transfer_cmd, opened_sleep_log)
-            if upload_result == '226 Transfer complete.':
-                # Successful upload. remove the logfile
-                log.info("Upload successful")
-                os.remove(sleep_log)
-            else:
-                log.warning("Upload unsuccessful")
-
-        ftp.close()
-        log.info("FTP closed")
-    except socket_error:
-        log.warning("FTP Connection refused")
-    except permission_error:
-        log.warning("FTP invalid credentials")
-    except Exception as e:
-        log.error("Unknown ftp error encountered: %s" % e)
+    credentials = load_credentials(hostname, user, password)
+    if credentials is None:
+        return
+    LogfileUploader(*credentials, connections=connections, compress=compress).upload_all()
 
 
 if __name__ == '__main__':
-    upload_new_logfiles()
+    parser = argparse.ArgumentParser(prog='python logfile-upload.py',
+                                     description='Uploads finished logfiles to the fileserver, then removes them')
+    parser.add_argument('-c', '--connections',
+                        type=int,
+                        default=LogfileUploader.CONNECTIONS,
+                        help='most logfiles to upload at once (default: %d)' % LogfileUploader.CONNECTIONS)
+
+    parser.add_argument('--no-compress',
+                        action='store_true',
+                        help="send logfiles as they are, rather than gzipping them on the way")
+    args = parser.parse_args()
+    configure_logging()
+    upload_new_logfiles(connections=args.connections, compress=not args.no_compress)
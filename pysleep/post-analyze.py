@@ -8,8 +8,22 @@ Use Case: Analyzing data from logfile (after-the-fact analysis)
   - after-the-fact analysis
 """
 import argparse
-from pysleep.utils import SleepFile, log, check_correct_run_dir
-from pysleep.graphs import GraphWithAnalyzer
+import os
+from pysleep.pysleeplogging import configure_logging
+from pysleep.utils import SleepEntry, open_sleep_file, timestamp_from_strings, log, check_correct_run_dir
+from pysleep.report import summarize_files, write_report
+from pysleep.render import PostSessionReport, IMAGE_FORMATS
+from pysleep.staging import EPOCH_SECONDS, WAKE_THRESHOLD
+from pysleep.analyzers import AnalyzerPipeline, ANALYZER_STAGES, analyzer_names
+
+
+def session_time(value):
+    """Converts a command line time in MM-DD-YYYY_HH-MM-SS format into a timestamp"""
+    try:
+        date, time = value.split('_')
+        return timestamp_from_strings(date, time)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a time like 03-06-2015_02-30-00, not: %s" % value)
 
 
 def main():
@@ -25,27 +39,125 @@ def main():
                         type=int,
                         help='if provided, will print every entry where sum of last n entires > x to stdout')
 
+    parser.add_argument('--streaming',
+                        action='store_true',
+                        help='analyze one entry at a time, as realtime analysis would, instead of the whole file at once')
+
+    parser.add_argument('--epoch-seconds',
+                        type=int,
+                        default=EPOCH_SECONDS,
+                        help='length of the epochs the session is scored into asleep or awake (default: %d)' %
+                             EPOCH_SECONDS)
+
+    parser.add_argument('--wake-threshold',
+                        type=int,
+                        default=WAKE_THRESHOLD,
+                        help='weighted sum of epoch movement at which an epoch is scored awake; see the README for '
+                             'calibrating it (default: %d)' % WAKE_THRESHOLD)
+
+    parser.add_argument('-a', '--analyzers',
+                        type=analyzer_names,
+                        help='only run these comma separated analysis stages, logging their results and how long '
+                             'each took instead of showing graphs, from: %s' % ', '.join(sorted(ANALYZER_STAGES)))
+
+    parser.add_argument('--start',
+                        type=session_time,
+                        help='only analyze entries from this time on (MM-DD-YYYY_HH-MM-SS)')
+
+    parser.add_argument('--end',
+                        type=session_time,
+                        help='only analyze entries from before this time (MM-DD-YYYY_HH-MM-SS)')
+
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        help='analyze the files in parallel across this many processes (0 for one per CPU), '
+                             'writing a combined report instead of showing graphs')
+
+    parser.add_argument('--report',
+                        default='analysis-report.csv',
+                        help='where to write the combined report when using --jobs (default: analysis-report.csv)')
+
+    parser.add_argument('-o', '--output-dir',
+                        help='save each session\'s graphs as an image in this directory instead of showing them '
+                             '(works without a display)')
+
+    parser.add_argument('--format',
+                        choices=IMAGE_FORMATS,
+                        default='png',
+                        help='image format for --output-dir (default: png)')
+
     parser.add_argument('file',
-                        help='target sleepfile to perform analysis on',
+                        help='target sleepfile (.slp.csv or .slp.bin) to perform analysis on',
                         nargs='+')
     args = parser.parse_args()
+    configure_logging()
 
     # Check user is in the right directory
     check_correct_run_dir()
 
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.jobs is not None:
+        log.info("Processing %d files across %s processes..." % (len(args.file), args.jobs or 'all'))
+        summaries = summarize_files(args.file,
+                                    jobs=args.jobs,
+                                    min_movement_value=args.minimum_value,
+                                    min_movement_sum=args.minimum_sum,
+                                    start=args.start,
+                                    end=args.end,
+                                    output_dir=args.output_dir,
+                                    image_format=args.format,
+                                    epoch_seconds=args.epoch_seconds,
+                                    wake_threshold=args.wake_threshold)
+        write_report(summaries, args.report)
+        return
+
+    if args.analyzers:
+        graphs_class = AnalyzerPipeline
+        graphs_kwargs = {'stage_names': args.analyzers}
+    elif args.output_dir:
+        graphs_class = PostSessionReport
+        graphs_kwargs = {'output_dir': args.output_dir, 'image_format': args.format}
+    else:
+        # Only import pyplot when the graphs are going to be shown in a window
+        from pysleep.graphs import GraphWithAnalyzer
+        graphs_class = GraphWithAnalyzer
+        graphs_kwargs = {}
+
     for file in args.file:
         log.info("Processing %s..." % file)
-        sleep_file = SleepFile(file)
-        graph_with_analyzer = GraphWithAnalyzer(min_movement_value=args.minimum_value,
-                                                min_movement_sum=args.minimum_sum,
-                                                session_id=file)
+        sleep_file = open_sleep_file(file)
+        graph_with_analyzer = graphs_class(min_movement_value=args.minimum_value,
+                                           min_movement_sum=args.minimum_sum,
+                                           session_id=file,
+                                           epoch_seconds=args.epoch_seconds,
+                                           wake_threshold=args.wake_threshold,
+                                           **graphs_kwargs)
 
-        for sleep_entry in sleep_file.sleep_entries():
-            graph_with_analyzer.add_entry(sleep_entry)
+        if args.start is not None or args.end is not None:
+            # Only part of the file is wanted. Seek straight to it (using the file's session index)
+            indexes, timestamps, movement_values = sleep_file.slice_time(args.start, args.end)
+            if args.streaming:
+                for index, timestamp, movement_value in zip(indexes.tolist(), timestamps.tolist(),
+                                                            movement_values.tolist()):
+                    graph_with_analyzer.add_entry(SleepEntry(index, movement_value, timestamp=timestamp))
+            else:
+                graph_with_analyzer.analyze_array(movement_values, timestamps, indexes)
+        elif args.streaming:
+            for sleep_entry in sleep_file.sleep_entries():
+                graph_with_analyzer.add_entry(sleep_entry)
 
-            # This call will flush the stdout, so if you are experimenting with
-            # outputting data to stdout during processing, comment this out as it may interfere
-            sleep_file.show_progress()
+                # This call will flush the stdout, so if you are experimenting with
+                # outputting data to stdout during processing, comment this out as it may interfere
+                sleep_file.show_progress()
+        else:
+            # The whole file is available up front, so read and analyze it a large chunk at a time
+            for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays():
+                graph_with_analyzer.analyze_array(movement_values, timestamps, indexes)
+                sleep_file.show_progress()
+            if sleep_file.malformed_lines:
+                log.warning("Skipped %d malformed lines in %s" % (len(sleep_file.malformed_lines), file))
         graph_with_analyzer.show()
 
     # Run post-load analysis
@@ -0,0 +1,469 @@
+"""
+Analysis built out of independent stages. Each stage declares the shared rolling windows and the other stages it
+needs. AnalyzerPipeline only runs the stages asked for (and what they need), keeps each shared window once however
+many stages read it, and times every stage and window. SleepAnalyzer runs every stage; entry points which only need
+a few of them (see --analyzers) run a pipeline of just those.
+
+Usage:
+    analysis = AnalyzerPipeline(['movement-sums', 'staging'])
+    analysis.add_entry(sleep_entry)
+    analysis.show()
+"""
+import argparse
+import time
+import numpy
+from pysleeplogging import log
+from capture import SleepEntry
+from columns import sleep_entry_columns, session_span
+from rolling import RollingWindow, RollingSlope, rolling_sums, rolling_slopes, deteriorating_sums, entry_series
+from staging import SleepStager, EPOCH_SECONDS, WAKE_THRESHOLD, AWAKE, ASLEEP
+from episodes import EpisodeIndex
+from histogram import MovementHistogram
+
+ANALYZER_STAGES = {}
+"""Every stage class, by name"""
+
+SHARED_WINDOWS = {}
+"""Every shared window class, by name"""
+
+MOVEMENT_HISTORY_SIZE = 1000
+"""Default number of sleepentries to use for the short-term movement analysis"""
+
+SLOPE_HISTORY_SIZE = 50
+"""Default number of deteriorating movement sums to fit a line through for their slope"""
+
+
+def analyzer_stage(stage_class):
+    """Class decorator adding an AnalyzerStage to ANALYZER_STAGES"""
+    ANALYZER_STAGES[stage_class.name] = stage_class
+    return stage_class
+
+
+def shared_window(window_class):
+    """Class decorator adding a SharedWindow to SHARED_WINDOWS"""
+    SHARED_WINDOWS[window_class.name] = window_class
+    return window_class
+
+
+class SharedWindow(object):
+    """
+    Rolling state that more than one stage reads. It is updated with each entry before any stage sees the entry.
+    For a batch of entries (see AnalyzerPipeline.analyze_array) it is updated after every stage has seen the batch,
+    so stages can work out each entry's value from what the window held before the batch.
+    """
+    name = None
+
+    def __init__(self, **options):
+        pass
+
+    def add_entry(self, sleep_entry):
+        """Updates the window with one entry. Does nothing unless overridden."""
+        pass
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        """Updates the window with a batch of entries. Does nothing unless overridden."""
+        pass
+
+
+@shared_window
+class MovementWindow(SharedWindow):
+    """The last movement_history_size movement values, with running aggregates (see RollingWindow)"""
+    name = 'movement-window'
+
+    def __init__(self, movement_history_size=MOVEMENT_HISTORY_SIZE, **options):
+        super(MovementWindow, self).__init__(**options)
+        self.window = RollingWindow(movement_history_size)
+
+    def add_entry(self, sleep_entry):
+        self.window.push(sleep_entry.movement_value)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        for movement_value in movement_values[-self.window.size:].tolist():
+            self.window.push(movement_value)
+
+
+class AnalyzerStage(object):
+    """
+    One independent piece of analysis. Subclasses set `name` (as used on the command line), list what they need in
+    `windows` and `after`, and override add_entry. Stages which also override add_arrays (and set `batch`) can
+    analyze a whole batch of entries at once.
+    """
+    name = None
+
+    windows = ()
+    """Names of the shared windows this stage reads (see SHARED_WINDOWS)"""
+
+    after = ()
+    """Names of the stages this stage reads, which have to see each entry first"""
+
+    batch = False
+    """True if add_arrays is implemented"""
+
+    def __init__(self, pipeline, **options):
+        """
+        :param pipeline: the AnalyzerPipeline, for looking up windows and other stages
+        :param options: the pipeline's options (e.g. min_movement_value, retain_entries). Stages ignore the ones
+                        they don't use.
+        """
+        self.pipeline = pipeline
+
+    def add_entry(self, sleep_entry):
+        """Analyzes one entry. Does nothing unless overridden."""
+        pass
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        """Analyzes a batch of entries. Only called if `batch` is True. Does nothing unless overridden."""
+        pass
+
+    def finish(self):
+        """Called once the session is over"""
+        pass
+
+    def summary(self):
+        """:return: dict of summary statistics (see SleepAnalyzer.summary for the names)"""
+        return {}
+
+
+@analyzer_stage
+class StoreStage(AnalyzerStage):
+    """Keeps every entry, or the last retain_entries of them (see SleepEntryColumns and SleepEntryRing)"""
+    name = 'store'
+    batch = True
+
+    def __init__(self, pipeline, retain_entries=None, **options):
+        super(StoreStage, self).__init__(pipeline, **options)
+        self.retain_entries = retain_entries
+        self.sleep_entries = sleep_entry_columns(retain_entries)
+
+    def add_entry(self, sleep_entry):
+        self.sleep_entries.append(sleep_entry)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.sleep_entries.extend(indexes, timestamps, movement_values)
+
+    def finish(self):
+        if self.retain_entries is not None:
+            self.sleep_entries.flush()
+
+    def summary(self):
+        return session_span(self.sleep_entries)
+
+
+@analyzer_stage
+class MaxStage(AnalyzerStage):
+    """Largest movement value"""
+    name = 'max'
+    batch = True
+
+    def __init__(self, pipeline, **options):
+        super(MaxStage, self).__init__(pipeline, **options)
+        self.max_value = 0
+
+    def add_entry(self, sleep_entry):
+        if sleep_entry.movement_value > self.max_value:
+            self.max_value = sleep_entry.movement_value
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.max_value = max(self.max_value, movement_values.max().item())
+
+    def summary(self):
+        return {'max': self.max_value}
+
+
+@analyzer_stage
+class HistogramStage(AnalyzerStage):
+    """Mode, mean, variance and percentiles of the movement values (see MovementHistogram)"""
+    name = 'histogram'
+    batch = True
+
+    def __init__(self, pipeline, **options):
+        super(HistogramStage, self).__init__(pipeline, **options)
+        self.histogram = MovementHistogram()
+
+    def add_entry(self, sleep_entry):
+        self.histogram.add(sleep_entry.movement_value)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.histogram.add_array(movement_values)
+
+    def summary(self):
+        return {'mode': self.histogram.mode, 'mean': self.histogram.mean, 'variance': self.histogram.variance,
+                'median': self.histogram.median, 'p95': self.histogram.percentile(95)}
+
+
+@analyzer_stage
+class BigMovementsStage(AnalyzerStage):
+    """Runs of entries with movement values over min_movement_value (see EpisodeIndex)"""
+    name = 'big-movements'
+    batch = True
+
+    def __init__(self, pipeline, min_movement_value=0, **options):
+        super(BigMovementsStage, self).__init__(pipeline, **options)
+        self.movement_episodes = EpisodeIndex(min_movement_value)
+
+    def add_entry(self, sleep_entry):
+        self.movement_episodes.add(sleep_entry.index, sleep_entry.timestamp, sleep_entry.movement_value)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.movement_episodes.add_arrays(indexes, timestamps, movement_values)
+
+    def summary(self):
+        return {'big_movements': self.movement_episodes.num_entries,
+                'movement_episodes': len(self.movement_episodes)}
+
+
+@analyzer_stage
+class MovementSumsStage(AnalyzerStage):
+    """Sum of the last movement_history_size movement values, for every entry"""
+    name = 'movement-sums'
+    windows = ('movement-window',)
+    batch = True
+
+    def __init__(self, pipeline, retain_entries=None, **options):
+        super(MovementSumsStage, self).__init__(pipeline, **options)
+        self.window = pipeline.windows['movement-window'].window
+        self.movement_sums = entry_series(retain_entries)
+        self.num_movement_sums = 0
+        self.movement_sum_total = 0
+        self.movement_sum_max = 0
+
+    def add_entry(self, sleep_entry):
+        movement_sum = self.window.sum
+        self.movement_sums.append(movement_sum)
+        self.num_movement_sums += 1
+        self.movement_sum_total += movement_sum
+        if movement_sum > self.movement_sum_max:
+            self.movement_sum_max = movement_sum
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        movement_sums = rolling_sums(movement_values, self.window.size, self.window.values)
+        self.movement_sums.extend(movement_sums.tolist())
+        self.num_movement_sums += len(movement_sums)
+        self.movement_sum_total += int(movement_sums.sum())
+        self.movement_sum_max = max(self.movement_sum_max, movement_sums.max().item())
+
+    def summary(self):
+        if not self.num_movement_sums:
+            return {}
+        return {'movement_sum_mean': float(self.movement_sum_total) / self.num_movement_sums,
+                'movement_sum_max': self.movement_sum_max}
+
+
+@analyzer_stage
+class DeterioratingSumsStage(AnalyzerStage):
+    """Running sum of the movement values which loses 1 per entry, and never goes below 0"""
+    name = 'deteriorating-sums'
+    batch = True
+
+    def __init__(self, pipeline, retain_entries=None, **options):
+        super(DeterioratingSumsStage, self).__init__(pipeline, **options)
+        self.deteriorating_movement_sums = entry_series(retain_entries, [0, 0])
+        self.deteriorating_movement_sum_max = 0
+
+        self.batch_sums = None
+        """numpy array of the sums for the last batch of entries (see add_arrays)"""
+
+    def add_entry(self, sleep_entry):
+        deteriorating_movement_sum = max(0, self.deteriorating_movement_sums[-1] + sleep_entry.movement_value - 1)
+        self.deteriorating_movement_sums.append(deteriorating_movement_sum)
+        if deteriorating_movement_sum > self.deteriorating_movement_sum_max:
+            self.deteriorating_movement_sum_max = deteriorating_movement_sum
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.batch_sums = deteriorating_sums(movement_values, self.deteriorating_movement_sums[-1])
+        self.deteriorating_movement_sums.extend(self.batch_sums.tolist())
+        self.deteriorating_movement_sum_max = max(self.deteriorating_movement_sum_max, self.batch_sums.max().item())
+
+    def summary(self):
+        return {'deteriorating_movement_sum_max': self.deteriorating_movement_sum_max}
+
+
+@analyzer_stage
+class DeterioratingSlopeStage(AnalyzerStage):
+    """Slope of the last slope_history_size deteriorating movement sums, for every entry"""
+    name = 'deteriorating-slope'
+    after = ('deteriorating-sums',)
+    batch = True
+
+    def __init__(self, pipeline, retain_entries=None, slope_history_size=SLOPE_HISTORY_SIZE, **options):
+        super(DeterioratingSlopeStage, self).__init__(pipeline, **options)
+        self.sums_stage = pipeline.stages['deteriorating-sums']
+        self.sums = self.sums_stage.deteriorating_movement_sums
+        self.slope = RollingSlope(slope_history_size)
+        for deteriorating_movement_sum in self.sums:
+            self.slope.push(deteriorating_movement_sum)
+        self.deteriorating_movement_sum_coefficients = entry_series(retain_entries, [0, 0])
+
+    def add_entry(self, sleep_entry):
+        self.slope.push(self.sums[-1])
+        self.deteriorating_movement_sum_coefficients.append(self.slope.slope)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        # deteriorating-sums has already worked out this batch's sums
+        sums = self.sums_stage.batch_sums
+        self.deteriorating_movement_sum_coefficients.extend(
+            rolling_slopes(sums, self.slope.size, self.slope.values).tolist())
+        for deteriorating_movement_sum in sums[-self.slope.size:].tolist():
+            self.slope.push(deteriorating_movement_sum)
+
+
+@analyzer_stage
+class StagingStage(AnalyzerStage):
+    """Sleep/wake scoring of epoch_seconds epochs (see SleepStager)"""
+    name = 'staging'
+    batch = True
+
+    def __init__(self, pipeline, epoch_seconds=EPOCH_SECONDS, wake_threshold=WAKE_THRESHOLD, **options):
+        super(StagingStage, self).__init__(pipeline, **options)
+        self.stager = SleepStager(epoch_seconds, wake_threshold=wake_threshold)
+
+    def add_entry(self, sleep_entry):
+        self.stager.add_reading(sleep_entry.timestamp, sleep_entry.movement_value)
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        self.stager.add_arrays(timestamps, movement_values)
+
+    def finish(self):
+        self.stager.finish()
+
+    def summary(self):
+        return {'asleep_minutes': self.stager.minutes_in(ASLEEP),
+                'awake_minutes': self.stager.minutes_in(AWAKE),
+                'phase_changes': max(0, len(self.stager.transitions) - 1)}
+
+
+def resolve_stages(names):
+    """
+    :param names: names of the stages wanted
+    :return: names of those stages and every stage they need, each after the stages it needs
+    :raises ValueError: for a name that isn't in ANALYZER_STAGES
+    """
+    resolved = []
+
+    def add(name):
+        if name not in ANALYZER_STAGES:
+            raise ValueError("Unknown analyzer: %s (choose from %s)" % (name, ', '.join(sorted(ANALYZER_STAGES))))
+        if name in resolved:
+            return
+        for dependency in ANALYZER_STAGES[name].after:
+            add(dependency)
+        resolved.append(name)
+
+    for name in names:
+        add(name)
+    return resolved
+
+
+def analyzer_names(value):
+    """argparse type for a comma separated list of analyzer stages, e.g. --analyzers movement-sums,staging"""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    try:
+        resolve_stages(names)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return names
+
+
+class AnalyzerPipeline(object):
+    """
+    Runs the analyzer stages asked for (plus any they need) on each entry, and the shared windows they read.
+    Nothing else is worked out, so a stage nobody asked for costs nothing.
+    """
+    def __init__(self, stage_names, session_id=None, timed=True, **options):
+        """
+        :param stage_names: names of the stages wanted (see ANALYZER_STAGES)
+        :param timed: time every window and stage (see timings). Timing costs a little per entry and step.
+        :param options: passed on to every stage, e.g. min_movement_value, epoch_seconds, wake_threshold, and retain_entries to only
+                        keep the last that many entries and per-entry results in memory (the summary still covers
+                        every entry)
+        """
+        self.session_id = session_id
+        names = resolve_stages(stage_names)
+
+        self.windows = {}
+        """Shared windows, by name, that at least one stage reads"""
+        for name in names:
+            for window_name in ANALYZER_STAGES[name].windows:
+                if window_name not in self.windows:
+                    self.windows[window_name] = SHARED_WINDOWS[window_name](**options)
+
+        self.stages = {}
+        """Stages, by name"""
+
+        self.stage_order = names
+        """Names of the stages, in the order they see each entry"""
+        for name in names:
+            self.stages[name] = ANALYZER_STAGES[name](self, **options)
+        self._steps = [(name, window) for name, window in sorted(self.windows.items())] + \
+                      [(name, self.stages[name]) for name in names]
+        # Stages first in a batch, so they can see what the windows held before it
+        self._batch_steps = [(name, self.stages[name]) for name in names] + \
+                            [(name, window) for name, window in sorted(self.windows.items())]
+
+        self.timed = timed
+
+        self.seconds = dict((name, 0.0) for name, _ in self._steps)
+        """Total time spent in each window and stage, if timed"""
+
+        self.num_entries = 0
+
+    def add_entry(self, sleep_entry):
+        if self.timed:
+            for name, step in self._steps:
+                started = time.time()
+                step.add_entry(sleep_entry)
+                self.seconds[name] += time.time() - started
+        else:
+            for name, step in self._steps:
+                step.add_entry(sleep_entry)
+        self.num_entries += 1
+
+    def analyze_array(self, movement_values, timestamps, indexes=None):
+        """
+        Batch version of add_entry (see SleepAnalyzer.analyze_array). If any stage can't take a batch at once,
+        the entries are passed through one at a time instead.
+        """
+        movement_values = numpy.asarray(movement_values, dtype=numpy.int64)
+        if indexes is None:
+            indexes = numpy.arange(self.num_entries, self.num_entries + len(movement_values))
+        if not all(stage.batch for stage in self.stages.values()):
+            for index, timestamp, movement_value in zip(indexes, timestamps, movement_values):
+                self.add_entry(SleepEntry(int(index), int(movement_value), timestamp=float(timestamp)))
+            return
+        if not len(movement_values):
+            return
+
+        if self.timed:
+            for name, step in self._batch_steps:
+                started = time.time()
+                step.add_arrays(indexes, timestamps, movement_values)
+                self.seconds[name] += time.time() - started
+        else:
+            for name, step in self._batch_steps:
+                step.add_arrays(indexes, timestamps, movement_values)
+        self.num_entries += len(movement_values)
+
+    def summary(self):
+        """
+        Every stage's summary statistics in one dict. The session is taken to be over (see AnalyzerStage.finish).
+        """
+        summary = {'session_id': self.session_id, 'entries': self.num_entries}
+        for name in self.stage_order:
+            self.stages[name].finish()
+            summary.update(self.stages[name].summary())
+        return summary
+
+    def timings(self):
+        """:return: list of (window or stage name, total seconds, microseconds per entry), slowest first"""
+        return sorted(((name, seconds, seconds / max(1, self.num_entries) * 1e6)
+                       for name, seconds in self.seconds.items()), key=lambda timing: -timing[1])
+
+    def show(self):
+        """Logs every stage's summary statistics, and how long each stage took"""
+        for name, value in sorted(self.summary().items()):
+            log.info("%s: %s" % (name, value))
+        if not self.timed:
+            return
+        log.info("Time per stage over %d entries:" % self.num_entries)
+        for name, seconds, microseconds in self.timings():
+            log.info("  %s: %.3f s (%.2f us per entry)" % (name, seconds, microseconds))
@@ -0,0 +1,915 @@
+"""
+Everything sleep-logger.py needs to log a session: reading from the Teensy, writing logfiles, and the date and time
+helpers they share. Only the standard library and pyserial are imported here (not numpy or the analysis modules),
+so the logger is reading from the Teensy as soon as possible after it starts. utils.py imports all of it too.
+"""
+import sys
+import glob
+import os
+import math
+import csv
+import calendar
+import time
+import datetime
+import re
+import threading
+import serial
+try:
+    from serial.tools import list_ports
+except ImportError:
+    # Very old versions of pyserial. Every serial port is probed instead.
+    list_ports = None
+from pysleeplogging import log, ReadingLog
+from segments import SEGMENT_PATTERN, segment_filename, session_name_for, session_segments, compress_segment
+
+LIGHT_FILE = '/sys/class/leds/led0/brightness'
+
+class SleepEntry(object):
+    """
+    A simple storage container for the sleep data.
+    Will use current date and time if either is not provided
+
+    The date and time are kept as a single timestamp (see timestamp_from_strings). The date and time strings are
+    only worked out if they're asked for (e.g. when the entry is written to a logfile), and then kept.
+    __slots__ keeps each SleepEntry small, since a session can have hundreds of thousands of them.
+    """
+    __slots__ = ('index', 'movement_value', '_timestamp', '_date', '_time')
+
+    def __init__(self, index, movement_value, date=None, time=None, timestamp=None):
+        if timestamp is None and (date is None or time is None):
+            if date is None and time is None:
+                timestamp = current_timestamp()
+            elif date is None:
+                date = get_date_string()
+            else:
+                time = get_time_string()
+
+        self.index = index
+        """Integer index representing which reading this was starting from 0"""
+
+        self.movement_value = movement_value
+        """Integer > 0 representing how much movement was recorded by the accelerometer"""
+
+        self._timestamp = timestamp
+        self._date = date
+        self._time = time
+
+    @staticmethod
+    def copy(sleep_entry, index=None, movement_value=None, date=None, time=None):
+        """
+        Constructor that returns a copy of the passed in sleep_entry, but with fields replaced
+        with the input arguments.
+
+        USAGE:
+        original_entry = SleepEntry(index=0, movement_value=1)
+        copy_entry = SleepEntry.copy(original_entry, movement_value=1000)
+
+        RESULTS:
+        print original_entry
+        > "03-06-2015,18-22-09,0,1"
+        print copy_entry
+        > "03-06-2015,18-22-09,0,1000"
+        """
+        assert type(sleep_entry) == SleepEntry, "first argument must be a SleepEntry"
+        if date is None and time is None:
+            # Keep the same timestamp, without working out the date and time strings
+            return SleepEntry(index=index or sleep_entry.index,
+                              movement_value=movement_value or sleep_entry.movement_value,
+                              date=sleep_entry._date,
+                              time=sleep_entry._time,
+                              timestamp=sleep_entry._timestamp)
+        return SleepEntry(index=index or sleep_entry.index,
+                          movement_value=movement_value or sleep_entry.movement_value,
+                          date=date or sleep_entry.date,
+                          time=time or sleep_entry.time)
+
+    @property
+    def timestamp(self):
+        """
+        The date and time of this sleep_entry as a number of seconds (see timestamp_from_strings).
+        Unlike self.datetime, timestamps can be stored in and compared as plain numbers.
+        """
+        if self._timestamp is None:
+            self._timestamp = timestamp_from_strings(self._date, self._time)
+        return self._timestamp
+
+    @property
+    def date(self):
+        """String representing the date the sleep_entry was taken, in MM-DD-YYYY format.
+        Note: since most sleep tracking is done overnight (duh), the logfile will usually have 2 days
+        of date strings."""
+        if self._date is None:
+            self._date, self._time = strings_from_timestamp(self._timestamp)
+        return self._date
+
+    @property
+    def time(self):
+        """String representing the time the sleep_entry was taken in HH-MM-SS format (24 hour clock)"""
+        if self._time is None:
+            self._date, self._time = strings_from_timestamp(self._timestamp)
+        return self._time
+
+    @property
+    def datetime(self):
+        """
+        Combines the stored date and time of this sleep_entry into a datetime object.
+        Comparing sleep entries directly (or their timestamps) is quicker, if that's all that's needed.
+
+        USAGE:
+        if sleep_entry1.datetime < sleep_entry2.datetime:
+            print 'sleep_entry1 happened before sleep_entry2'
+        """
+        return EPOCH + datetime.timedelta(seconds=self.timestamp)
+
+    def __lt__(self, other):
+        """
+        Sleep entries are ordered by when they were taken: sleep_entry1 < sleep_entry2. Entries taken at the same
+        time are equal, and hash the same, whatever their index and movement value.
+        """
+        return self.timestamp < other.timestamp
+
+    def __le__(self, other):
+        return self.timestamp <= other.timestamp
+
+    def __gt__(self, other):
+        return self.timestamp > other.timestamp
+
+    def __ge__(self, other):
+        return self.timestamp >= other.timestamp
+
+    def __eq__(self, other):
+        if not isinstance(other, SleepEntry):
+            return NotImplemented
+        return self.timestamp == other.timestamp
+
+    def __ne__(self, other):
+        if not isinstance(other, SleepEntry):
+            return NotImplemented
+        return self.timestamp != other.timestamp
+
+    def __hash__(self):
+        return hash(self.timestamp)
+
+    def __sub__(self, other):
+        """Number of seconds between two sleep entries: sleep_entry2 - sleep_entry1"""
+        return self.timestamp - other.timestamp
+
+    @staticmethod
+    def header_names():
+        """
+        Prints the currently supported headers for a correctly formatted CSV logfile.
+        This isn't used much besides for debugging, and for ensuring that logfiles read in
+        have the same csv header as this expected one.
+        """
+        return ['Date', 'Time', 'Index', 'Movement Value']
+
+    def __str__(self):
+        """
+        Override the string method so printing a sleep_entry looks pretty click
+        """
+        return "%s,%s,%s,%s" % (self.date, self.time, self.index, self.movement_value)
+
+
+class SleepReader(object):
+    """
+    Base class for input devices. Subclasses should implement the get_next_sleep_entry method, and is_ready.
+    All methods should call parent to keep sleep index updated.
+    """
+    def __init__(self, **kwargs):
+        self.next_available_index = 0
+
+    def sleep_entries(self):
+        self.next_available_index += 1
+        return
+
+    def show_progress(self):
+        pass
+
+
+class Teensy(SleepReader):
+    PROBE_TIMEOUT = 1
+    """Seconds to wait for a port which can't be identified as a Teensy to send something"""
+
+    MIN_RETRY_DELAY = 0.5
+    """Seconds to wait before looking again when no Teensy is found. Doubles with each try, up to MAX_RETRY_DELAY."""
+
+    MAX_RETRY_DELAY = 8
+
+    last_port = None
+    """Port the Teensy was last found on. It is tried first next time (e.g. when the Teensy is plugged back in)."""
+
+    def __init__(self, **kwargs):
+        super(Teensy, self).__init__(**kwargs)
+        self.teensy = None
+        """Serial object"""
+
+        self._silent_ports = set()
+        """Ports which have already been probed and sent nothing. They aren't probed again until they reappear."""
+
+        self.reading_log = ReadingLog()
+        """Logs a summary of the readings every minute, rather than every reading"""
+
+        log.info("Searching for USB device")
+        retry_delay = self.MIN_RETRY_DELAY
+        while self.teensy is None:
+            self.teensy = self._get_teensy_usb()
+            if self.teensy is None:
+                # Nothing found. Back off rather than spinning through the ports.
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.MAX_RETRY_DELAY)
+
+    def _get_teensy_usb(self):
+        """Searches, opens, and returns a serial port object connected to the Teensy.
+
+        Ports with the Teensy's USB vendor ID are opened straight away. Failing that, any other serial port
+        which hasn't been probed already is probed, all at once, for up to PROBE_TIMEOUT seconds.
+
+        :raises EnvironmentError:
+            On unsupported or unknown platforms
+        :returns:
+            An initialized serial object (hopefully) connected to the Teensy, or None
+        """
+        teensy_ports, other_ports = find_teensy_ports()
+
+        for port in teensy_ports + other_ports:
+            log.debug("Found available port: %s" % port)
+
+        # Method 1: Match via USB vendor ID
+        for port in sorted(teensy_ports, key=lambda port: port != Teensy.last_port):
+            try:
+                teensy = serial.Serial(port=port, timeout=1)
+                log.info("Using %s" % port)
+                Teensy.last_port = port
+                return teensy
+            except (OSError, serial.SerialException) as e:
+                log.debug("Unable to open %s: %s" % (port, e))
+
+        # Method 2: Match via ready-to-read serial ports
+        self._silent_ports &= set(other_ports)
+        ports = [port for port in other_ports if port not in self._silent_ports]
+        teensy = self._probe(sorted(ports, key=lambda port: port != Teensy.last_port))
+        if teensy is not None:
+            log.info("Using %s" % teensy.port)
+            Teensy.last_port = teensy.port
+        return teensy
+
+    def _probe(self, ports):
+        """
+        Opens every port at once, and waits up to PROBE_TIMEOUT seconds for each to send something.
+        A port still being probed after that (e.g. stuck opening or reading) is given up on: its port is closed, it
+        isn't probed again until it reappears, and anything it sends afterwards is ignored.
+
+        :return: serial object for the first port (in the order given) which sent something, or None
+        """
+        lock = threading.Lock()
+        # Set once the probe is over. Probes which finish after this are ignored.
+        finished = threading.Event()
+        # Port -> serial object, for every port opened. All but the one returned are closed at the end.
+        opened = {}
+        responses = {}
+        silent = set()
+
+        def probe(port):
+            log.debug("Checking: %s" % port)
+            try:
+                teensy = serial.Serial(port=port, timeout=self.PROBE_TIMEOUT)
+                with lock:
+                    if finished.is_set():
+                        teensy.close()
+                        return
+                    opened[port] = teensy
+                if teensy.read(4):
+                    with lock:
+                        if not finished.is_set():
+                            teensy.timeout = 1
+                            responses[port] = teensy
+                    return
+            except (OSError, serial.SerialException):
+                pass
+            with lock:
+                if not finished.is_set():
+                    silent.add(port)
+
+        threads = [threading.Thread(target=probe, args=(port,)) for port in ports]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + self.PROBE_TIMEOUT + 1
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+
+        with lock:
+            finished.set()
+            stragglers = [port for port, thread in zip(ports, threads)
+                          if thread.is_alive() and port not in responses and port not in silent]
+        found = [responses[port] for port in ports if port in responses]
+        teensy = found[0] if found else None
+        for port, serial_port in opened.items():
+            if serial_port is not teensy:
+                serial_port.close()
+        for port in stragglers:
+            log.debug("Gave up probing %s" % port)
+        self._silent_ports |= silent | set(stragglers)
+        return teensy
+
+    def sleep_entries(self):
+        """Gets new data from the provided teensy object (via readline)
+        and converts it into an integer.
+
+        :returns:
+            Integer value representing movement as determined by teensy, or None
+        """
+        super(Teensy, self).sleep_entries()
+
+        try:
+            for line in self.teensy:
+                raw_value = line.strip()
+                assert raw_value is not '', "Teensy returned empty string"
+                movement_value = int(raw_value)
+
+                self.reading_log.add(movement_value)
+                yield SleepEntry(self.next_available_index, movement_value)
+        finally:
+            # Reading stops when a read times out (the Teensy went quiet), fails, or the caller stops. The readings
+            # since the last summary get theirs now, rather than waiting for a reading that isn't coming.
+            self.reading_log.flush()
+
+
+def serial_ports():
+    """Lists the serial ports which might have a Teensy on them.
+
+    :raises EnvironmentError:
+        On unsupported or unknown platforms
+    :returns:
+        List of port names
+    """
+    if sys.platform.startswith('win'):
+        log.debug("Using windows system.")
+        return ['COM' + str(i + 1) for i in range(256)]
+
+    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
+        # this is to exclude your current terminal "/dev/tty"
+        log.debug("Using linux system")
+        return glob.glob('/dev/tty[A-Za-z]*')
+
+    elif sys.platform.startswith('darwin'):
+        log.debug("Using darwin (Apple) system")
+        return glob.glob('/dev/tty.*')
+
+    else:
+        log.error("Unsupported / uncrecognized platform")
+        raise EnvironmentError('Unsupported platform')
+
+
+TEENSY_USB_VENDOR_ID = 0x16C0
+"""USB vendor ID of the Teensy (PJRC's, shared by all Teensy boards)"""
+
+
+def usb_ids(hwid):
+    """
+    :param hwid: hardware description from serial.tools.list_ports, e.g. 'USB VID:PID=16c0:0483 SNR=12345'
+    :return: (vendor id, product id), or None if the port isn't a USB device
+    """
+    match = re.search(r'VID:PID=([0-9A-Fa-f]{4}):([0-9A-Fa-f]{4})', hwid or '')
+    if match is None:
+        return None
+    return int(match.group(1), 16), int(match.group(2), 16)
+
+
+def find_teensy_ports():
+    """Lists serial ports, picking out the ones which are Teensies from their USB vendor ID.
+    Only ports with a device behind them are listed (not every /dev/tty node), unless pyserial is too old to
+    list ports, in which case every port serial_ports finds is listed as a possible Teensy.
+
+    :returns:
+        (list of Teensy ports, list of other serial ports which might be a Teensy)
+    """
+    if list_ports is None:
+        return [], serial_ports()
+
+    teensy_ports = []
+    other_ports = []
+    for port_info in list_ports.comports():
+        port, description, hwid = tuple(port_info)[:3]
+        ids = usb_ids(hwid)
+        if ids is not None and ids[0] == TEENSY_USB_VENDOR_ID:
+            teensy_ports.append(port)
+        else:
+            other_ports.append(port)
+    return sorted(teensy_ports), sorted(other_ports)
+
+
+class SessionIndex(object):
+    """
+    Index of where every INTERVAL-th entry of a .slp.csv logfile starts in the file, by entry index and timestamp.
+    It is kept next to the logfile (as <logfile>.idx), so that SleepFile can jump straight to any time or index
+    of a long logfile without reading everything before it.
+
+    Usage:
+        session_index = SessionIndex.load(SessionIndex.filename_for('logs/session.slp.csv'))
+        session_index.add(index, timestamp, offset, line_number)
+    """
+    INTERVAL = 1000
+    """Number of lines between checkpoints"""
+
+    def __init__(self):
+        self.indexes = []
+        self.timestamps = []
+        self.offsets = []
+        """Byte offset of the start of each checkpoint's line"""
+        self.line_numbers = []
+        """Line number (starting from 1, the header) of each checkpoint's line"""
+
+    def add(self, index, timestamp, offset, line_number):
+        self.indexes.append(index)
+        self.timestamps.append(timestamp)
+        self.offsets.append(offset)
+        self.line_numbers.append(line_number)
+
+    @staticmethod
+    def header_names():
+        return ['Index', 'Timestamp', 'Offset', 'Line']
+
+    @staticmethod
+    def line(index, timestamp, offset, line_number):
+        """:return: the line written to the sidecar index for a checkpoint"""
+        return "%s,%r,%s,%s\r\n" % (index, float(timestamp), offset, line_number)
+
+    @staticmethod
+    def filename_for(logfile_name):
+        return logfile_name + '.idx'
+
+    @classmethod
+    def load(cls, filename, logfile_size):
+        """
+        Reads a sidecar index. Checkpoints past the end of the logfile (e.g. written just before the power went)
+        and anything after a malformed line are ignored.
+
+        :return: a SessionIndex, or None if the file doesn't exist
+        """
+        try:
+            index_file = open(filename, 'r')
+        except IOError:
+            return None
+        session_index = cls()
+        with index_file:
+            index_file.readline()
+            for line in index_file:
+                try:
+                    index, timestamp, offset, line_number = line.strip().split(',')
+                    index, timestamp, offset, line_number = int(index), float(timestamp), int(offset), int(line_number)
+                except ValueError:
+                    break
+                if offset >= logfile_size:
+                    break
+                session_index.add(index, timestamp, offset, line_number)
+        return session_index
+
+    def save(self, filename):
+        try:
+            with open(filename, 'w') as index_file:
+                index_file.write(','.join(self.header_names()) + "\r\n")
+                for checkpoint in zip(self.indexes, self.timestamps, self.offsets, self.line_numbers):
+                    index_file.write(self.line(*checkpoint))
+        except IOError as e:
+            log.warning("Unable to save session index %s: %s" % (filename, e))
+
+
+class OutFile(object):
+    """
+    Writes a session to a .slp.csv logfile (and its session index).
+
+    Entries are collected in memory and written a batch at a time, every `flush_entries` entries or `flush_seconds`
+    seconds, whichever comes first, rather than one SD card write per reading. Each batch is first written to a
+    journal (<logfile>.wal), then to the logfile, so a batch cut short by a power loss can be finished by
+    recover_logfile. At most one batch's worth of readings is lost.
+
+    Long sessions can be rotated: with `rotate_entries` or `rotate_seconds` set, the session is logged as a series of
+    segments (see segments.py), and each finished segment is gzipped on a background thread. SleepFile reads the
+    segments back as one logfile, and the session index covers the whole session.
+
+    Usage:
+        logfile = OutFile()
+        logfile.write_entry(sleep_entry)
+        logfile.close()
+    """
+
+    FLUSH_ENTRIES = 60
+    """Default number of entries to collect before writing them out"""
+
+    FLUSH_SECONDS = 60
+    """Default most seconds an entry waits in memory before being written out"""
+
+    def __init__(self, filename=None, flush_entries=FLUSH_ENTRIES, flush_seconds=FLUSH_SECONDS, fsync=True,
+                 rotate_entries=None, rotate_seconds=None):
+        """
+        Creates the logfile, and writes the header row
+
+        :param filename: defaults to a timestamped file in logs/
+        :param flush_entries: write out once this many entries are waiting
+        :param flush_seconds: write out once the oldest waiting entry is this many seconds old
+        :param fsync: make sure each batch is on disk (not just in the OS's cache) before carrying on
+        :param rotate_entries: start a new segment once the current one has this many entries
+        :param rotate_seconds: start a new segment once the current one is this many seconds old
+        """
+        self.logfile_name = filename or 'logs/%s-%s.slp.csv' % (get_date_string(), get_time_string())
+        """The session's name. When rotating, the entries are in its segments rather than a file of this name."""
+
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+
+        self.rotate_entries = rotate_entries
+        self.rotate_seconds = rotate_seconds
+        self.rotating = bool(rotate_entries or rotate_seconds)
+
+        self.segment_number = 0
+        """Number of the segment being written (counting from 1), or 0 if the session isn't rotated"""
+
+        self.segments = []
+        """Filenames of the segments written so far (gzipped ones under their final name)"""
+
+        self._compressions = []
+        """Threads gzipping finished segments"""
+
+        self._segment_base_offset = 0
+        """Where the current segment's first entry starts in the session as SleepFile reads it"""
+
+        self._open_next_segment()
+
+        self.num_entries_written = 0
+        """Number of entries passed to write_entry (including any not written out yet)"""
+
+        self.flushes = 0
+        """Number of batches written out"""
+
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        """Longest it has taken to write out a batch (including the journal and fsyncs)"""
+
+        self._pending_lines = []
+        self._pending_index_lines = []
+        self._first_pending_time = None
+
+        # Write the session index alongside the logfile, so it doesn't need to be built when the logfile is read
+        index_filename = SessionIndex.filename_for(self.logfile_name)
+        try:
+            self.index_file = open(index_filename, 'a')
+            self.index_file.write(','.join(SessionIndex.header_names()) + "\r\n")
+            self.index_file.flush()
+            self._index_offset = self.index_file.tell()
+        except IOError as e:
+            log.warning("Unable to open session index %s: %s" % (index_filename, e))
+            self.index_file = None
+            self._index_offset = 0
+
+    def _open_next_segment(self):
+        """
+        Opens the file the next entries are written to (and its journal), and writes the header row.
+        Without rotation that's just the logfile.
+        """
+        if self.rotating:
+            self.segment_number += 1
+            self.segment_name = segment_filename(self.logfile_name, self.segment_number)
+            self.segments.append(self.segment_name)
+        else:
+            self.segment_name = self.logfile_name
+        log.info("Logging to %s" % self.segment_name)
+        try:
+            self.logfile = open(self.segment_name, 'a')
+            self.logwriter = csv.writer(self.logfile)
+        except Exception as e:
+            log.error("Unable to open logfile: %s" % e)
+            sys.exit(1)
+        # Write CSV header information
+        self.logwriter.writerow(SleepEntry.header_names())
+        self.logfile.flush()
+        self._offset = self.logfile.tell()
+        """Where the next entry will start in the segment, counting entries which haven't been written out yet"""
+
+        self._header_size = self._offset
+        self.segment_entries = 0
+        self.segment_started = time.time()
+
+        self.journal_name = journal_filename_for(self.segment_name)
+        try:
+            self.journal = open(self.journal_name, 'wb')
+        except IOError as e:
+            log.warning("Unable to open journal %s, a power loss may leave a partial line: %s" % (self.journal_name, e))
+            self.journal = None
+
+    def _close_segment(self):
+        self.flush()
+        self.logfile.close()
+        if self.journal:
+            self.journal.close()
+            os.remove(self.journal_name)
+        if self.rotating:
+            thread = threading.Thread(target=self._compress_segment, args=(len(self.segments) - 1,),
+                                      name="Compress %s" % self.segment_name)
+            thread.daemon = True
+            thread.start()
+            self._compressions.append(thread)
+
+    def _compress_segment(self, position):
+        try:
+            self.segments[position] = compress_segment(self.segments[position])
+        except (IOError, OSError) as e:
+            # Left uncompressed. recover_logfiles tries again next time.
+            log.warning("Unable to compress %s: %s" % (self.segments[position], e))
+
+    def rotate(self):
+        """Finishes the current segment (gzipping it in the background), and starts the next one"""
+        self._close_segment()
+        self._segment_base_offset += self._offset - (self._header_size if self.segment_number > 1 else 0)
+        self._open_next_segment()
+
+    def _rotation_due(self, now):
+        """:return: True if the current segment is full (or old) enough to start the next one"""
+        if not self.rotating or not self.segment_entries:
+            return False
+        return ((self.rotate_entries and self.segment_entries >= self.rotate_entries) or
+                (self.rotate_seconds and now - self.segment_started >= self.rotate_seconds))
+
+    def write_entry(self, sleep_entry):
+        now = time.time()
+        if self._rotation_due(now):
+            # Rotated before the entry rather than after it, so the last segment is never left empty
+            self.rotate()
+
+        if self.index_file and self.num_entries_written % SessionIndex.INTERVAL == 0:
+            # Offsets in the session index are into the whole session, where only the first segment's header counts
+            offset = self._offset if self.segment_number <= 1 else \
+                self._segment_base_offset + self._offset - self._header_size
+            self._pending_index_lines.append(SessionIndex.line(sleep_entry.index, sleep_entry.timestamp,
+                                                               offset, self.num_entries_written + 2))
+        line = str(sleep_entry) + "\r\n"
+        self._pending_lines.append(line)
+        self._offset += len(line)
+        self.num_entries_written += 1
+        self.segment_entries += 1
+
+        if self._first_pending_time is None:
+            self._first_pending_time = now
+        if len(self._pending_lines) >= self.flush_entries:
+            self.flush()
+        else:
+            self.flush_if_due(now)
+
+    def flush_if_due(self, now=None):
+        """
+        Writes out the waiting entries if the oldest has waited flush_seconds. write_entry only checks when an entry
+        arrives, so call this now and again (e.g. as a SleepEntryPipeline stage's idle function) for the last entries
+        before the readings stop to be written out in time.
+        """
+        if self._first_pending_time is not None and \
+                (now or time.time()) - self._first_pending_time >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Writes out every waiting entry"""
+        if not self._pending_lines:
+            return
+        started = time.time()
+        data = ''.join(self._pending_lines)
+        index_data = ''.join(self._pending_index_lines)
+        logfile_offset = self._offset - len(data)
+
+        if self.journal:
+            # Redo record: where the batch goes in each file, then the batch itself
+            self.journal.seek(0)
+            self.journal.truncate()
+            self.journal.write(("%d,%d,%d,%d\n" % (logfile_offset, len(data), self._index_offset, len(index_data)) +
+                                data + index_data).encode('ascii'))
+            self._sync(self.journal)
+
+        self.logfile.write(data)
+        self._sync(self.logfile)
+        if self.index_file and index_data:
+            self.index_file.write(index_data)
+            self._sync(self.index_file)
+            self._index_offset += len(index_data)
+
+        if self.journal:
+            # The batch is safely in the logfile. Nothing to redo.
+            self.journal.seek(0)
+            self.journal.truncate()
+            self.journal.flush()
+
+        self._pending_lines = []
+        self._pending_index_lines = []
+        self._first_pending_time = None
+
+        seconds = time.time() - started
+        self.flushes += 1
+        self.flush_seconds_total += seconds
+        self.flush_seconds_max = max(self.flush_seconds_max, seconds)
+
+    def _sync(self, file_object):
+        file_object.flush()
+        if self.fsync:
+            os.fsync(file_object.fileno())
+
+    def write_stats(self):
+        """
+        :return: dict describing how long writing out batches has taken
+        """
+        return {'entries': self.num_entries_written,
+                'pending': len(self._pending_lines),
+                'flushes': self.flushes,
+                'mean_flush_seconds': self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+                'max_flush_seconds': self.flush_seconds_max}
+
+    def close(self):
+        self._close_segment()
+        if self.index_file:
+            self.index_file.close()
+        for thread in self._compressions:
+            thread.join()
+        log.info("Log saved to %s (%d entries in %d writes, mean %.1f ms, max %.1f ms)" %
+                 (self.logfile_name, self.num_entries_written, self.flushes,
+                  self.write_stats()['mean_flush_seconds'] * 1000, self.flush_seconds_max * 1000))
+
+
+def journal_filename_for(logfile_name):
+    """OutFile's journal for a logfile. It only exists while the logfile is being written (or after a crash)."""
+    return logfile_name + '.wal'
+
+
+def recover_logfile(logfile_name):
+    """
+    Finishes off a logfile whose OutFile never closed (e.g. the power went): replays the last batch from the journal
+    if it didn't make it into the logfile in full, or cuts off a partial last line, then removes the journal.
+
+    :return: True if the logfile needed recovering
+    """
+    journal_name = journal_filename_for(logfile_name)
+    if not os.path.exists(journal_name):
+        return False
+    if not os.path.exists(logfile_name):
+        os.remove(journal_name)
+        return False
+
+    with open(journal_name, 'rb') as journal:
+        record = journal.read().decode('ascii', 'replace')
+    replayed = False
+    header, _, batch = record.partition('\n')
+    try:
+        logfile_offset, data_size, index_offset, index_data_size = [int(field) for field in header.split(',')]
+    except ValueError:
+        # Empty (the last batch was written out in full), or cut short before the batch was written anywhere else
+        batch = None
+    if batch is not None and len(batch) == data_size + index_data_size:
+        # Writing the same batch to the same place twice does no harm, so there's no need to check if it's needed
+        _replace_tail(logfile_name, logfile_offset, batch[:data_size])
+        # A segment's entries are indexed in its session's index
+        index_filename = SessionIndex.filename_for(session_name_for(logfile_name))
+        if index_data_size and os.path.exists(index_filename):
+            _replace_tail(index_filename, index_offset, batch[data_size:])
+        replayed = True
+    else:
+        _remove_partial_line(logfile_name)
+    os.remove(journal_name)
+    log.info("Recovered %s%s" % (logfile_name, " (replayed last write)" if replayed else ""))
+    return True
+
+
+def recover_logfiles(directory='logs', rotate_seconds=None):
+    """
+    Recovers every logfile (or segment) in `directory` left unfinished by a crash (see recover_logfile), and gzips
+    any finished segments which didn't get compressed. A segment is only taken to be finished once a later segment of
+    its session has been started, or (with `rotate_seconds`, the longest a segment is written to) once it hasn't been
+    written to for longer than that, so a segment another logger is still writing is left alone.
+    """
+    for journal_name in glob.glob(os.path.join(directory, '*.slp.csv.wal')):
+        recover_logfile(journal_name[:-len('.wal')])
+    now = time.time()
+    for segment in glob.glob(os.path.join(directory, '*.slp.csv')):
+        # A segment still being written has a journal
+        if not SEGMENT_PATTERN.match(segment) or os.path.exists(journal_filename_for(segment)):
+            continue
+        if not _segment_finished(segment, rotate_seconds, now):
+            continue
+        try:
+            compress_segment(segment)
+        except (IOError, OSError) as e:
+            log.warning("Unable to compress %s: %s" % (segment, e))
+
+
+def _segment_finished(segment, rotate_seconds, now):
+    """:return: True if a later segment of the session exists, or the segment is older than rotate_seconds"""
+    number = int(SEGMENT_PATTERN.match(segment).group(2))
+    last_number = int(SEGMENT_PATTERN.match(session_segments(segment)[-1]).group(2))
+    if last_number > number:
+        return True
+    return rotate_seconds is not None and now - os.path.getmtime(segment) > rotate_seconds
+
+
+def _replace_tail(filename, offset, data):
+    """Cuts the file off at `offset`, then writes `data` there"""
+    with open(filename, 'r+b') as file_object:
+        file_object.truncate(offset)
+        file_object.seek(offset)
+        file_object.write(data.encode('ascii'))
+        file_object.flush()
+        os.fsync(file_object.fileno())
+
+
+def _remove_partial_line(filename):
+    """Cuts off anything after the last newline in the file"""
+    with open(filename, 'r+b') as file_object:
+        file_object.seek(0, os.SEEK_END)
+        size = file_object.tell()
+        file_object.seek(max(0, size - 4096))
+        tail = file_object.read()
+        if tail.endswith(b'\n'):
+            return
+        last_newline = tail.rfind(b'\n')
+        if last_newline >= 0:
+            file_object.truncate(size - len(tail) + last_newline + 1)
+
+
+class LightSwitch(object):
+    """Static object for turning off and on the Raspberry Pi's indicator LED.
+
+    Usage:
+        LightSwitch.turn_on()
+        LightSwitch.turn_off()
+    """
+    @staticmethod
+    def turn_on():
+        try:
+            with open(LIGHT_FILE, 'w') as f:
+                f.write('1')
+        except IOError:
+            log.warning("Unable to turn on indicator led")
+
+    @staticmethod
+    def turn_off():
+        try:
+            with open(LIGHT_FILE, 'w') as f:
+                f.write('0')
+        except IOError:
+            log.warning("Unable to turn off indicator led")
+
+
+def get_date_string():
+    """
+    :return: A string representation of the current date as mm-dd-yyyy
+    """
+    return datetime.datetime.now().strftime("%m-%d-%Y")
+
+
+def get_time_string():
+    """
+    :return: A string representation of the current time as hh-mm-sss
+    """
+    return datetime.datetime.now().strftime("%H-%M-%S")
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def timestamp_from_strings(date, time):
+    """
+    Converts a date string (mm-dd-yyyy) and time string (hh-mm-ss) into a number of seconds since 01-01-1970 00-00-00.
+    Logfiles record the local wall-clock time without a timezone, so timestamps are too: they count seconds on
+    the same clock the logfile was written with, and convert back to exactly the same strings.
+
+    :return: integer number of seconds
+    """
+    month, day, year = date.split('-')
+    hours, minutes, seconds = time.split('-')
+    days = (datetime.date(int(year), int(month), int(day)) - EPOCH.date()).days
+    return days * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+_date_strings = {}
+"""Date strings by number of days since 01-01-1970, so each date only has to be formatted once"""
+
+
+def strings_from_timestamp(timestamp):
+    """
+    The opposite of timestamp_from_strings.
+
+    :return: (date string as mm-dd-yyyy, time string as hh-mm-ss)
+    """
+    days, seconds = divmod(int(math.floor(timestamp)), 86400)
+    if days not in _date_strings:
+        _date_strings[days] = (EPOCH + datetime.timedelta(days=days)).strftime("%m-%d-%Y")
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return _date_strings[days], "%02d-%02d-%02d" % (hours, minutes, seconds)
+
+
+def current_timestamp():
+    """
+    :return: The current date and time as a timestamp (see timestamp_from_strings)
+    """
+    return calendar.timegm(time.localtime())
+
+
+def check_correct_run_dir():
+    if os.getcwd()[-20:] != '/live-sleep-analyzer':
+        log.error("Please cd into the project directory before running any scripts!")
+        sys.exit(1)
@@ -0,0 +1,260 @@
+"""
+Column-oriented storage of sleep entries: SleepEntryColumns for a whole session, and SleepEntryRing for only the
+most recent entries of a session too long to keep in memory
+"""
+import argparse
+import numpy
+from pysleeplogging import log
+from capture import SleepEntry, strings_from_timestamp
+
+
+class SleepEntryColumns(object):
+    """
+    Column-oriented storage for a session's worth of sleep entries. Instead of keeping a SleepEntry object
+    (and two date/time strings) per reading, the index, timestamp and movement_value of every entry are kept
+    in growable numpy arrays, costing 20 bytes per reading.
+
+    Indexing and iterating still yield SleepEntry objects, which are built on demand, so this can be used
+    in place of a list of SleepEntries. Analysis that wants to look at the whole session at once should use
+    the indexes, timestamps and movement_values columns instead.
+
+    Usage:
+        columns = SleepEntryColumns()
+        columns.append(SleepEntry(0, 5))
+        print columns[-1]
+        print columns.movement_values.mean()
+    """
+    INITIAL_CAPACITY = 4096
+    """Number of entries to make room for up front. Capacity doubles whenever it runs out."""
+
+    def __init__(self):
+        self._allocate(self.INITIAL_CAPACITY)
+
+    def _allocate(self, capacity):
+        self._start = 0
+        """Position of the first entry still held (only ever moves on in a SleepEntryRing)"""
+        self._count = 0
+        self._indexes = numpy.empty(capacity, dtype=numpy.int64)
+        self._timestamps = numpy.empty(capacity, dtype=numpy.float64)
+        self._movement_values = numpy.empty(capacity, dtype=numpy.int32)
+
+    def append(self, sleep_entry):
+        if self._count == len(self._indexes):
+            self._grow()
+        self._indexes[self._count] = sleep_entry.index
+        self._timestamps[self._count] = sleep_entry.timestamp
+        self._movement_values[self._count] = sleep_entry.movement_value
+        self._count += 1
+
+    def extend(self, indexes, timestamps, movement_values):
+        """Appends many entries at once, given as equal-length arrays of each column"""
+        count = self._count + len(indexes)
+        while count > len(self._indexes):
+            self._grow()
+        self._indexes[self._count:count] = indexes
+        self._timestamps[self._count:count] = timestamps
+        self._movement_values[self._count:count] = movement_values
+        self._count = count
+
+    def _grow(self):
+        capacity = len(self._indexes) * 2
+        for name in ('_indexes', '_timestamps', '_movement_values'):
+            column = getattr(self, name)
+            grown = numpy.empty(capacity, dtype=column.dtype)
+            grown[:self._count] = column[:self._count]
+            setattr(self, name, grown)
+
+    def entry(self, position):
+        """Builds a SleepEntry from the entry stored at `position`"""
+        position += self._start
+        return SleepEntry(int(self._indexes[position]), int(self._movement_values[position]),
+                          timestamp=self._timestamps[position].item())
+
+    def __len__(self):
+        return self._count - self._start
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.entry(position)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.entry(position) for position in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("SleepEntryColumns index out of range")
+        return self.entry(key)
+
+    @property
+    def indexes(self):
+        """numpy array of every stored SleepEntry.index"""
+        return self._indexes[self._start:self._count]
+
+    @property
+    def timestamps(self):
+        """numpy array of every stored SleepEntry.timestamp"""
+        return self._timestamps[self._start:self._count]
+
+    @property
+    def movement_values(self):
+        """numpy array of every stored SleepEntry.movement_value"""
+        return self._movement_values[self._start:self._count]
+
+    @property
+    def num_added(self):
+        """Number of entries ever added, including any no longer held (see SleepEntryRing)"""
+        return self._count
+
+    @property
+    def first_timestamp(self):
+        """Timestamp of the first entry ever added, or None if there are none"""
+        return self._timestamps[0].item() if self._count else None
+
+    @property
+    def nbytes(self):
+        """Bytes of memory currently held by the columns, including room reserved for future entries"""
+        return self._indexes.nbytes + self._timestamps.nbytes + self._movement_values.nbytes
+
+
+class SleepEntryRing(SleepEntryColumns):
+    """
+    SleepEntryColumns which only holds the last `size` entries, so a live session can run for as long as it likes in
+    a fixed amount of memory. The entries which drop out are all in the logfile already.
+
+    The columns have room for 2 * `size` entries, filled one after another. Once they are full, the last `size`
+    entries are moved back to the start, so each entry is copied once more at most and the column properties are
+    still plain slices of the columns, oldest first. Entries which have dropped out are passed to `spill` (if given)
+    when they are about to be overwritten, a batch at a time, e.g. to log a summary of them.
+
+    Usage:
+        columns = SleepEntryRing(3600, spill=log_spilled_entries)
+        columns.append(SleepEntry(0, 5))
+        print columns.movement_values.mean(), columns.num_added
+    """
+    def __init__(self, size, spill=None):
+        """
+        :param spill: function(indexes, timestamps, movement_values) to pass the entries that drop out to, or None
+        """
+        assert size > 0, "SleepEntryRing size must be a positive integer, not: %s" % size
+        self.size = size
+        self.spill = spill
+        self._allocate(2 * size)
+
+        self.dropped = 0
+        """Number of entries which have dropped out"""
+
+        self._first_timestamp = None
+
+    def append(self, sleep_entry):
+        if self._count == len(self._indexes):
+            self._compact()
+        if self._first_timestamp is None:
+            self._first_timestamp = sleep_entry.timestamp
+        self._indexes[self._count] = sleep_entry.index
+        self._timestamps[self._count] = sleep_entry.timestamp
+        self._movement_values[self._count] = sleep_entry.movement_value
+        self._count += 1
+        if self._count - self._start > self.size:
+            self._start += 1
+            self.dropped += 1
+
+    def extend(self, indexes, timestamps, movement_values):
+        num_values = len(indexes)
+        if not num_values:
+            return
+        if self._first_timestamp is None:
+            self._first_timestamp = float(timestamps[0])
+        if num_values >= self.size:
+            # Everything held so far drops out, along with the start of the batch
+            excess = num_values - self.size
+            self._spill(0, self._count)
+            if excess and self.spill is not None:
+                self.spill(indexes[:excess], timestamps[:excess], movement_values[:excess])
+            self.dropped += len(self) + excess
+            self._start = 0
+            self._count = self.size
+            self._indexes[:self.size] = indexes[excess:]
+            self._timestamps[:self.size] = timestamps[excess:]
+            self._movement_values[:self.size] = movement_values[excess:]
+            return
+
+        if self._count + num_values > len(self._indexes):
+            self._compact()
+        count = self._count + num_values
+        self._indexes[self._count:count] = indexes
+        self._timestamps[self._count:count] = timestamps
+        self._movement_values[self._count:count] = movement_values
+        self._count = count
+        excess = len(self) - self.size
+        if excess > 0:
+            self._start += excess
+            self.dropped += excess
+
+    def flush(self):
+        """Passes every entry which has dropped out, but not been spilled yet, to `spill`"""
+        if self._start:
+            self._compact()
+
+    def _compact(self):
+        """Spills the entries which have dropped out, and moves the ones still held back to the start"""
+        self._spill(0, self._start)
+        held = len(self)
+        for name in ('_indexes', '_timestamps', '_movement_values'):
+            column = getattr(self, name)
+            column[:held] = column[self._start:self._count]
+        self._start = 0
+        self._count = held
+
+    def _spill(self, start, end):
+        if self.spill is not None and end > start:
+            self.spill(self._indexes[start:end], self._timestamps[start:end], self._movement_values[start:end])
+
+    @property
+    def num_added(self):
+        return self.dropped + len(self)
+
+    @property
+    def first_timestamp(self):
+        return self._first_timestamp
+
+
+def log_spilled_entries(indexes, timestamps, movement_values):
+    """SleepEntryRing spill which logs a line summarizing the entries that have dropped out of memory"""
+    log.info("Entries %d to %d (%s to %s) dropped out of memory: mean movement %.2f, max %d" %
+             (indexes[0], indexes[-1], '_'.join(strings_from_timestamp(timestamps[0])),
+              '_'.join(strings_from_timestamp(timestamps[-1])), movement_values.mean(), movement_values.max()))
+
+
+def sleep_entry_columns(retain_entries=None):
+    """
+    :return: SleepEntryColumns for every entry, or with `retain_entries`, a SleepEntryRing of the last
+             retain_entries entries, which logs a summary of the entries that drop out
+    """
+    if retain_entries is None:
+        return SleepEntryColumns()
+    return SleepEntryRing(retain_entries, spill=log_spilled_entries)
+
+
+def entry_count(value):
+    """argparse type for a number of entries, e.g. --retain-entries 3600"""
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError("expected a number of entries of 1 or more, not: %s" % value)
+    return count
+
+
+def session_span(sleep_entries):
+    """
+    :param sleep_entries: SleepEntryColumns or SleepEntryRing
+    :return: dict of the number of entries ever added, and the times of the first and last of them (None if there
+             are none), as in SleepAnalyzer.summary
+    """
+    if not len(sleep_entries):
+        return {'entries': sleep_entries.num_added, 'start': None, 'end': None}
+    return {'entries': sleep_entries.num_added,
+            'start': '_'.join(strings_from_timestamp(sleep_entries.first_timestamp)),
+            'end': '_'.join(strings_from_timestamp(sleep_entries.timestamps[-1]))}
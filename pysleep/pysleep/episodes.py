@@ -0,0 +1,207 @@
+"""
+Big movements as episodes: each run of consecutive entries whose movement values are over min_movement_value is kept
+as one MovementEpisode (start, end, peak, integral) instead of one SleepEntry per entry. Episodes never overlap and
+are added in time order, so they are already sorted by both start and end, and EpisodeIndex answers range and
+overlap queries (e.g. "bursts between 2 and 4 a.m. longer than 30 s") by bisecting rather than scanning.
+"""
+from bisect import bisect_left, bisect_right
+import numpy
+
+
+class MovementEpisode(object):
+    """
+    A run of consecutive big movement entries. The episode in progress is updated in place as entries are added.
+    """
+    __slots__ = ('start_index', 'end_index', 'start', 'end', 'peak', 'peak_index', 'integral')
+
+    def __init__(self, start_index, end_index, start, end, peak, peak_index, integral):
+        self.start_index = start_index
+        """Index of the first entry"""
+
+        self.end_index = end_index
+        """Index of the last entry"""
+
+        self.start = start
+        """Timestamp of the first entry (see timestamp_from_strings)"""
+
+        self.end = end
+        """Timestamp of the last entry"""
+
+        self.peak = peak
+        """Largest movement value"""
+
+        self.peak_index = peak_index
+        """Index of the (first) entry with the largest movement value"""
+
+        self.integral = integral
+        """Sum of the movement values"""
+
+    @property
+    def entries(self):
+        return self.end_index - self.start_index + 1
+
+    @property
+    def duration(self):
+        """Seconds from the first entry to the last"""
+        return self.end - self.start
+
+    def __eq__(self, other):
+        return isinstance(other, MovementEpisode) and all(getattr(self, name) == getattr(other, name)
+                                                          for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "MovementEpisode(%s)" % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+
+class EpisodeIndex(object):
+    """
+    Every big movement episode in a session, in time order. Entries are added one at a time (add) or a batch at a
+    time (add_arrays), giving the same episodes either way. The last episode is extended for as long as the entries
+    after it are big movements too.
+
+    Queries bisect on the episodes' start and end timestamps, which only works while timestamps never go backwards
+    within a session (as they don't, apart from the clock going back an hour at the end of daylight saving time).
+
+    Usage:
+        episodes = EpisodeIndex(min_movement_value=10)
+        episodes.add(sleep_entry.index, sleep_entry.timestamp, sleep_entry.movement_value)
+        for episode in episodes.query(start, end, min_duration=30):
+            print episode.start, episode.peak
+    """
+    def __init__(self, min_movement_value=0):
+        """
+        :param min_movement_value: movement values above this are big movements. None makes every entry one.
+        """
+        self.min_movement_value = min_movement_value
+
+        self.episodes = []
+        """Every episode, oldest first"""
+
+        self.num_entries = 0
+        """Number of big movement entries in all the episodes"""
+
+        self._starts = []
+        """Start timestamp of every episode, for bisecting"""
+
+        self._ends = []
+        """End timestamp of every episode, for bisecting"""
+
+        self._open = None
+        """The last episode, while the last entry added was part of it"""
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __iter__(self):
+        return iter(self.episodes)
+
+    def __getitem__(self, position):
+        return self.episodes[position]
+
+    def add(self, index, timestamp, movement_value):
+        """Adds one entry, extending the last episode or starting a new one if it is a big movement"""
+        if self.min_movement_value is not None and movement_value <= self.min_movement_value:
+            self._open = None
+            return
+        self.num_entries += 1
+        episode = self._open
+        if episode is not None and index == episode.end_index + 1:
+            episode.end_index = index
+            episode.end = timestamp
+            episode.integral += movement_value
+            if movement_value > episode.peak:
+                episode.peak = movement_value
+                episode.peak_index = index
+            self._ends[-1] = timestamp
+        else:
+            self._append(MovementEpisode(index, index, timestamp, timestamp, movement_value, index, movement_value))
+
+    def add_arrays(self, indexes, timestamps, movement_values):
+        """
+        Batch version of add: finds the runs of big movements over whole arrays, so the work done per entry is in
+        numpy rather than Python.
+        """
+        movement_values = numpy.asarray(movement_values, dtype=numpy.int64)
+        if not len(movement_values):
+            return
+        indexes = numpy.asarray(indexes, dtype=numpy.int64)
+        timestamps = numpy.asarray(timestamps)
+        if self.min_movement_value is None:
+            positions = numpy.arange(len(movement_values))
+        else:
+            positions = numpy.flatnonzero(movement_values > self.min_movement_value)
+        if not len(positions):
+            self._open = None
+            return
+
+        # A run ends wherever the next big movement isn't the next entry
+        run_indexes = indexes[positions]
+        breaks = numpy.flatnonzero((numpy.diff(positions) != 1) | (numpy.diff(run_indexes) != 1)) + 1
+        run_starts = numpy.concatenate(([0], breaks))
+        run_ends = numpy.concatenate((breaks, [len(positions)])) - 1
+        values = movement_values[positions]
+        peaks = numpy.maximum.reduceat(values, run_starts)
+        integrals = numpy.add.reduceat(values, run_starts)
+        # The first entry of each run with the run's peak value
+        run_numbers = numpy.repeat(numpy.arange(len(run_starts)), numpy.diff(numpy.append(run_starts, len(values))))
+        at_peak = numpy.flatnonzero(values == peaks[run_numbers])
+        peak_positions = at_peak[numpy.unique(run_numbers[at_peak], return_index=True)[1]]
+
+        runs = list(zip(run_indexes[run_starts].tolist(), run_indexes[run_ends].tolist(),
+                        timestamps[positions[run_starts]].tolist(), timestamps[positions[run_ends]].tolist(),
+                        peaks.tolist(), run_indexes[peak_positions].tolist(), integrals.tolist()))
+        self.num_entries += len(positions)
+
+        episode = self._open
+        if episode is not None and positions[0] == 0 and runs[0][0] == episode.end_index + 1:
+            # The batch carries on the last episode
+            start_index, end_index, start, end, peak, peak_index, integral = runs.pop(0)
+            episode.end_index = end_index
+            episode.end = end
+            episode.integral += integral
+            if peak > episode.peak:
+                episode.peak = peak
+                episode.peak_index = peak_index
+            self._ends[-1] = end
+        for run in runs:
+            self._append(MovementEpisode(*run))
+        if positions[-1] != len(movement_values) - 1:
+            self._open = None
+
+    def _append(self, episode):
+        self.episodes.append(episode)
+        self._starts.append(episode.start)
+        self._ends.append(episode.end)
+        self._open = episode
+
+    def overlapping(self, start=None, end=None):
+        """:return: list of the episodes with any part between the `start` and `end` timestamps (None for no limit)"""
+        first = 0 if start is None else bisect_left(self._ends, start)
+        last = len(self.episodes) if end is None else bisect_right(self._starts, end)
+        return self.episodes[first:last]
+
+    def within(self, start=None, end=None):
+        """:return: list of the episodes entirely between the `start` and `end` timestamps (None for no limit)"""
+        first = 0 if start is None else bisect_left(self._starts, start)
+        last = len(self.episodes) if end is None else bisect_right(self._ends, end)
+        return self.episodes[first:last]
+
+    def at(self, timestamp):
+        """:return: the episode going on at `timestamp`, or None"""
+        position = bisect_right(self._starts, timestamp) - 1
+        if position >= 0 and self._ends[position] >= timestamp:
+            return self.episodes[position]
+        return None
+
+    def query(self, start=None, end=None, min_duration=None, min_peak=None, min_integral=None):
+        """
+        :return: list of the episodes overlapping `start` to `end` (see overlapping) which last at least
+                 `min_duration` seconds, and reach at least `min_peak` / add up to at least `min_integral`
+        """
+        return [episode for episode in self.overlapping(start, end)
+                if (min_duration is None or episode.duration >= min_duration) and
+                (min_peak is None or episode.peak >= min_peak) and
+                (min_integral is None or episode.integral >= min_integral)]
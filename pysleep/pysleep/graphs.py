@@ -1,5 +1,6 @@
+import time
 from matplotlib import pyplot
-from utils import SleepAnalyzer
+from utils import SleepAnalyzer, log
 
 
 class PostSessionGraphs(SleepAnalyzer):
@@ -15,11 +16,11 @@ class PostSessionGraphs(SleepAnalyzer):
         ncols = 1
 
         # Graph 1
-        if self.big_movement_entries:
+        if self.movement_episodes:
             nrows += 1
             pyplot.subplot(nrows, ncols, nrows)
-            x_values = [sleep_entry.index for sleep_entry in self.big_movement_entries]
-            y_values = [sleep_entry.movement_value for sleep_entry in self.big_movement_entries]
+            x_values = [episode.peak_index for episode in self.movement_episodes]
+            y_values = [episode.peak for episode in self.movement_episodes]
             pyplot.xlim(xmin=0, xmax=max(x_values))
             pyplot.ylim(ymin=0, ymax=max(y_values))
             pyplot.plot(x_values, y_values, 'ro')
@@ -66,37 +67,169 @@ class PostSessionGraphs(SleepAnalyzer):
         pyplot.show()
 
 
-class LiveSessionGraphs(SleepAnalyzer):
-    def __init__(self, **kwargs):
-        super(LiveSessionGraphs, self).__init__(**kwargs)
+class LiveSessionGraphs(object):
+    """
+    Live graphs of the last movement_history_size entries of an AnalyzerPipeline, kept up to date as the pipeline
+    analyzes entries. The graphs only draw: the entries and movement sums come from the pipeline's 'store' and
+    'movement-sums' stages (see STAGES), so nothing is analyzed twice.
+
+    The figure and its lines are made once. Each frame only moves the lines' data and blits them over a saved
+    copy of the background (axes, ticks, labels), instead of clearing and redrawing the whole figure.
+    Frames are drawn at most `frame_rate` times a second however fast entries arrive: entries added between
+    frames are simply shown together in the next one, so drawing never holds up reading from the Teensy.
+    """
+
+    FRAME_RATE = 5
+    """Default maximum number of frames drawn per second"""
+
+    STAGES = ('store', 'movement-sums')
+    """Analysis stages the graphs are drawn from, which the pipeline has to run"""
+
+    def __init__(self, analysis, frame_rate=FRAME_RATE):
+        """
+        :param analysis: AnalyzerPipeline running (at least) the STAGES. add_entry is only called once it has
+                         analyzed the entry, from the same thread.
+        """
+        missing = [name for name in self.STAGES if name not in analysis.stages]
+        if missing:
+            raise ValueError("Live graphs need the analysis stages: %s" % ', '.join(missing))
+        self.analysis = analysis
+        self.history_size = analysis.windows['movement-window'].window.size
+        """Number of entries shown"""
         pyplot.ion()
 
-    def add_entry(self, sleep_entry):
-        super(LiveSessionGraphs, self).add_entry(sleep_entry)
-        pyplot.figure("LiveSessionGraphs %s" % self.session_id)
-        pyplot.clf()
-        nrows = 1
-        ncols = 1
+        self.frame_interval = 1.0 / frame_rate
+        """Minimum number of seconds between frames"""
 
-        # Graph 1
-        subplot = pyplot.subplot(nrows, ncols, nrows)
-        subplot.set_title('Raw Movement Values')
-        x_values = [x.index for x in self.last_entries]
-        y_values = [x.movement_value for x in self.last_entries]
-        pyplot.scatter(x_values, y_values, color='black')
+        self.frames_drawn = 0
 
-        # Graph 2
-        if self.movement_coefficients:
-            nrows += 1
-            subplot = pyplot.subplot(nrows, ncols, nrows)
-            subplot.set_title('Movement Coefficients')
-            x_values2 = [[x] for x in range(0, len(self.movement_coefficients))]
-            y_values2 = [[y] for y in self.movement_coefficients]
-            pyplot.xlim(xmin=0, xmax=len(self.movement_coefficients))
-            pyplot.ylim(ymin=0, ymax=max(self.movement_coefficients))
-            pyplot.scatter(x_values2, y_values2, color='black')
+        self.entries_coalesced = 0
+        """Entries which were shown along with later entries, rather than getting a frame of their own"""
 
-        pyplot.draw()
+        self.late_frames = 0
+        """Frames which were on screen more than one frame_interval after they were due"""
+
+        self.dropped_frames = 0
+        """Frames which would have been drawn at frame_rate, but weren't because the dashboard was running behind"""
+
+        self.full_redraws = 0
+        """Times the whole figure was redrawn (e.g. to scroll the axes) rather than just the lines"""
+
+        self._next_frame_time = 0
+        self._first_pending_time = None
+        """When the oldest entry not yet on screen was added"""
+
+        self.figure = pyplot.figure("LiveSessionGraphs %s" % analysis.session_id)
+        self.figure.clf()
+        self.canvas = self.figure.canvas
+
+        movement_axes = self.figure.add_subplot(2, 1, 1)
+        movement_axes.set_title('Raw Movement Values')
+        sums_axes = self.figure.add_subplot(2, 1, 2)
+        sums_axes.set_title('Movement Sums')
+        self.figure.subplots_adjust(hspace=0.4)
+        self.movement_line, = movement_axes.plot([], [], 'k.', animated=True)
+        self.sums_line, = sums_axes.plot([], [], 'k-', animated=True)
+        for axes in (movement_axes, sums_axes):
+            axes.set_xlim(0, self.history_size)
+            axes.set_ylim(0, 1)
+
+        self._background = None
+        self._can_blit = hasattr(self.canvas, 'copy_from_bbox') and hasattr(self.canvas, 'blit')
+        # Every full redraw (including resizing the window) has to save a new background to blit over
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.draw()
+
+    def add_entry(self, sleep_entry):
+        """Shows the entry in the next frame, drawing it now if a frame is due. The analysis must have seen it."""
+        now = time.time()
+        if self._first_pending_time is None:
+            self._first_pending_time = now
+        else:
+            self.entries_coalesced += 1
+        if now >= self._next_frame_time:
+            self.draw_frame()
+
+    def draw_frame(self):
+        """
+        Shows every entry added so far. Only the lines are redrawn, unless the newest entries have run off the
+        edge of the axes, in which case the axes are moved along and the whole figure is redrawn.
+        """
+        sleep_entries = self.analysis.stages['store'].sleep_entries
+        x_values = sleep_entries.indexes[-self.history_size:]
+        movement_values = sleep_entries.movement_values[-self.history_size:]
+        movement_sums = self.analysis.stages['movement-sums'].movement_sums[-len(x_values):]
+        self.movement_line.set_data(x_values, movement_values)
+        self.sums_line.set_data(x_values, movement_sums)
+
+        rescaled = False
+        if len(x_values):
+            for line, y_max in ((self.movement_line, movement_values.max()), (self.sums_line, max(movement_sums))):
+                rescaled = self._rescale(line.axes, x_values[0], x_values[-1], y_max) or rescaled
+
+        if rescaled or not self._can_blit or self._background is None:
+            self.full_redraws += 1
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_lines()
+            self.canvas.blit(self.figure.bbox)
+        self.canvas.flush_events()
+
+        now = time.time()
+        if self._first_pending_time is not None:
+            due = max(self._first_pending_time, self._next_frame_time)
+            lateness = now - due
+            if lateness > self.frame_interval:
+                self.late_frames += 1
+                self.dropped_frames += int(lateness / self.frame_interval)
+        self.frames_drawn += 1
+        self._first_pending_time = None
+        self._next_frame_time = now + self.frame_interval
+
+    def _rescale(self, axes, x_min, x_max, y_max):
+        """
+        Moves the x axis along by half a window once the newest entry reaches its end, and doubles the y axis
+        when a value goes over it, so that the axes (and the saved background) only change now and again.
+
+        :return: True if the axes changed
+        """
+        rescaled = False
+        left, right = axes.get_xlim()
+        if x_max >= right or x_min < left:
+            left = max(x_min, x_max - self.history_size // 2)
+            axes.set_xlim(left, left + self.history_size)
+            rescaled = True
+        bottom, top = axes.get_ylim()
+        if y_max >= top:
+            axes.set_ylim(bottom, max(y_max * 2, 1))
+            rescaled = True
+        return rescaled
+
+    def _draw_lines(self):
+        self.movement_line.axes.draw_artist(self.movement_line)
+        self.sums_line.axes.draw_artist(self.sums_line)
+
+    def _on_draw(self, event):
+        if self._can_blit:
+            self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_lines()
+
+    def frame_stats(self):
+        """
+        :return: dict of counters describing how well the dashboard is keeping up
+        """
+        return {'frames_drawn': self.frames_drawn,
+                'full_redraws': self.full_redraws,
+                'entries_coalesced': self.entries_coalesced,
+                'late_frames': self.late_frames,
+                'dropped_frames': self.dropped_frames}
+
+    def show(self):
+        """Logs how well the graphs kept up. The analysis logs its own results (see AnalyzerPipeline.show)."""
+        log.info("Frames drawn: %(frames_drawn)d (%(full_redraws)d full redraws)   "
+                 "Entries coalesced: %(entries_coalesced)d   Late frames: %(late_frames)d   "
+                 "Dropped frames: %(dropped_frames)d" % self.frame_stats())
 
 
 class GraphWithAnalyzer(PostSessionGraphs):
@@ -0,0 +1,154 @@
+"""
+Streaming histogram of movement values: a fixed number of equal width bins, so adding a value is one list update
+however long the session, and the mode, mean, variance and percentiles can be read at any time without keeping the
+values themselves. Histograms with the same bins add together, e.g. into statistics across every session in a report.
+"""
+import math
+import numpy
+
+NUM_BINS = 1024
+"""Default number of bins"""
+
+BIN_WIDTH = 1
+"""Default bin width. With a width of 1 every value under NUM_BINS has a bin of its own, so every statistic is exact."""
+
+
+class MovementHistogram(object):
+    """
+    Counts of movement values in NUM_BINS bins of BIN_WIDTH, from 0 up. Values past the last bin are counted in an
+    overflow bin, and values below 0 in the first bin. The count, sum, sum of squares, min and max are kept exactly
+    for every value, so the mean and variance are always exact; the mode and percentiles are exact to the bin width
+    for values inside the bins, and percentiles falling in the overflow bin give the largest value.
+
+    Usage:
+        histogram = MovementHistogram()
+        histogram.add(sleep_entry.movement_value)
+        print histogram.mode, histogram.mean, histogram.percentile(95)
+    """
+    def __init__(self, num_bins=NUM_BINS, bin_width=BIN_WIDTH):
+        assert num_bins > 0 and bin_width > 0
+        self.num_bins = num_bins
+        self.bin_width = bin_width
+
+        self.counts = [0] * num_bins
+        """Number of values in each bin"""
+
+        self.overflow = 0
+        """Number of values past the last bin"""
+
+        self.count = 0
+        self.sum = 0
+        self.sum_of_squares = 0
+        self.min = None
+        self.max = None
+
+    def add(self, movement_value):
+        bin_number = movement_value // self.bin_width
+        if bin_number >= self.num_bins:
+            self.overflow += 1
+        else:
+            self.counts[max(0, bin_number)] += 1
+        self.count += 1
+        self.sum += movement_value
+        self.sum_of_squares += movement_value * movement_value
+        if self.min is None or movement_value < self.min:
+            self.min = movement_value
+        if self.max is None or movement_value > self.max:
+            self.max = movement_value
+
+    def add_array(self, movement_values):
+        """Same as add for every value in the array, binning them all in one go"""
+        movement_values = numpy.asarray(movement_values, dtype=numpy.int64)
+        if not len(movement_values):
+            return
+        bin_numbers = numpy.maximum(movement_values // self.bin_width, 0)
+        in_bins = bin_numbers[bin_numbers < self.num_bins]
+        for bin_number, count in enumerate(numpy.bincount(in_bins, minlength=self.num_bins).tolist()):
+            if count:
+                self.counts[bin_number] += count
+        self.overflow += len(movement_values) - len(in_bins)
+        self.count += len(movement_values)
+        self.sum += int(movement_values.sum())
+        self.sum_of_squares += int(numpy.dot(movement_values, movement_values))
+        low, high = movement_values.min().item(), movement_values.max().item()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other):
+        """Adds every value counted by `other` (which has to have the same bins) to this histogram"""
+        assert (self.num_bins, self.bin_width) == (other.num_bins, other.bin_width), "Histograms have different bins"
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.overflow += other.overflow
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        for name, pick in (('min', min), ('max', max)):
+            values = [value for value in (getattr(self, name), getattr(other, name)) if value is not None]
+            setattr(self, name, pick(values) if values else None)
+        return self
+
+    def __add__(self, other):
+        return MovementHistogram(self.num_bins, self.bin_width).merge(self).merge(other)
+
+    def occurrences(self, movement_value):
+        """:return: number of values counted in `movement_value`'s bin (0 for None)"""
+        if movement_value is None:
+            return 0
+        bin_number = movement_value // self.bin_width
+        if bin_number >= self.num_bins:
+            return self.overflow
+        return self.counts[max(0, bin_number)]
+
+    @property
+    def mode(self):
+        """Most common value (the lowest, if several are), or the start of the most common bin. None if empty."""
+        if not self.count or not any(self.counts):
+            return None
+        most = max(self.counts)
+        return self.counts.index(most) * self.bin_width
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return float(self.sum) / self.count
+
+    @property
+    def variance(self):
+        """Population variance"""
+        if not self.count:
+            return None
+        return max(0.0, (self.sum_of_squares - float(self.sum) * self.sum / self.count) / self.count)
+
+    def percentile(self, percent):
+        """
+        :return: the value `percent` percent of the way through the values in order (the lower value where that
+                 falls between two, like numpy.percentile(values, percent, interpolation='lower')), or the start of
+                 its bin. None if empty.
+        """
+        if not self.count:
+            return None
+        rank = int(math.floor(percent / 100.0 * (self.count - 1)))
+        if rank == self.count - 1:
+            return self.max
+        seen = 0
+        for bin_number, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                return max(bin_number * self.bin_width, self.min)
+        return self.max
+
+    @property
+    def median(self):
+        return self.percentile(50)
+
+    def __eq__(self, other):
+        return isinstance(other, MovementHistogram) and all(
+            getattr(self, name) == getattr(other, name) for name in
+            ('num_bins', 'bin_width', 'counts', 'overflow', 'count', 'sum', 'sum_of_squares', 'min', 'max'))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "MovementHistogram(%d values in %d bins of %d)" % (self.count, self.num_bins, self.bin_width)
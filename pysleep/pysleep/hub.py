@@ -0,0 +1,226 @@
+"""
+Logging and analyzing many patients at once, each with their own Teensy. One thread waits on every device's serial
+port at once (with select), so a quiet or unplugged device never holds up the others.
+"""
+import os
+import select
+import time
+from collections import deque
+import serial
+from utils import SleepEntry, SleepAnalyzer, OutFile, get_date_string, get_time_string, log
+from capture import find_teensy_ports, list_ports
+
+
+def hub_ports():
+    """
+    :return: the ports with a Teensy on them, found by USB vendor ID (see find_teensy_ports). With a pyserial too old
+             to list ports, every serial port is returned instead, and those which send nothing are soon ignored
+             (see SleepHub.SILENT_TIMEOUT).
+    """
+    teensy_ports, other_ports = find_teensy_ports()
+    if list_ports is None:
+        return other_ports
+    return teensy_ports
+
+
+class Device(object):
+    """
+    One patient's Teensy: reads whatever its serial port has ready without waiting, and logs and analyzes every
+    complete reading. The logfile isn't created until the first reading arrives, so a port with something other than
+    a Teensy on it never gets one.
+    """
+    def __init__(self, port, log_dir='logs', retain_entries=None):
+        """
+        :param retain_entries: only keep the last this many readings in memory (see SleepAnalyzer), or None for all
+        """
+        self.port = port
+        self.log_dir = log_dir
+        self.retain_entries = retain_entries
+
+        # A zero timeout never waits. The hub only reads once select says there is something to read.
+        self.serial = serial.Serial(port=port, timeout=0)
+        self.fileno = self.serial.fileno()
+        self.opened_time = time.time()
+
+        self.logfile = None
+        """OutFile for this device's session. Created by the first reading."""
+
+        self.sleep_analyzer = None
+
+        self.next_available_index = 0
+        self.malformed_readings = 0
+        self._partial_line = ''
+
+    def logfile_name(self):
+        """A timestamped logfile like OutFile's, with the port's name on the end to tell patients apart"""
+        return os.path.join(self.log_dir, '%s-%s-%s.slp.csv' %
+                            (get_date_string(), get_time_string(), os.path.basename(self.port)))
+
+    def read(self):
+        """
+        Reads everything waiting on the port, and logs and analyzes each complete reading.
+
+        :raises OSError, serial.SerialException: when the device has gone away
+        :return: number of readings handled
+        """
+        data = os.read(self.fileno, 4096)
+        if not data:
+            raise OSError("%s closed" % self.port)
+        if not isinstance(data, str):
+            data = data.decode('ascii', 'replace')
+
+        lines = (self._partial_line + data).split('\n')
+        self._partial_line = lines.pop()
+        num_readings = 0
+        for line in lines:
+            raw_value = line.strip()
+            if not raw_value:
+                continue
+            try:
+                movement_value = int(raw_value)
+            except ValueError:
+                self.malformed_readings += 1
+                log.warning("%s: unreadable value %r" % (self.port, raw_value))
+                continue
+            self.add_entry(SleepEntry(self.next_available_index, movement_value))
+            self.next_available_index += 1
+            num_readings += 1
+        return num_readings
+
+    def add_entry(self, sleep_entry):
+        if self.logfile is None:
+            self.logfile = OutFile(self.logfile_name())
+            self.sleep_analyzer = SleepAnalyzer(session_id=self.logfile.logfile_name,
+                                                retain_entries=self.retain_entries)
+        self.logfile.write_entry(sleep_entry)
+        self.sleep_analyzer.add_entry(sleep_entry)
+
+    def close(self):
+        try:
+            self.serial.close()
+        except (OSError, serial.SerialException):
+            pass
+        if self.logfile:
+            self.logfile.close()
+
+
+class SleepHub(object):
+    """
+    Finds every Teensy plugged in, and logs and analyzes a separate session for each one, all from one thread.
+    New devices are picked up, and unplugged devices closed, without disturbing the rest.
+
+    Usage:
+        hub = SleepHub()
+        hub.run()
+    """
+
+    SCAN_INTERVAL = 2
+    """Seconds between looking for newly plugged in devices"""
+
+    SILENT_TIMEOUT = 10
+    """Seconds a newly opened port can go without sending a reading before it is given up on as not a Teensy"""
+
+    FINISHED_SESSIONS = 100
+    """Number of ended sessions whose summaries are kept in finished_sessions. Older ones are only in the log."""
+
+    RETAIN_ENTRIES = 3600
+    """Default number of readings each device's analysis keeps in memory (about an hour at a reading a second)"""
+
+    def __init__(self, find_ports=hub_ports, log_dir='logs', retain_entries=RETAIN_ENTRIES):
+        """
+        :param find_ports: function returning the ports to look for devices on
+        :param log_dir: where to write each device's logfile
+        :param retain_entries: readings each device's analysis keeps in memory, so that a hub logging many patients
+                               for days runs in a fixed amount of memory. The session summaries still cover every
+                               reading. None keeps every reading.
+        """
+        self.find_ports = find_ports
+        self.log_dir = log_dir
+        self.retain_entries = retain_entries
+
+        self.devices = {}
+        """Open devices, by port"""
+
+        self.ignored_ports = set()
+        """Ports which didn't act like a Teensy. They are tried again if they are unplugged and plugged back in."""
+
+        self.finished_sessions = deque(maxlen=self.FINISHED_SESSIONS)
+        """Summaries (see SleepAnalyzer.summary) of the most recent sessions to end. Their analyzers aren't kept."""
+
+        self._running = False
+
+    def scan(self):
+        """Opens any new ports, and forgets about ignored ports which have gone away"""
+        ports = set(self.find_ports())
+        self.ignored_ports &= ports
+        for port in sorted(ports - set(self.devices) - self.ignored_ports):
+            try:
+                self.devices[port] = Device(port, self.log_dir, self.retain_entries)
+                log.info("Device found on %s" % port)
+            except (OSError, serial.SerialException) as e:
+                log.debug("Unable to open %s: %s" % (port, e))
+                self.ignored_ports.add(port)
+
+    def close_device(self, port, reason):
+        device = self.devices.pop(port)
+        device.close()
+        if device.sleep_analyzer is None:
+            log.info("Ignoring %s: %s" % (port, reason))
+            self.ignored_ports.add(port)
+        else:
+            summary = device.sleep_analyzer.summary()
+            log.info("Session on %s ended (%s) after %d readings: %s minutes asleep, %s minutes awake, max %s" %
+                     (port, reason, device.next_available_index, summary['asleep_minutes'], summary['awake_minutes'],
+                      summary['max']))
+            self.finished_sessions.append(summary)
+
+    def poll(self, timeout):
+        """
+        Waits up to `timeout` seconds for any device to send something, then reads from every device that has.
+
+        :return: number of readings handled
+        """
+        devices_by_fileno = dict((device.fileno, device) for device in self.devices.values())
+        if not devices_by_fileno:
+            time.sleep(timeout)
+            return 0
+
+        readable, _, _ = select.select(list(devices_by_fileno), [], [], timeout)
+        num_readings = 0
+        for fileno in readable:
+            device = devices_by_fileno[fileno]
+            try:
+                num_readings += device.read()
+            except (OSError, serial.SerialException) as e:
+                self.close_device(device.port, "unplugged: %s" % e)
+
+        now = time.time()
+        for device in list(self.devices.values()):
+            if device.logfile is None:
+                if now - device.opened_time > self.SILENT_TIMEOUT:
+                    self.close_device(device.port, "no readings after %d seconds" % self.SILENT_TIMEOUT)
+            else:
+                # A device which has gone quiet still gets its last readings written out on time
+                device.logfile.flush_if_due(now)
+        return num_readings
+
+    def run(self, duration=None):
+        """
+        Logs every device until stopped (or for `duration` seconds), then closes every session.
+        """
+        self._running = True
+        end_time = None if duration is None else time.time() + duration
+        next_scan_time = 0
+        try:
+            while self._running and (end_time is None or time.time() < end_time):
+                if time.time() >= next_scan_time:
+                    self.scan()
+                    next_scan_time = time.time() + self.SCAN_INTERVAL
+                self.poll(min(self.SCAN_INTERVAL, max(0, next_scan_time - time.time())))
+        finally:
+            for port in list(self.devices):
+                self.close_device(port, "hub stopped")
+
+    def stop(self):
+        """Makes run() return after its current poll. Safe to call from another thread."""
+        self._running = False
@@ -0,0 +1,291 @@
+"""
+Reading sleep entries on one thread and handling them on others, so that a slow logfile write, analysis step or
+graph redraw never holds up reading from the Teensy.
+"""
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from pysleeplogging import log
+
+BLOCK = 'block'
+"""Drop policy: when a stage's queue is full, the reader waits for it. Nothing is lost, but reading is held up."""
+
+DROP_OLDEST = 'drop-oldest'
+"""Drop policy: when a stage's queue is full, the oldest waiting entry is thrown away to make room"""
+
+DROP_NEWEST = 'drop-newest'
+"""Drop policy: when a stage's queue is full, the new entry is thrown away"""
+
+DROP_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+_STOP = object()
+"""Put on a stage's queue to tell it no more entries are coming"""
+
+
+class Stage(object):
+    """
+    One consumer of the pipeline's sleep entries: a bounded queue, and a handler called with each entry taken off it.
+    Keeps counters of how it is keeping up (see stats).
+    """
+    IDLE_SECONDS = 1.0
+    """Most seconds between calls to the idle function while no entries arrive"""
+
+    def __init__(self, name, handler, queue_size=1000, drop_policy=BLOCK, main_thread=False, idle=None):
+        """
+        :param handler: called with each sleep entry, in the order they were read
+        :param idle: called (with no arguments, on the same thread as the handler) whenever the queue runs empty,
+            and every IDLE_SECONDS while it stays empty, e.g. to write out a batch that has waited long enough.
+            It fails the stage like the handler does.
+        :param queue_size: most entries that can be waiting for the handler
+        :param drop_policy: what to do with new entries when the queue is full (BLOCK, DROP_OLDEST or DROP_NEWEST)
+        :param main_thread: handle entries on the thread that runs the pipeline rather than a thread of the stage's
+            own. Needed for anything that draws graphs, since GUI toolkits only work from the main thread.
+        """
+        assert drop_policy in DROP_POLICIES, "Unknown drop policy: %s" % drop_policy
+        self.name = name
+        self.handler = handler
+        self.drop_policy = drop_policy
+        self.main_thread = main_thread
+        self.idle = idle
+        self.queue = queue.Queue(queue_size)
+        self.thread = None
+
+        self.handled = 0
+        """Number of entries passed to the handler"""
+
+        self.dropped = 0
+        """Number of entries thrown away because the queue was full"""
+
+        self.max_depth = 0
+        """Most entries that have been waiting in the queue at once"""
+
+        self.lag = 0.0
+        """Seconds between the last handled entry being read, and being handled"""
+
+        self.max_lag = 0.0
+
+        self.error = None
+        """The exception that stopped the handler, if any"""
+
+    def put(self, read_time, sleep_entry):
+        """Queues an entry for the handler, following the stage's drop policy if the queue is full"""
+        item = (read_time, sleep_entry)
+        if self.error is not None:
+            # Nothing is taking entries off the queue any more
+            self.dropped += 1
+            return
+        if self.drop_policy == BLOCK:
+            self.queue.put(item)
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    if self.drop_policy == DROP_NEWEST:
+                        self.dropped += 1
+                        return
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        # The handler emptied the queue in the meantime, so nothing was dropped
+                        pass
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def stop(self):
+        """Tells the stage that no more entries are coming, once it has handled the ones already queued"""
+        if self.error is None:
+            self.queue.put((None, _STOP))
+
+    def handle_waiting(self, timeout=None):
+        """
+        Handles entries until the queue is empty (waiting up to `timeout` seconds for the first one),
+        or until the stage is stopped.
+
+        :return: False once the stage has been stopped, otherwise True
+        """
+        block = timeout is None or timeout > 0
+        try:
+            read_time, sleep_entry = self.queue.get(block, timeout)
+            while True:
+                if sleep_entry is _STOP:
+                    return False
+                self._handle(read_time, sleep_entry)
+                if self.error is not None:
+                    return False
+                read_time, sleep_entry = self.queue.get_nowait()
+        except queue.Empty:
+            if self.idle is not None:
+                try:
+                    self.idle()
+                except Exception as e:
+                    self._fail(e)
+                    return False
+            return True
+
+    def _handle(self, read_time, sleep_entry):
+        try:
+            self.handler(sleep_entry)
+        except Exception as e:
+            self._fail(e)
+            self.dropped += 1
+            return
+        self.handled += 1
+        self.lag = time.time() - read_time
+        self.max_lag = max(self.max_lag, self.lag)
+
+    def _fail(self, e):
+        log.error("Stage %s failed, and will get no more entries: %r" % (self.name, e))
+        self.error = e
+        # Unblock the reader if it is waiting on this stage
+        while not self.queue.empty():
+            self.dropped += 1
+            self.queue.get_nowait()
+
+    def _run(self):
+        timeout = None if self.idle is None else self.IDLE_SECONDS
+        while self.handle_waiting(timeout):
+            pass
+
+    def start(self):
+        if not self.main_thread:
+            self.thread = threading.Thread(target=self._run, name="Stage %s" % self.name)
+            self.thread.daemon = True
+            self.thread.start()
+
+    @property
+    def depth(self):
+        """Number of entries currently waiting in the queue"""
+        return self.queue.qsize()
+
+    def stats(self):
+        """
+        :return: dict of counters describing how the stage is keeping up
+        """
+        return {'name': self.name,
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'handled': self.handled,
+                'dropped': self.dropped,
+                'lag': self.lag,
+                'max_lag': self.max_lag}
+
+
+class SleepEntryPipeline(object):
+    """
+    Reads sleep entries from a SleepReader on a thread of its own, and passes each one on to every stage.
+    Each stage has its own queue, so one falling behind only holds up the others if it uses the BLOCK drop policy
+    and its queue fills up.
+
+    Usage:
+        pipeline = SleepEntryPipeline(Teensy())
+        pipeline.add_stage('logfile', logfile.write_entry)
+        pipeline.add_stage('graphs', live_session_graphs.add_entry, drop_policy=DROP_OLDEST, main_thread=True)
+        pipeline.run()
+    """
+
+    STATS_INTERVAL = 60
+    """Seconds between logging each stage's counters while running"""
+
+    def __init__(self, sleep_reader):
+        self.sleep_reader = sleep_reader
+        self.stages = []
+
+        self.entries_read = 0
+
+        self.error = None
+        """The exception that stopped the reader (e.g. serial.SerialException when the Teensy is unplugged)"""
+
+        self._stopping = threading.Event()
+        self._reader_thread = None
+
+    def add_stage(self, name, handler, **kwargs):
+        """
+        Adds a consumer of every sleep entry read. See Stage for the keyword arguments.
+
+        :return: the Stage
+        """
+        stage = Stage(name, handler, **kwargs)
+        self.stages.append(stage)
+        return stage
+
+    def _read(self):
+        try:
+            for sleep_entry in self.sleep_reader.sleep_entries():
+                if self._stopping.is_set():
+                    break
+                self.entries_read += 1
+                read_time = time.time()
+                for stage in self.stages:
+                    stage.put(read_time, sleep_entry)
+        except Exception as e:
+            self.error = e
+        finally:
+            for stage in self.stages:
+                stage.stop()
+
+    def run(self):
+        """
+        Reads and handles entries until the reader runs out of entries or fails, or the user interrupts.
+        Entries already read are handled before returning.
+
+        :raises: whatever stopped the reader, e.g. serial.SerialException
+        """
+        for stage in self.stages:
+            stage.start()
+        self._reader_thread = threading.Thread(target=self._read, name="SleepEntryPipeline reader")
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+
+        main_thread_stages = [stage for stage in self.stages if stage.main_thread]
+        next_stats_time = time.time() + self.STATS_INTERVAL
+        try:
+            while self._reader_thread.is_alive() or any(stage.depth for stage in main_thread_stages):
+                if main_thread_stages:
+                    for stage in main_thread_stages:
+                        if stage.error is None:
+                            stage.handle_waiting(timeout=0.05)
+                else:
+                    # Joining with a timeout lets a KeyboardInterrupt through
+                    self._reader_thread.join(0.5)
+                if time.time() >= next_stats_time:
+                    self.log_stats()
+                    next_stats_time += self.STATS_INTERVAL
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        """Stops reading, and waits for every stage to handle the entries already read"""
+        self._stopping.set()
+        if self._reader_thread is not None:
+            # The reader stops the stages once it stops reading
+            self._reader_thread.join(2)
+            if self._reader_thread.is_alive():
+                # Still waiting on the reader (or a full stage). Stop the stages anyway.
+                for stage in self.stages:
+                    stage.stop()
+        for stage in self.stages:
+            if stage.main_thread:
+                if stage.error is None:
+                    stage.handle_waiting(timeout=0)
+            elif stage.thread is not None:
+                stage.thread.join()
+        self.log_stats()
+
+    def stats(self):
+        """
+        :return: list of each stage's counters (see Stage.stats)
+        """
+        return [stage.stats() for stage in self.stages]
+
+    def log_stats(self):
+        log.info("Pipeline: %d entries read" % self.entries_read)
+        for stats in self.stats():
+            log.info("  %(name)s: %(handled)d handled, %(dropped)d dropped, queue depth %(depth)d (max %(max_depth)d), "
+                     "lag %(lag).3f s (max %(max_lag).3f s)" % stats)
@@ -1,23 +1,192 @@
 __author__ = 'dano'
+import atexit
 import logging
 import logging.handlers
+import os
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG_FILENAME = 'sleeplogger.log'
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s]: %(message)s'
 
 log = logging.getLogger('sleep-logger')
 log.setLevel(logging.DEBUG)
+# Nothing is written anywhere until an entry point calls configure_logging, so importing pysleep creates no logfile
+log.addHandler(logging.NullHandler())
+
+
+if hasattr(logging.handlers, 'QueueHandler'):
+    QueueHandler = logging.handlers.QueueHandler
+    QueueListener = logging.handlers.QueueListener
+else:
+    # Python 2 has neither, so here are the parts of Python 3's that are used
+    class QueueHandler(logging.Handler):
+        """Puts each record on a queue for a QueueListener to write, instead of writing it"""
+        def __init__(self, record_queue):
+            logging.Handler.__init__(self)
+            self.queue = record_queue
+
+        def prepare(self, record):
+            # Format now, so the record can be written on another thread without holding on to its args
+            message = self.format(record)
+            record.msg = message
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        """Writes the records a QueueHandler queues to `handlers`, on a thread of its own"""
+        _sentinel = None
+
+        def __init__(self, record_queue, *handlers, **kwargs):
+            self.queue = record_queue
+            self.handlers = handlers
+            self.respect_handler_level = kwargs.get('respect_handler_level', False)
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def handle(self, record):
+            for handler in self.handlers:
+                if not self.respect_handler_level or record.levelno >= handler.level:
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    return
+                self.handle(record)
+
+        def stop(self):
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+
+class _ProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler which only queues records in the process that configured logging. A process forked from it
+    (e.g. a worker in post-analyze.py --jobs) has a copy of the queue but not the listener's thread, so there it
+    hands records straight to the listener's handlers instead.
+    """
+    def __init__(self, record_queue, listener):
+        QueueHandler.__init__(self, record_queue)
+        self.listener = listener
+        self.pid = os.getpid()
+
+    def emit(self, record):
+        if os.getpid() == self.pid:
+            QueueHandler.emit(self, record)
+        else:
+            self.listener.handle(record)
+
+
+_listener = None
+
+
+def configure_logging(filename=LOG_FILENAME, console_level=logging.DEBUG, file_level=logging.INFO):
+    """
+    Sends log messages to the console and to `filename`. Call once, at the start of an entry point.
+
+    Logging only puts each record on a queue; a thread of its own formats and writes them, so the thread that logged
+    (e.g. the one reading from the Teensy) never waits on the console or the SD card. Whatever is still queued is
+    written when the program exits.
+
+    :param filename: logfile for messages at `file_level` and above, or None for the console only
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+
+    # Create Console Logger
+    ch = logging.StreamHandler()
+    ch.setLevel(console_level)
+    ch.setFormatter(formatter)
+    handlers.append(ch)
+
+    # Create File logger
+    if filename is not None:
+        fh = logging.FileHandler(filename)
+        fh.setLevel(file_level)
+        fh.setFormatter(formatter)
+        handlers.append(fh)
+
+    record_queue = queue.Queue()
+    _listener = QueueListener(record_queue, *handlers, respect_handler_level=True)
+    log.addHandler(_ProcessQueueHandler(record_queue, _listener))
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class ReadingLog(object):
+    """
+    Logs readings as they arrive without a log message per reading: every `summary_seconds` it logs how many
+    readings arrived since the last summary, and their lowest, mean and highest movement values. Every
+    `sample_every`th reading is also logged on its own, at DEBUG.
+
+    Usage:
+        reading_log = ReadingLog()
+        reading_log.add(movement_value)
+        reading_log.flush()  # once readings stop, e.g. on a read timeout
+    """
+    SUMMARY_SECONDS = 60
+
+    def __init__(self, summary_seconds=SUMMARY_SECONDS, sample_every=None, logger=log):
+        """
+        :param sample_every: log every this many readings on their own (1 for every reading), or None for none
+        """
+        self.summary_seconds = summary_seconds
+        self.sample_every = sample_every
+        self.logger = logger
+
+        self.total_readings = 0
+        self._readings = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+        self._started = time.time()
 
-# Create File logger
-fh = logging.FileHandler('sleeplogger.log')
-fh.setLevel(logging.INFO)
+    def add(self, movement_value):
+        self.total_readings += 1
+        if self.sample_every and self.total_readings % self.sample_every == 0:
+            self.logger.debug("Read movement value: %d", movement_value)
 
-# Create Console Logger
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
+        self._readings += 1
+        self._sum += movement_value
+        if self._min is None or movement_value < self._min:
+            self._min = movement_value
+        if self._max is None or movement_value > self._max:
+            self._max = movement_value
 
-# Set Formatter
-formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s')
-ch.setFormatter(formatter)
-fh.setFormatter(formatter)
+        if time.time() - self._started >= self.summary_seconds:
+            self.flush()
 
-# Add handlers
-log.addHandler(ch)
-log.addHandler(fh)
\ No newline at end of file
+    def flush(self):
+        """Logs a summary of the readings since the last one, if there were any"""
+        now = time.time()
+        if self._readings:
+            self.logger.info("Read %d movement values in %.0f s (min %d, mean %.1f, max %d)",
+                             self._readings, now - self._started, self._min, float(self._sum) / self._readings,
+                             self._max)
+        self._readings = 0
+        self._sum = 0
+        self._min = self._max = None
+        self._started = now
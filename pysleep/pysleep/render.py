@@ -0,0 +1,108 @@
+"""
+Rendering a session's graphs straight to image files, for machines without a display.
+Unlike graphs.py this never touches pyplot or an interactive backend: matplotlib's Agg renderer is only imported
+once the first image is drawn, so importing this module is cheap.
+"""
+import os
+import numpy
+from utils import SleepAnalyzer, log
+
+IMAGE_FORMATS = ('png', 'svg')
+"""File formats PostSessionReport can write"""
+
+
+def decimate(x_values, y_values, num_bins):
+    """
+    Shrinks a series down to at most two points per bin (the lowest and highest y value in it), splitting the
+    x range into `num_bins` equal bins. With one bin per pixel of the plot, the plot looks the same as it would
+    with every point in it (every peak survives), but costs the same to draw however long the session was.
+
+    :param x_values: ascending x values
+    :param y_values: one y value per x value
+    :param num_bins: number of bins, usually the width of the plot in pixels
+    :return: (x_values, y_values) as numpy arrays
+    """
+    x_values = numpy.asarray(x_values, dtype=numpy.float64)
+    y_values = numpy.asarray(y_values, dtype=numpy.float64)
+    if len(y_values) <= 2 * num_bins:
+        return x_values, y_values
+
+    edges = numpy.linspace(x_values[0], x_values[-1], num_bins + 1)[:-1]
+    starts = numpy.unique(numpy.searchsorted(x_values, edges))
+    minimums = numpy.minimum.reduceat(y_values, starts)
+    maximums = numpy.maximum.reduceat(y_values, starts)
+    return numpy.repeat(x_values[starts], 2), numpy.column_stack((minimums, maximums)).ravel()
+
+
+def session_series(sleep_analyzer):
+    """
+    The same series PostSessionGraphs shows, as (title, x_values, y_values, style) tuples. Empty series are left out.
+    """
+    series = []
+    if sleep_analyzer.movement_episodes:
+        # Each big movement episode at its peak
+        series.append(('Big Movements',
+                       [episode.peak_index for episode in sleep_analyzer.movement_episodes],
+                       [episode.peak for episode in sleep_analyzer.movement_episodes],
+                       'r.'))
+    for title, values in (('Movement Coefficients', sleep_analyzer.movement_coefficients),
+                          ('Movement Sums', sleep_analyzer.movement_sums),
+                          ('Deteriorating Movement Sums', sleep_analyzer.deteriorating_movement_sums),
+                          ('Deteriorating Movement Sum Coefficients',
+                           sleep_analyzer.deteriorating_movement_sum_coefficients)):
+        if values:
+            series.append((title, numpy.arange(len(values)), values, 'r-'))
+    return series
+
+
+def render_session(sleep_analyzer, filename, width=1600, height_per_graph=300, dpi=100):
+    """
+    Draws the session's graphs, one above the other, into an image file.
+
+    :param sleep_analyzer: a SleepAnalyzer which has analyzed the session
+    :param filename: where to save the image. Its extension (.png or .svg) picks the format.
+    :param width: image width in pixels. Each series is decimated to this many bins before it is drawn.
+    :param height_per_graph: height in pixels of each graph
+    """
+    # Imported here so that nothing picks (or needs) a display-backed backend
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    series = session_series(sleep_analyzer)
+    figure = Figure(figsize=(float(width) / dpi, float(height_per_graph * max(1, len(series))) / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    figure.suptitle(str(sleep_analyzer.session_id))
+
+    for position, (title, x_values, y_values, style) in enumerate(series):
+        x_values, y_values = decimate(x_values, y_values, width)
+        subplot = figure.add_subplot(len(series), 1, position + 1)
+        subplot.set_title(title)
+        subplot.plot(x_values, y_values, style, linewidth=0.5, markersize=2)
+        subplot.set_xlim(x_values[0], max(x_values[-1], x_values[0] + 1))
+
+    figure.savefig(filename, dpi=dpi)
+    log.info("Graphs saved to %s" % filename)
+
+
+def report_filename(session_id, output_dir, image_format='png'):
+    """Image file for a session, named after its logfile: e.g. reports/03-06-2015_22-00-00.slp.csv.png"""
+    return os.path.join(output_dir, '%s.%s' % (os.path.basename(str(session_id)), image_format))
+
+
+class PostSessionReport(SleepAnalyzer):
+    """
+    Headless version of PostSessionGraphs: show() saves the session's graphs to an image file instead of
+    opening a window.
+    """
+    def __init__(self, output_dir='.', image_format='png', **kwargs):
+        super(PostSessionReport, self).__init__(**kwargs)
+        assert image_format in IMAGE_FORMATS, "Unsupported image format: %s" % image_format
+
+        self.output_dir = output_dir
+        """Directory the image is saved in"""
+
+        self.image_format = image_format
+
+    def show(self):
+        super(PostSessionReport, self).show()
+        render_session(self, report_filename(self.session_id, self.output_dir, self.image_format))
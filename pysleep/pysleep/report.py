@@ -0,0 +1,139 @@
+"""
+Summarizing many logfiles at once, for re-analyzing an archive of sessions
+"""
+import csv
+import multiprocessing
+from utils import SleepAnalyzer, open_sleep_file, timestamp_from_strings, log
+from render import render_session, report_filename
+from staging import EPOCH_SECONDS, WAKE_THRESHOLD
+from histogram import MovementHistogram
+
+REPORT_COLUMNS = ['session_id', 'entries', 'start', 'end', 'max', 'mode', 'mean', 'variance', 'median', 'p95',
+                  'movement_sum_mean', 'movement_sum_max', 'deteriorating_movement_sum_max', 'big_movements',
+                  'movement_episodes', 'asleep_minutes', 'awake_minutes', 'phase_changes', 'malformed_lines', 'error']
+"""Columns of the combined report, in order. Each is a key of the summary dicts made by summarize_file."""
+
+
+def summarize_file(filename, min_movement_value=0, min_movement_sum=0, start=None, end=None, output_dir=None,
+                   image_format='png', epoch_seconds=EPOCH_SECONDS, wake_threshold=WAKE_THRESHOLD):
+    """
+    Analyzes a single logfile in one batch, without any graphs, and summarizes the results.
+    Runs in a worker process when summarizing files in parallel, so it never raises: any problem with the file
+    is reported in the summary's 'error' instead.
+
+    :param start: if given, only analyze entries from this timestamp on
+    :param end: if given, only analyze entries from before this timestamp
+    :param output_dir: if given, also save the session's graphs as an image in this directory (see render_session)
+    :param epoch_seconds: length of the sleep/wake epochs (see staging.py)
+    :param wake_threshold: weighted epoch count at which an epoch is scored awake (see staging.WAKE_THRESHOLD)
+    :return: dict of summary statistics (see SleepAnalyzer.summary), and the session's MovementHistogram under
+             'histogram' for combine_summaries
+    """
+    try:
+        sleep_file = open_sleep_file(filename)
+        sleep_analyzer = SleepAnalyzer(min_movement_value=min_movement_value,
+                                       min_movement_sum=min_movement_sum,
+                                       session_id=filename,
+                                       epoch_seconds=epoch_seconds,
+                                       wake_threshold=wake_threshold)
+        if start is not None or end is not None:
+            indexes, timestamps, movement_values = sleep_file.slice_time(start, end)
+            sleep_analyzer.analyze_array(movement_values, timestamps, indexes)
+        else:
+            for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays():
+                sleep_analyzer.analyze_array(movement_values, timestamps, indexes)
+        sleep_file.close()
+        if output_dir:
+            render_session(sleep_analyzer, report_filename(filename, output_dir, image_format))
+        summary = sleep_analyzer.summary()
+        summary['malformed_lines'] = len(sleep_file.malformed_lines)
+        # Not a report column: combine_summaries merges the sessions' histograms
+        summary['histogram'] = sleep_analyzer.histogram
+        return summary
+    except (Exception, SystemExit) as e:
+        # SleepFile exits on files it can't open. Don't let that take down a worker process.
+        log.error("Unable to analyze %s: %r" % (filename, e))
+        return {'session_id': filename, 'error': repr(e)}
+
+
+def _summarize_file(arguments):
+    """Pool.map only passes one argument"""
+    filename, kwargs = arguments
+    return summarize_file(filename, **kwargs)
+
+
+def summarize_files(filenames, jobs=None, **kwargs):
+    """
+    Summarizes many logfiles, spread across a pool of `jobs` processes.
+
+    :param jobs: number of processes to use. Defaults to one per CPU.
+    :param kwargs: passed on to summarize_file
+    :return: list of summaries, in the same order as `filenames`
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    arguments = [(filename, kwargs) for filename in filenames]
+    if jobs == 1 or len(filenames) == 1:
+        return [_summarize_file(argument) for argument in arguments]
+
+    pool = multiprocessing.Pool(min(jobs, len(filenames)))
+    try:
+        # Waiting with a timeout lets a KeyboardInterrupt through, which a plain map() would swallow
+        summaries = pool.map_async(_summarize_file, arguments, chunksize=1).get(60 * 60 * 24 * 365)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return summaries
+
+
+def combine_summaries(summaries):
+    """
+    :return: a summary covering every session in `summaries` (leaving out any that couldn't be analyzed)
+    """
+    summaries = [summary for summary in summaries if not summary.get('error') and summary['entries']]
+    combined = {'session_id': 'All sessions (%d)' % len(summaries),
+                'entries': sum(summary['entries'] for summary in summaries),
+                'malformed_lines': sum(summary['malformed_lines'] for summary in summaries),
+                'big_movements': sum(summary['big_movements'] for summary in summaries),
+                'movement_episodes': sum(summary['movement_episodes'] for summary in summaries)}
+    if summaries:
+        combined['start'] = min((summary['start'] for summary in summaries), key=_timestamp)
+        combined['end'] = max((summary['end'] for summary in summaries), key=_timestamp)
+        for name in ('max', 'movement_sum_max', 'deteriorating_movement_sum_max'):
+            combined[name] = max(summary[name] for summary in summaries)
+        combined['movement_sum_mean'] = sum(summary['movement_sum_mean'] * summary['entries']
+                                            for summary in summaries) / combined['entries']
+        # The sessions' histograms add up to the histogram of every reading in them
+        histogram = MovementHistogram()
+        for summary in summaries:
+            histogram.merge(summary['histogram'])
+        combined.update(mode=histogram.mode, mean=histogram.mean, variance=histogram.variance,
+                        median=histogram.median, p95=histogram.percentile(95))
+    return combined
+
+
+def write_report(summaries, filename):
+    """
+    Writes one row per summary, plus a row combining them all, to a csv file
+    """
+    with open(filename, 'w') as report_file:
+        report_writer = csv.writer(report_file)
+        report_writer.writerow(REPORT_COLUMNS)
+        for summary in summaries + [combine_summaries(summaries)]:
+            report_writer.writerow([_format(summary.get(column)) for column in REPORT_COLUMNS])
+    log.info("Report saved to %s" % filename)
+
+
+def _timestamp(session_time):
+    """Converts a summary's start or end (MM-DD-YYYY_HH-MM-SS) into a timestamp, so that they can be compared"""
+    return timestamp_from_strings(*session_time.split('_'))
+
+
+def _format(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '%.3f' % value
+    return value
@@ -0,0 +1,278 @@
+"""
+Fixed-size rolling windows used by the per-entry analysis in SleepAnalyzer, and batch versions of the same
+calculations for when a whole session is available up front
+"""
+from collections import deque
+from itertools import islice
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+
+class RollingWindow(object):
+    """
+    Keeps the last `size` values pushed into it, along with running aggregates over them.
+    Every aggregate is updated as values enter and leave the window, so the cost of a push does not depend
+    on the size of the window.
+
+    Sums are kept exactly for integer values (movement values are integers), so `sum` is identical to
+    summing the window from scratch.
+
+    Usage:
+        window = RollingWindow(1000)
+        window.push(3)
+        print window.sum, window.mean, window.variance, window.min, window.max
+    """
+    def __init__(self, size):
+        assert size > 0, "RollingWindow size must be a positive integer, not: %s" % size
+
+        self.size = size
+        """Maximum number of values held in the window"""
+
+        self.values = deque(maxlen=size)
+        """The values currently in the window, oldest first"""
+
+        self.sum = 0
+        """Sum of the values currently in the window"""
+
+        self.sum_of_squares = 0
+        """Sum of the squares of the values currently in the window. Used for the variance."""
+
+        self._pushed = 0
+        """Total number of values ever pushed. Used to tell when a min/max candidate has left the window."""
+
+        self._min_candidates = deque()
+        """(position, value) pairs with increasing values. The front is always the window minimum."""
+
+        self._max_candidates = deque()
+        """(position, value) pairs with decreasing values. The front is always the window maximum."""
+
+    def push(self, value):
+        """
+        Adds a value to the window, dropping the oldest value if the window is full.
+
+        :param value: a number (usually a movement_value)
+        """
+        if len(self.values) == self.size:
+            expired = self.values[0]
+            self.sum -= expired
+            self.sum_of_squares -= expired * expired
+
+        self.values.append(value)
+        self.sum += value
+        self.sum_of_squares += value * value
+
+        # Anything pushed at or before this position has left the window
+        expired_position = self._pushed - self.size
+
+        while self._min_candidates and self._min_candidates[-1][1] >= value:
+            self._min_candidates.pop()
+        self._min_candidates.append((self._pushed, value))
+        if self._min_candidates[0][0] <= expired_position:
+            self._min_candidates.popleft()
+
+        while self._max_candidates and self._max_candidates[-1][1] <= value:
+            self._max_candidates.pop()
+        self._max_candidates.append((self._pushed, value))
+        if self._max_candidates[0][0] <= expired_position:
+            self._max_candidates.popleft()
+
+        self._pushed += 1
+
+    @property
+    def count(self):
+        """Number of values currently in the window"""
+        return len(self.values)
+
+    @property
+    def is_full(self):
+        return len(self.values) == self.size
+
+    @property
+    def mean(self):
+        if not self.values:
+            return 0.0
+        return float(self.sum) / len(self.values)
+
+    @property
+    def variance(self):
+        """Population variance of the values currently in the window"""
+        count = len(self.values)
+        if not count:
+            return 0.0
+        return max(0.0, (self.sum_of_squares - float(self.sum) * self.sum / count) / count)
+
+    @property
+    def min(self):
+        if not self._min_candidates:
+            return None
+        return self._min_candidates[0][1]
+
+    @property
+    def max(self):
+        if not self._max_candidates:
+            return None
+        return self._max_candidates[0][1]
+
+
+class RollingSlope(object):
+    """
+    Least-squares slope of the last `size` values pushed into it, taking the x value of each point to be
+    its position in the window (0 for the oldest). This is the same line LinearRegression would fit to the
+    window, but the sums it needs are kept up to date as values enter and leave the window, so a push costs
+    the same whatever the window size.
+
+    Usage:
+        slope = RollingSlope(50)
+        slope.push(3)
+        print slope.slope
+    """
+    def __init__(self, size):
+        assert size > 0, "RollingSlope size must be a positive integer, not: %s" % size
+
+        self.size = size
+        """Maximum number of values held in the window"""
+
+        self.values = deque(maxlen=size)
+        """The values currently in the window, oldest first"""
+
+        self.sum_y = 0
+        """Sum of the values currently in the window"""
+
+        self.sum_xy = 0
+        """Sum of each value in the window multiplied by its position in the window"""
+
+    def push(self, value):
+        """
+        Adds a value to the window, dropping the oldest value if the window is full.
+        Dropping the oldest value moves every other value one position closer to the front,
+        which takes sum_y (minus the dropped value) off of sum_xy.
+
+        :param value: a number (usually a deteriorating movement sum)
+        """
+        count = len(self.values)
+        if count == self.size:
+            expired = self.values[0]
+            self.sum_y -= expired
+            self.sum_xy -= self.sum_y
+            count -= 1
+
+        self.values.append(value)
+        self.sum_xy += count * value
+        self.sum_y += value
+
+    @property
+    def slope(self):
+        """Slope of the least-squares line through the window. 0.0 until there are two points to fit."""
+        count = len(self.values)
+        if count < 2:
+            return 0.0
+        sum_x = count * (count - 1) // 2
+        sum_xx = (count - 1) * count * (2 * count - 1) // 6
+        return float(count * self.sum_xy - sum_x * self.sum_y) / (count * sum_xx - sum_x * sum_x)
+
+
+class RetainedSeries(deque):
+    """
+    deque with a maxlen which can also be sliced like a list, so code written for a list of per-entry results (e.g.
+    movement_sums[-1000:]) works on the last maxlen of them too. Slices are lists. Slices near the end are taken
+    from the end, so the last few results cost the same to get however many are kept.
+    """
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return deque.__getitem__(self, key)
+        start, stop, step = key.indices(len(self))
+        if step < 0:
+            return list(self)[key]
+        if stop <= start:
+            return []
+        if start > len(self) // 2:
+            tail = list(islice(reversed(self), len(self) - start))
+            tail.reverse()
+            return tail[:stop - start:step]
+        return list(islice(self, start, stop, step))
+
+
+def entry_series(retain_entries=None, values=()):
+    """
+    Somewhere to keep a result per entry (e.g. SleepAnalyzer.movement_sums).
+
+    :param retain_entries: most results to keep, or None to keep every one
+    :param values: results to start with
+    :return: a list of `values`, or with `retain_entries`, a RetainedSeries which drops its oldest results past that
+             many
+    """
+    if retain_entries is None:
+        return list(values)
+    return RetainedSeries(values, maxlen=retain_entries)
+
+
+def rolling_sums(values, size, previous=()):
+    """
+    Batch version of RollingWindow.sum: the sum of the last `size` values after each value in `values`.
+
+    :param values: numpy array (or sequence) of integers
+    :param size: window size
+    :param previous: values already in the window before `values`, oldest first (e.g. RollingWindow.values)
+    :return: numpy array with one sum per value
+    """
+    values = numpy.asarray(values)
+    previous = numpy.asarray(list(previous)[-size:], dtype=values.dtype)
+    running_totals = numpy.concatenate(([0], numpy.cumsum(numpy.concatenate((previous, values)))))
+    ends = numpy.arange(len(previous) + 1, len(previous) + len(values) + 1)
+    return running_totals[ends] - running_totals[numpy.maximum(0, ends - size)]
+
+
+def deteriorating_sums(values, start=0):
+    """
+    Batch version of SleepAnalyzer's deteriorating_movement_sums: a running total which gains each value,
+    loses 1 per value, and never drops below 0.
+
+    :param values: numpy array (or sequence) of integers
+    :param start: the deteriorating sum before the first value
+    :return: numpy array with one deteriorating sum per value
+    """
+    totals = numpy.cumsum(numpy.asarray(values, dtype=numpy.int64) - 1)
+    # Every time the running total would have dropped below 0, it is clamped. The amount clamped off so far is
+    # the lowest the unclamped total has been (or -start, since the sum starts out that far above 0).
+    lowest = numpy.minimum.accumulate(numpy.concatenate(([-start], totals)))[1:]
+    return totals - lowest
+
+
+def rolling_slopes(values, size, previous=()):
+    """
+    Batch version of RollingSlope.slope: the least-squares slope of the last `size` values after each value in
+    `values`. Gives exactly the same results as pushing each value into a RollingSlope.
+
+    :param values: numpy array (or sequence) of integers
+    :param size: window size
+    :param previous: values already in the window before `values`, oldest first (e.g. RollingSlope.values)
+    :return: numpy array with one slope per value
+    """
+    values = numpy.asarray(values)
+    previous = list(previous)[-size:]
+    slopes = numpy.empty(len(values), dtype=numpy.float64)
+
+    # Until the window fills up, the window size changes with every value, so feed those through a RollingSlope
+    num_partial = min(len(values), max(0, size - len(previous) - 1))
+    rolling_slope = RollingSlope(size)
+    for value in previous:
+        rolling_slope.push(value)
+    for position in range(num_partial):
+        rolling_slope.push(values[position].item())
+        slopes[position] = rolling_slope.slope
+
+    num_full = len(values) - num_partial
+    if num_full > 0:
+        extended = numpy.concatenate((numpy.asarray(previous, dtype=values.dtype), values))
+        extended = numpy.ascontiguousarray(extended[len(previous) + num_partial - size + 1:])
+        windows = as_strided(extended, shape=(num_full, size), strides=(extended.strides[0], extended.strides[0]))
+        sum_y = windows.sum(axis=1)
+        sum_xy = windows.dot(numpy.arange(size, dtype=windows.dtype))
+        sum_x = size * (size - 1) // 2
+        sum_xx = (size - 1) * size * (2 * size - 1) // 6
+        if size < 2:
+            slopes[num_partial:] = 0.0
+        else:
+            numerators = (size * sum_xy - sum_x * sum_y).astype(numpy.float64)
+            slopes[num_partial:] = numerators / float(size * sum_xx - sum_x * sum_x)
+    return slopes
@@ -0,0 +1,198 @@
+"""
+Rotated sessions: a long session logged as a series of numbered segments (logs/<session>.0001.slp.csv,
+logs/<session>.0002.slp.csv, ...), each of which is gzipped once it is finished. Every segment is a complete logfile
+with its own header row, and SegmentedFile reads them all back as one logfile.
+"""
+import glob
+import gzip
+import os
+import re
+import shutil
+import struct
+from bisect import bisect_right
+from pysleeplogging import log
+
+SEGMENT_PATTERN = re.compile(r'^(.*)\.(\d{4})\.slp\.csv(\.gz)?$')
+"""Matches a segment's filename. Groups: the session's name (without .slp.csv), the segment number, and .gz"""
+
+
+def segment_filename(session_name, number):
+    """
+    :param session_name: the session's logfile name, e.g. logs/03-06-2015-22-00-00.slp.csv
+    :return: the name of the session's `number`th segment (counting from 1), e.g. logs/03-06-2015-22-00-00.0001.slp.csv
+    """
+    return '%s.%04d.slp.csv' % (session_name[:-len('.slp.csv')], number)
+
+
+def session_name_for(filename):
+    """
+    :return: the name of the session a segment belongs to (any other filename is returned unchanged)
+    """
+    match = SEGMENT_PATTERN.match(filename)
+    if match is None:
+        return filename
+    return match.group(1) + '.slp.csv'
+
+
+def session_segments(filename):
+    """
+    Finds the segments of a rotated session, given the session's name or any of its segments.
+    A segment which has both a gzipped and a plain copy was being compressed when the logger stopped, so the plain
+    copy is used.
+
+    :return: list of segment filenames in order, empty if the session wasn't rotated
+    """
+    session_name = session_name_for(filename)
+    segments = {}
+    for segment in glob.glob(session_name[:-len('.slp.csv')] + '.[0-9][0-9][0-9][0-9].slp.csv*'):
+        match = SEGMENT_PATTERN.match(segment)
+        if match is None:
+            # e.g. a segment's journal
+            continue
+        number = int(match.group(2))
+        if number not in segments or not match.group(3):
+            segments[number] = segment
+    return [segments[number] for number in sorted(segments)]
+
+
+def open_segment(filename):
+    """Opens a segment (gzipped or not) for reading bytes"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def segment_size(filename):
+    """
+    :return: size of the segment once uncompressed. A gzip file ends with this (modulo 4GB, far bigger than a segment).
+    """
+    if not filename.endswith('.gz'):
+        return os.path.getsize(filename)
+    with open(filename, 'rb') as segment:
+        segment.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', segment.read(4))[0]
+
+
+def compress_segment(filename):
+    """
+    Gzips a finished segment, then removes the uncompressed copy. The gzipped copy is written under a temporary name
+    and only renamed to <segment>.gz once it is complete and on disk, so nothing (e.g. the uploader) ever sees a
+    partly written .gz, and the uncompressed copy is only removed after that. A power loss part way through loses
+    nothing: the leftover temporary file is overwritten when recover_logfiles compresses the segment again.
+
+    :return: the gzipped segment's filename
+    """
+    compressed_filename = filename + '.gz'
+    temporary_filename = compressed_filename + '.tmp'
+    with open(filename, 'rb') as segment:
+        with open(temporary_filename, 'wb') as compressed_file:
+            compressed = gzip.GzipFile(os.path.basename(filename), 'wb', fileobj=compressed_file)
+            shutil.copyfileobj(segment, compressed)
+            compressed.close()
+            compressed_file.flush()
+            os.fsync(compressed_file.fileno())
+    os.rename(temporary_filename, compressed_filename)
+    os.remove(filename)
+    log.debug("Compressed %s" % compressed_filename)
+    return compressed_filename
+
+
+class SegmentedFile(object):
+    """
+    Read-only file object over the segments of a rotated session, which reads as if they were one logfile: the first
+    segment's header row, followed by every segment's entries. Supports the parts of the file interface SleepFile
+    uses (read, readline, iteration, tell, and seek to any position).
+    """
+    def __init__(self, segments):
+        self.segments = segments
+
+        self._starts = []
+        """Position in the combined file of the first byte each segment contributes"""
+
+        self._skips = []
+        """Bytes at the start of each segment that don't appear in the combined file (the header row, after the first)"""
+
+        position = 0
+        for number, segment in enumerate(segments):
+            skip = 0
+            if number:
+                with open_segment(segment) as segment_file:
+                    skip = len(segment_file.readline())
+            self._starts.append(position)
+            self._skips.append(skip)
+            position += segment_size(segment) - skip
+        self.size = position
+        """Size of the combined file"""
+
+        self._position = 0
+        self._segment_number = None
+        self._segment_file = None
+        self.seek(0)
+
+    def _open(self, number, offset):
+        """Moves to `offset` bytes into segment `number`'s part of the combined file"""
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_number = number
+        self._segment_file = open_segment(self.segments[number]) if number < len(self.segments) else None
+        if self._segment_file is not None:
+            self._segment_file.seek(self._skips[number] + offset)
+
+    def _next_segment(self):
+        if self._segment_file is None:
+            return False
+        self._open(self._segment_number + 1, 0)
+        return self._segment_file is not None
+
+    def read(self, size=-1):
+        chunks = []
+        while self._segment_file is not None and size != 0:
+            data = self._segment_file.read(size)
+            if data:
+                chunks.append(data)
+                self._position += len(data)
+                if size > 0:
+                    size -= len(data)
+            elif not self._next_segment():
+                break
+        return b''.join(chunks)
+
+    def readline(self):
+        while self._segment_file is not None:
+            line = self._segment_file.readline()
+            if line:
+                self._position += len(line)
+                return line
+            if not self._next_segment():
+                break
+        return b''
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        assert whence == os.SEEK_SET, "SegmentedFile can only seek to an absolute position"
+        if not self.segments:
+            self._position = 0
+            return
+        number = max(0, bisect_right(self._starts, offset) - 1)
+        self._open(number, offset - self._starts[number])
+        self._position = offset
+
+    def close(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._segment_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,195 @@
+"""
+Sleep/wake staging: readings are added up into fixed length epochs (a minute by default), and each epoch is scored
+from a weighted window of the epochs around it, the way actigraphy scores sleep (Cole-Kripke). SleepStager does this
+live, a reading at a time or a batch of readings at a time (e.g. a whole logfile), with identical results.
+"""
+import math
+from collections import deque
+import numpy
+
+UNKNOWN = 0
+"""Phase before enough of the session has been scored"""
+
+AWAKE = 1
+ASLEEP = 2
+
+PHASE_NAMES = {UNKNOWN: 'unknown', AWAKE: 'awake', ASLEEP: 'asleep'}
+
+EPOCH_SECONDS = 60
+"""Default epoch length"""
+
+COLE_KRIPKE_WEIGHTS = (404, 598, 326, 441, 1408, 508, 350)
+"""Cole-Kripke weights for one minute epochs: the four epochs before the scored epoch, the epoch itself, and the
+two after it"""
+
+COLE_KRIPKE_FUTURE_EPOCHS = 2
+
+WAKE_THRESHOLD = 1000000
+"""
+Default weighted sum of epoch counts at which an epoch is scored awake (Cole-Kripke's 1 / P). The published scale
+factor was fitted to a particular actigraph's activity counts rather than the Teensy's movement values, so this is a
+starting point rather than a calibrated value: it scores a minute of steady background readings (0-2 each) as asleep,
+and a minute of sustained movement as awake. Entry points take --wake-threshold; see the README for calibrating it
+against sessions with known sleep times.
+"""
+
+
+def epoch_number(timestamp, epoch_seconds):
+    """Epochs line up with the clock (e.g. on the minute), so every session splits into the same epochs"""
+    return int(math.floor(timestamp / epoch_seconds))
+
+
+class SleepStager(object):
+    """
+    Scores a live session into sleep/wake epochs with constant work per epoch: the counts of the last few epochs
+    are kept in a window, and each epoch is scored once the epochs after it that it is weighted with are complete.
+    So the current phase runs `future_epochs` epochs (plus the epoch in progress) behind the latest reading.
+    Epochs with no readings in them count as no movement.
+
+    Usage:
+        stager = SleepStager()
+        stager.add_listener(lambda timestamp, old_phase, new_phase: ...)
+        stager.add_reading(sleep_entry.timestamp, sleep_entry.movement_value)
+        stager.finish()
+    """
+    def __init__(self, epoch_seconds=EPOCH_SECONDS, weights=COLE_KRIPKE_WEIGHTS, future_epochs=COLE_KRIPKE_FUTURE_EPOCHS,
+                 wake_threshold=WAKE_THRESHOLD):
+        """
+        :param weights: integer weight of each epoch in the window, oldest first
+        :param future_epochs: how many of the weights are for epochs after the scored epoch
+        :param wake_threshold: weighted sums at least this big are scored awake
+        """
+        assert 0 <= future_epochs < len(weights)
+        self.epoch_seconds = epoch_seconds
+        self.weights = tuple(int(weight) for weight in weights)
+        self.future_epochs = future_epochs
+        self.wake_threshold = wake_threshold
+
+        self.epoch_starts = []
+        """Start timestamp of every scored epoch"""
+
+        self.counts = []
+        """Sum of the movement values in every scored epoch"""
+
+        self.scores = []
+        """Weighted sum of the epoch counts around every scored epoch"""
+
+        self.phases = []
+        """AWAKE or ASLEEP for every scored epoch"""
+
+        self.phase = UNKNOWN
+        """Phase of the last scored epoch"""
+
+        self.transitions = []
+        """(epoch start timestamp, new phase) for every change of phase, including the first epoch scored"""
+
+        self.listeners = []
+
+        self.finished = False
+
+        self._window = deque([0] * (len(self.weights) - 1 - future_epochs), maxlen=len(self.weights))
+        self._pending_counts = deque()
+        """Counts of epochs which are complete, but waiting for the epochs after them"""
+
+        self._epoch = None
+        """Number of the epoch in progress (see epoch_number)"""
+
+        self._epoch_count = 0
+        self._next_epoch_to_score = None
+
+    def add_listener(self, listener):
+        """Calls listener(epoch start timestamp, old phase, new phase) whenever the phase changes"""
+        self.listeners.append(listener)
+
+    def add_reading(self, timestamp, movement_value):
+        self.add_count(epoch_number(timestamp, self.epoch_seconds), movement_value)
+
+    def add_count(self, epoch, count):
+        """Adds `count` to epoch number `epoch`, first completing every epoch before it"""
+        assert not self.finished, "Session has already been finished"
+        if self._epoch is None:
+            self._epoch = self._next_epoch_to_score = epoch
+        while epoch > self._epoch:
+            self._complete_epoch()
+        self._epoch_count += count
+
+    def add_arrays(self, timestamps, movement_values):
+        """
+        Same as add_reading for every reading in the arrays, but adds the readings up per epoch, and scores the
+        epochs they complete, over whole arrays at once. The counts and weights are integers, so the scores (and so
+        the phases) come out exactly the same.
+        """
+        assert not self.finished, "Session has already been finished"
+        if not len(timestamps):
+            return
+        epochs = numpy.floor(numpy.asarray(timestamps, dtype=numpy.float64) / self.epoch_seconds).astype(numpy.int64)
+        if self._epoch is None:
+            self._epoch = self._next_epoch_to_score = int(epochs[0])
+        # As in add_count, a reading from before the epoch in progress (e.g. after the clock was set back) counts
+        # towards it
+        offsets = numpy.maximum(numpy.maximum.accumulate(epochs) - self._epoch, 0)
+        counts = numpy.bincount(offsets, weights=numpy.asarray(movement_values, dtype=numpy.int64))
+        # bincount adds up in floating point, exact for any count that fits in 53 bits
+        counts = numpy.rint(counts).astype(numpy.int64)
+        counts[0] += self._epoch_count
+
+        # Every epoch but the last is now complete
+        completed = counts[:-1]
+        self._epoch += len(completed)
+        self._epoch_count = int(counts[-1])
+        if not len(completed):
+            return
+        window = numpy.concatenate((numpy.asarray(self._window, dtype=numpy.int64), completed))
+        scores = []
+        if len(window) >= len(self.weights):
+            scores = numpy.correlate(window, numpy.asarray(self.weights, dtype=numpy.int64), mode='valid').tolist()
+            if len(self._window) == len(self.weights):
+                # The window was already full, and its epoch already scored
+                scores = scores[1:]
+        self._window.extend(completed[-len(self.weights):].tolist())
+        self._pending_counts.extend(completed.tolist())
+        for score in scores:
+            self._score(score)
+
+    def _complete_epoch(self):
+        self._window.append(self._epoch_count)
+        self._pending_counts.append(self._epoch_count)
+        self._epoch += 1
+        self._epoch_count = 0
+        if len(self._window) == len(self.weights):
+            self._score(sum(weight * count for weight, count in zip(self.weights, self._window)))
+
+    def _score(self, score):
+        """Scores the oldest epoch waiting to be scored, whose window of epochs has the weighted sum `score`"""
+        phase = AWAKE if score >= self.wake_threshold else ASLEEP
+        epoch_start = self._next_epoch_to_score * self.epoch_seconds
+        self._next_epoch_to_score += 1
+
+        self.epoch_starts.append(epoch_start)
+        self.counts.append(self._pending_counts.popleft())
+        self.scores.append(score)
+        self.phases.append(phase)
+        if phase != self.phase:
+            old_phase, self.phase = self.phase, phase
+            self.transitions.append((epoch_start, phase))
+            for listener in self.listeners:
+                listener(epoch_start, old_phase, phase)
+
+    def finish(self):
+        """
+        Completes the epoch in progress, and scores the last epochs as if the session carried on with no movement.
+        Call once the session is over. Calling it again does nothing.
+        """
+        if self.finished or self._epoch is None:
+            self.finished = True
+            return
+        self._complete_epoch()
+        while self._pending_counts:
+            self._window.append(0)
+            self._score(sum(weight * count for weight, count in zip(self.weights, self._window)))
+        self.finished = True
+
+    def minutes_in(self, phase):
+        """:return: minutes of the scored epochs spent in `phase`"""
+        return self.phases.count(phase) * self.epoch_seconds / 60.0
+
@@ -1,2 +0,0 @@
-__author__ = 'dano'
-
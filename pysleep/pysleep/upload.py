@@ -0,0 +1,401 @@
+"""
+Uploading finished logfiles to the fileserver over FTP, a few at a time. A transfer cut short (e.g. the Wi-Fi
+dropped) is picked up where it stopped next time, and a logfile is only removed once the server has all of it.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+import zlib
+from ftplib import FTP, all_errors as ftp_errors, error_perm as permission_error
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from pysleeplogging import log
+from segments import SEGMENT_PATTERN, session_name_for, session_segments
+
+MIN_SIZE_FOR_UPLOAD = 1000000
+"""Logfiles smaller than this (in bytes) aren't worth keeping, so they aren't uploaded. Segments are always uploaded."""
+
+UPLOAD_INTERVAL = 30 * 60
+"""Default seconds between looking for logfiles to upload, when uploading in the background"""
+
+
+class UploadError(Exception):
+    """The server's copy of a logfile doesn't match the local one"""
+
+
+def load_credentials(hostname=None, user=None, password=None):
+    """
+    The fileserver's hostname and login. Anything not passed in is read from settings.py, or failing that
+    default_settings.py.
+
+    :return: (hostname, user, password), or None if any of them is missing
+    """
+    credentials = {'HOSTNAME': hostname, 'USER': user, 'PASSWORD': password}
+    for name in credentials:
+        if credentials[name] is not None:
+            continue
+        for module in ('settings', 'default_settings'):
+            try:
+                credentials[name] = getattr(__import__(module), name)
+                break
+            except (ImportError, AttributeError):
+                pass
+        if credentials[name] is None:
+            log.warning("No %s provided in function call, credentials file, or default credentials file" %
+                        name.lower())
+            return None
+    return credentials['HOSTNAME'], credentials['USER'], credentials['PASSWORD']
+
+
+def local_logfiles(directory='logs', min_size=MIN_SIZE_FOR_UPLOAD):
+    """
+    :return: logfiles in `directory` which are ready to upload: finished logfiles of at least `min_size` bytes,
+        and gzipped segments of rotated sessions (uncompressed segments are still being written)
+    """
+    logfiles = []
+    candidates = [logfile for logfile in glob.glob(os.path.join(directory, '*.slp.csv'))
+                  if not SEGMENT_PATTERN.match(logfile)]
+    candidates += glob.glob(os.path.join(directory, '*.slp.csv.gz'))
+    for logfile in sorted(candidates):
+        if os.path.exists(logfile + '.wal'):
+            log.info("Skipping %s: sleeplog is still being written (or needs recovering)" % logfile)
+        elif logfile.endswith('.gz') and os.path.exists(logfile[:-len('.gz')]):
+            log.info("Skipping %s: segment is still being compressed" % logfile)
+        elif not SEGMENT_PATTERN.match(logfile) and os.path.getsize(logfile) < min_size:
+            log.info("Skipping %s: sleeplog is < %s bytes" % (logfile, min_size))
+        else:
+            logfiles.append(logfile)
+    return logfiles
+
+
+def parse_listing(lines):
+    """
+    Reads the sizes out of a LIST response in the usual Unix `ls -l` format, e.g.
+    -rw-r--r--   1 logfiler logfiler    5900000 Mar 06 22:00 03-06-2015-22-00-00.slp.csv
+
+    :return: dict of file sizes in bytes, by filename. Lines which can't be read (e.g. directories) are left out.
+    """
+    sizes = {}
+    for line in lines:
+        fields = line.split(None, 8)
+        if len(fields) < 9 or not fields[0].startswith('-'):
+            continue
+        try:
+            sizes[fields[8]] = int(fields[4])
+        except ValueError:
+            pass
+    return sizes
+
+
+class UploadReader(object):
+    """
+    Read-only file object over a logfile as it is sent to the server: gzipped on the fly if `compress` is set, or
+    as it is. Only a block of the logfile (and what it compresses to) is held in memory at a time, so there is no
+    temporary file and memory use doesn't grow with the logfile. Keeps the size and md5 of everything read so far,
+    so the server's copy can be checked without reading (or compressing) the logfile again.
+    """
+
+    BLOCK_SIZE = 64 * 1024
+    """Bytes of the logfile read (and compressed) at a time"""
+
+    def __init__(self, filename, compress=True, level=6):
+        self._file = open(filename, 'rb')
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        self._buffer = b''
+        self._finished = False
+
+        self.size = 0
+        """Number of bytes read so far"""
+
+        self.md5 = hashlib.md5()
+        """md5 of the bytes read so far"""
+
+        self.logfile_bytes = 0
+        """Number of bytes of the logfile used so far"""
+
+    def _fill(self, size):
+        """Reads (and compresses) blocks of the logfile until at least `size` bytes are ready, or it runs out"""
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        while not self._finished and (size < 0 or buffered < size):
+            block = self._file.read(self.BLOCK_SIZE)
+            self.logfile_bytes += len(block)
+            if not block:
+                self._finished = True
+                block = self._compressor.flush() if self._compressor else b''
+            elif self._compressor:
+                block = self._compressor.compress(block)
+            chunks.append(block)
+            buffered += len(block)
+        self._buffer = b''.join(chunks)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.size += len(data)
+        self.md5.update(data)
+        return data
+
+    def skip(self, size):
+        """
+        Reads past the first `size` bytes (e.g. the part the server already has).
+
+        :return: True if there is anything after them
+        """
+        while size > 0:
+            data = self.read(min(size, self.BLOCK_SIZE))
+            if not data:
+                break
+            size -= len(data)
+        self._fill(1)
+        return size == 0 and bool(self._buffer)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LogfileUploader(object):
+    """
+    Uploads every logfile ready to go (see local_logfiles) over a small pool of FTP connections. The server is
+    listed once up front, rather than once per logfile: a logfile the server already has part of is resumed from
+    where it stopped (with REST), and one it already has all of is just checked. Each logfile is checked against the
+    server's copy (size, plus md5 if the server supports XMD5) before it is removed locally.
+
+    Logfiles are gzipped on the fly as they are sent (see UploadReader), and stored on the server with .gz on the
+    end of their name. Segments of rotated sessions are already gzipped, so they are sent as they are.
+
+    Usage:
+        uploader = LogfileUploader(*load_credentials())
+        uploader.upload_all()
+    """
+
+    CONNECTIONS = 3
+    """Default number of logfiles uploaded at once"""
+
+    def __init__(self, hostname, user, password, directory='logs', remote_directory='logs', connections=CONNECTIONS,
+                 port=21, timeout=5, compress=True, min_size=MIN_SIZE_FOR_UPLOAD):
+        """
+        :param directory: local directory to upload logfiles from
+        :param remote_directory: directory on the server to upload them to
+        :param connections: most FTP connections open at once
+        :param compress: gzip logfiles as they are sent
+        :param min_size: logfiles smaller than this many bytes are left alone
+        """
+        self.hostname = hostname
+        self.user = user
+        self.password = password
+        self.directory = directory
+        self.remote_directory = remote_directory
+        self.connections = connections
+        self.port = port
+        self.timeout = timeout
+        self.compress = compress
+        self.min_size = min_size
+
+        self.stats = {}
+        """Counters from the last upload_all (see upload_all)"""
+
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        """:return: an FTP connection, logged in and in the remote directory, in binary mode"""
+        ftp = FTP(timeout=self.timeout)
+        ftp.connect(self.hostname, self.port)
+        ftp.login(self.user, self.password)
+        ftp.cwd(self.remote_directory)
+        ftp.voidcmd('TYPE I')
+        return ftp
+
+    def remote_sizes(self, ftp):
+        """:return: sizes of the files already in the remote directory, by filename"""
+        lines = []
+        ftp.retrlines('LIST', lines.append)
+        # Back to binary mode for SIZE and STOR (retrlines switches to ASCII)
+        ftp.voidcmd('TYPE I')
+        return parse_listing(lines)
+
+    def upload_all(self):
+        """
+        Uploads (or finishes uploading) every logfile ready to go, then removes them locally.
+
+        :return: dict of counters: 'uploaded' and 'resumed' logfiles, 'failed' logfiles (left to try again next
+            time), 'bytes_sent' to the server, 'logfile_bytes' of logfiles those bytes came from, and 'seconds' taken
+        """
+        started = time.time()
+        self.stats = {'uploaded': 0, 'resumed': 0, 'failed': 0, 'bytes_sent': 0, 'logfile_bytes': 0, 'seconds': 0.0}
+        logfiles = local_logfiles(self.directory, self.min_size)
+        if not logfiles:
+            return self.stats
+        log.info("Found local logfiles: %s" % logfiles)
+
+        try:
+            ftp = self.connect()
+            remote_sizes = self.remote_sizes(ftp)
+        except ftp_errors as e:
+            log.warning("Unable to reach the fileserver: %r" % e)
+            self.stats['failed'] = len(logfiles)
+            return self.stats
+
+        pending = queue.Queue()
+        for logfile in logfiles:
+            pending.put((logfile, remote_sizes.get(self.remote_name(logfile))))
+
+        # The connection used for the listing is the first worker's
+        workers = [threading.Thread(target=self._work, args=(pending, ftp), name="Upload 1")]
+        for number in range(1, min(self.connections, len(logfiles))):
+            workers.append(threading.Thread(target=self._work, args=(pending, None), name="Upload %d" % (number + 1)))
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # Left behind if every connection broke
+        self.stats['failed'] += pending.qsize()
+
+        self.stats['seconds'] = time.time() - started
+        log.info("Uploaded %(uploaded)d logfiles (%(resumed)d resumed, %(failed)d failed), %(bytes_sent)d bytes in "
+                 "%(seconds).1f s" % self.stats)
+        return self.stats
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _work(self, pending, ftp):
+        """Uploads logfiles off the `pending` queue until it's empty, over one connection"""
+        try:
+            if ftp is None:
+                ftp = self.connect()
+        except ftp_errors as e:
+            # The other connections carry on with the logfiles this one would have uploaded
+            log.warning("Unable to open another connection to the fileserver: %r" % e)
+            return
+        try:
+            while True:
+                try:
+                    logfile, remote_size = pending.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.upload_file(ftp, logfile, remote_size)
+                except (UploadError,) + tuple(ftp_errors) as e:
+                    log.warning("Upload of %s unsuccessful, will try again next time: %r" % (logfile, e))
+                    self._count('failed')
+                    if not isinstance(e, (UploadError, permission_error)):
+                        # The connection itself may be broken. Leave the rest to the other connections.
+                        break
+        finally:
+            try:
+                ftp.quit()
+            except ftp_errors:
+                ftp.close()
+
+    def remote_name(self, logfile):
+        """:return: the logfile's name on the server, marked with .gz if it is gzipped as it is sent"""
+        remote_name = os.path.basename(logfile)
+        if self.compress and not remote_name.endswith('.gz'):
+            remote_name += '.gz'
+        return remote_name
+
+    def upload_file(self, ftp, logfile, remote_size=None):
+        """
+        Sends whatever part of `logfile` the server doesn't have yet, checks the server's copy, and removes the
+        logfile (and, once a session is fully uploaded, its session index).
+
+        :param remote_size: size of the server's copy, or None if it hasn't got one
+        :raises UploadError: if the server's copy doesn't match, even after sending the whole logfile again
+        """
+        remote_name = self.remote_name(logfile)
+        offset = remote_size or 0
+        if offset:
+            log.info("Resuming %s from byte %d" % (remote_name, offset))
+            self._count('resumed')
+        else:
+            log.info("Uploading %s" % remote_name)
+
+        if not self.verify(ftp, remote_name, *self._send(ftp, logfile, remote_name, offset)):
+            if not offset:
+                raise UploadError("%s doesn't match the server's copy" % remote_name)
+            # What the server already had wasn't the start of this logfile. Send all of it.
+            log.warning("Server's copy of %s doesn't match, sending all of it again" % remote_name)
+            if not self.verify(ftp, remote_name, *self._send(ftp, logfile, remote_name, 0)):
+                raise UploadError("%s doesn't match the server's copy" % remote_name)
+
+        log.info("Upload of %s successful" % remote_name)
+        self._count('uploaded')
+        os.remove(logfile)
+        session_name = session_name_for(logfile)
+        if os.path.exists(session_name + '.idx') and not session_segments(session_name):
+            # The logfile's session index is no use without it (or, once rotated, without all of its segments)
+            os.remove(session_name + '.idx')
+
+    def _send(self, ftp, logfile, remote_name, offset):
+        """
+        Sends what is uploaded for `logfile` (see UploadReader) from byte `offset` on, to the same position in the
+        server's copy. Nothing is sent if the server's copy is already as long (or longer).
+
+        :return: (size, md5) of everything the server's copy should hold
+        """
+        with UploadReader(logfile, compress=self.remote_name(logfile) != os.path.basename(logfile)) as reader:
+            if reader.skip(offset):
+                ftp.storbinary('STOR %s' % remote_name, reader, rest=offset or None)
+                self._count('bytes_sent', reader.size - offset)
+            # Read anything left, for the size and md5 (when the server's copy is longer than the logfile)
+            while reader.read(UploadReader.BLOCK_SIZE):
+                pass
+            self._count('logfile_bytes', reader.logfile_bytes)
+        return reader.size, reader.md5.hexdigest()
+
+    def verify(self, ftp, remote_name, size, md5):
+        """
+        :return: True if the server's copy is `size` bytes long, and has the same md5 if the server can work it out
+            (with the XMD5 command many servers support)
+        """
+        if ftp.size(remote_name) != size:
+            return False
+        try:
+            response = ftp.sendcmd('XMD5 %s' % remote_name)
+        except permission_error:
+            # Server doesn't support XMD5. The size will have to do.
+            return True
+        return response.split()[-1].lower() == md5
+
+    def run(self, interval=UPLOAD_INTERVAL, stopping=None):
+        """
+        Uploads every `interval` seconds until `stopping` (a threading.Event) is set
+
+        Failures are logged rather than raised, so that a problem with the server never stops the caller.
+        """
+        stopping = stopping or threading.Event()
+        while not stopping.is_set():
+            try:
+                self.upload_all()
+            except Exception as e:
+                log.error("Unknown error uploading logfiles: %r" % e)
+            stopping.wait(interval)
+
+    def start(self, interval=UPLOAD_INTERVAL):
+        """
+        Uploads in the background, on a thread of its own, every `interval` seconds. Uploading is all waiting on the
+        network or SD card, so it doesn't hold up reading from the Teensy.
+
+        :return: threading.Event to set to stop uploading
+        """
+        stopping = threading.Event()
+        thread = threading.Thread(target=self.run, args=(interval, stopping), name="Logfile uploader")
+        thread.daemon = True
+        thread.start()
+        return stopping
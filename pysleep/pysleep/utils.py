@@ -2,92 +2,22 @@
 Shared library of classes for sleep logging, analyzing, and graphing
 """
 import sys
-import glob
 import os
 import math
-import csv
-import datetime
-import serial
+import struct
+import warnings
+from bisect import bisect_right
 import numpy
-from sklearn import linear_model
 from pysleeplogging import log
-
-LIGHT_FILE = '/sys/class/leds/led0/brightness'
-
-class SleepEntry(object):
-    """
-    A simple storage container for the sleep data.
-    Will use current date and time if either is not provided
-    """
-    def __init__(self, index, movement_value, date=None, time=None):
-        if date is None:
-            date = get_date_string()
-
-        if time is None:
-            time = get_time_string()
-
-        self.index = index
-        """Integer index representing which reading this was starting from 0"""
-
-        self.movement_value = movement_value
-        """Integer > 0 representing how much movement was recorded by the accelerometer"""
-
-        self.date = date
-        """String representing the date the sleep_entry was taken, in MM-DD-YYYY format.
-        Note: since most sleep tracking is done overnight (duh), the logfile will usually have 2 days
-        of date strings."""
-
-        self.time = time
-        """String representing the time the sleep_entry was taken in HH-MM-SS format (24 hour clock)"""
-
-    @staticmethod
-    def copy(sleep_entry, index=None, movement_value=None, date=None, time=None):
-        """
-        Constructor that returns a copy of the passed in sleep_entry, but with fields replaced
-        with the input arguments.
-
-        USAGE:
-        original_entry = SleepEntry(index=0, movement_value=1)
-        copy_entry = SleepEntry.copy(original_entry, movement_value=1000)
-
-        RESULTS:
-        print original_entry
-        > "03-06-2015,18-22-09,0,1"
-        print copy_entry
-        > "03-06-2015,18-22-09,0,1000"
-        """
-        assert type(sleep_entry) == SleepEntry, "first argument must be a SleepEntry"
-        return SleepEntry(index=index or sleep_entry.index,
-                          movement_value=movement_value or sleep_entry.movement_value,
-                          date=date or sleep_entry.date,
-                          time=time or sleep_entry.time)
-
-    @property
-    def datetime(self):
-        """
-        Combines the stored date and time of this sleep_entry into a datetime object.
-        This is useful for time comparisons.
-
-        USAGE:
-        if sleep_entry1.datetime > sleep_entry2.datetime:
-            print 'sleep_entry1 happened before sleep_entry2'
-        """
-        return datetime.datetime.strptime("%s_%s" % (self.date, self.time), "%m-%d-%Y_%H-%M-%S")
-
-    @staticmethod
-    def header_names():
-        """
-        Prints the currently supported headers for a correctly formatted CSV logfile.
-        This isn't used much besides for debugging, and for ensuring that logfiles read in
-        have the same csv header as this expected one.
-        """
-        return ['Date', 'Time', 'Index', 'Movement Value']
-
-    def __str__(self):
-        """
-        Override the string method so printing a sleep_entry looks pretty click
-        """
-        return "%s,%s,%s,%s" % (self.date, self.time, self.index, self.movement_value)
+from rolling import entry_series
+from staging import EPOCH_SECONDS, WAKE_THRESHOLD, AWAKE, ASLEEP
+from columns import SleepEntryColumns, SleepEntryRing, log_spilled_entries, sleep_entry_columns, session_span
+from analyzers import AnalyzerPipeline, MOVEMENT_HISTORY_SIZE, SLOPE_HISTORY_SIZE
+from segments import SEGMENT_PATTERN, SegmentedFile, session_name_for, session_segments
+from capture import LIGHT_FILE, SleepEntry, SleepReader, Teensy, serial_ports, TEENSY_USB_VENDOR_ID, usb_ids, \
+    find_teensy_ports, SessionIndex, OutFile, journal_filename_for, recover_logfile, recover_logfiles, LightSwitch, \
+    get_date_string, get_time_string, EPOCH, timestamp_from_strings, strings_from_timestamp, current_timestamp, \
+    check_correct_run_dir
 
 
 class SleepEntryStore(object):
@@ -99,8 +29,16 @@ class SleepEntryStore(object):
         sleep_entry = SleepEntry(0,0)
         storage.add_entry(sleep_entry)
     """
-    def __init__(self, session_id=None, **kwargs):
-        self.sleep_entries = []
+    def __init__(self, session_id=None, retain_entries=None, **kwargs):
+        """
+        :param retain_entries: only keep the last this many entries in memory (see SleepEntryRing), or None to keep
+                               them all. Subclasses keep their own per-entry results for as long.
+        """
+        self.retain_entries = retain_entries
+
+        self.sleep_entries = sleep_entry_columns(retain_entries)
+        """Every SleepEntry added this session (or the last retain_entries of them). Use the column properties
+        (e.g. sleep_entries.movement_values) to look at the whole session at once."""
 
         self.session_id = session_id
 
@@ -124,11 +62,12 @@ class SleepEntryStore(object):
         Subclasses can look at all the existing data and perform final analysis on the sleepdata as a whole
         at this point.
         """
-        pass
+        if self.retain_entries is not None:
+            self.sleep_entries.flush()
 
     @property
     def num_values_recorded(self):
-        return len(self.sleep_entries)
+        return self.sleep_entries.num_added
 
     @property
     def next_available_index(self):
@@ -140,16 +79,32 @@ class SleepEntryStore(object):
         return self.num_values_recorded - 1
 
 
+def _stage_attribute(stage_name, attribute, doc):
+    """Property of a SleepAnalyzer which reads `attribute` of one of its analysis stages"""
+    return property(lambda self: getattr(self.analysis.stages[stage_name], attribute), doc=doc)
+
+
 class SleepAnalyzer(SleepEntryStore):
     """
     Subclass of SleepEntryStore which performs data analysis on each entry as it is added to the datastore,
     as well as post-session analysis.
+
+    The analysis is every stage in analyzers.py, run through an AnalyzerPipeline (self.analysis). Their results can
+    be read from the analyzer (e.g. self.movement_sums) as well as from the stages.
     """
 
-    MOVEMENT_HISTORY_SIZE = 1000
+    MOVEMENT_HISTORY_SIZE = MOVEMENT_HISTORY_SIZE
     """Number of sleepentries to use for the short-term movement analysis. """
 
-    def __init__(self, min_movement_sum=0, min_movement_value=0, **kwargs):
+    SLOPE_HISTORY_SIZE = SLOPE_HISTORY_SIZE
+    """Number of deteriorating_movement_sums to fit a line through for the deteriorating_movement_sum_coefficients"""
+
+    STAGES = ('max', 'histogram', 'big-movements', 'movement-sums', 'deteriorating-sums', 'deteriorating-slope',
+              'staging')
+    """Analysis stages run on every entry. The entries themselves are kept by the SleepEntryStore."""
+
+    def __init__(self, min_movement_sum=0, min_movement_value=0, epoch_seconds=EPOCH_SECONDS,
+                 wake_threshold=WAKE_THRESHOLD, **kwargs):
         super(SleepAnalyzer, self).__init__(**kwargs)
 
         self.min_movement_sum = min_movement_sum
@@ -157,25 +112,36 @@ class SleepAnalyzer(SleepEntryStore):
 
         self.min_movement_value = min_movement_value
 
-        self.max_value = 0
-        """Max value recorded this session. Not very useful, but a simple example of what the SleepAnalyzer can do"""
+        self.movement_coefficients = entry_series(self.retain_entries)
 
-        self.occurrences_of = {}
-        """Key-Value store where the Key is the movement_value,
-        and the Value is the number of times it has occurred (Mode)"""
+        self.analysis = AnalyzerPipeline(self.STAGES, session_id=self.session_id, timed=False,
+                                         min_movement_value=min_movement_value, epoch_seconds=epoch_seconds,
+                                         wake_threshold=wake_threshold,
+                                         retain_entries=self.retain_entries,
+                                         movement_history_size=self.MOVEMENT_HISTORY_SIZE,
+                                         slope_history_size=self.SLOPE_HISTORY_SIZE)
+        """Runs the STAGES on each entry (see analyzers.py)"""
 
-        self.phase = 0
-        """Current sleep phase."""
+    max_value = _stage_attribute('max', 'max_value', "Max value recorded this session")
 
-        self.movement_coefficients = []
+    histogram = _stage_attribute('histogram', 'histogram', "Counts of the movement values, for the mode, mean, "
+                                                           "variance and percentiles (see histogram.py)")
 
-        self.big_movement_entries = []
+    movement_episodes = _stage_attribute('big-movements', 'movement_episodes',
+                                         "Runs of consecutive entries with movement values over min_movement_value "
+                                         "(see episodes.py)")
 
-        self.movement_sums = []
+    movement_sums = _stage_attribute('movement-sums', 'movement_sums',
+                                     "Sum of the last MOVEMENT_HISTORY_SIZE movement values, for every entry")
 
-        self.deteriorating_movement_sums = [0, 0]
+    deteriorating_movement_sums = _stage_attribute('deteriorating-sums', 'deteriorating_movement_sums',
+                                                   "Running sum of the movement values which loses 1 per entry")
 
-        self.deteriorating_movement_sum_coefficients = [0, 0]
+    deteriorating_movement_sum_coefficients = _stage_attribute(
+        'deteriorating-slope', 'deteriorating_movement_sum_coefficients',
+        "Slope of the last SLOPE_HISTORY_SIZE deteriorating_movement_sums, for every entry")
+
+    stager = _stage_attribute('staging', 'stager', "Scores the session into sleep/wake epochs (see staging.py)")
 
     def add_entry(self, sleep_entry):
         """This function is run immediately after the entry has been stored in the SleepEntryStore (parent.__init__).
@@ -184,48 +150,41 @@ class SleepAnalyzer(SleepEntryStore):
         # Call parent, to add value to SleepEntryStore
         super(SleepAnalyzer, self).add_entry(sleep_entry)
 
-        # Add to big_movement_entries
-        if sleep_entry.movement_value > self.min_movement_value:
-            self.big_movement_entries.append(sleep_entry)
-
-        # Add the movement_sum
-        num_entries = self.MOVEMENT_HISTORY_SIZE * -1
-        movement_sum = sum([x.movement_value for x in self.sleep_entries[num_entries:]])
-        self.movement_sums.append(movement_sum)
-
-
-        self.deteriorating_movement_sums.append(self.deteriorating_movement_sums[-1] + sleep_entry.movement_value - 1)
-        if self.deteriorating_movement_sums[-1] < 0:
-            self.deteriorating_movement_sums[-1] = 0
+        self.analysis.add_entry(sleep_entry)
 
-        y_values = [[y] for y in self.deteriorating_movement_sums[-50:]]
-        x_values = [[x] for x in range(0, len(y_values))]
-        regr = linear_model.LinearRegression()
-        regr.fit(x_values, y_values)
-        self.deteriorating_movement_sum_coefficients.append(regr.coef_[0][0])
+    def analyze_array(self, movement_values, timestamps, indexes=None):
+        """
+        Batch version of add_entry, for when many entries are available at once (e.g. a whole logfile).
+        Stores the entries and updates every analysis result exactly as if each entry had been passed to
+        add_entry in turn, but computes them over whole numpy arrays instead of one entry at a time.
 
-        # Compare to max
-        movement_value = sleep_entry.movement_value
-        if movement_value > self.max_value:
-            self.max_value = movement_value
+        Subclasses which hook add_entry need to see every entry, so for them the entries are passed to
+        add_entry one at a time instead.
 
-        # Adjust self.occurances_of
-        if movement_value not in self.occurrences_of.keys():
-            self.occurrences_of[movement_value] = 1
-        else:
-            self.occurrences_of[movement_value] += 1
+        :param movement_values: array of movement values
+        :param timestamps: array of timestamps (see timestamp_from_strings), one per movement value
+        :param indexes: array of sleep entry indexes. Defaults to counting up from next_available_index.
+        """
+        movement_values = numpy.asarray(movement_values, dtype=numpy.int64)
+        num_values = len(movement_values)
+        if indexes is None:
+            indexes = numpy.arange(self.next_available_index, self.next_available_index + num_values)
 
+        if self._hooks_add_entry():
+            for index, timestamp, movement_value in zip(indexes, timestamps, movement_values):
+                self.add_entry(SleepEntry(int(index), int(movement_value), timestamp=float(timestamp)))
+            return
 
+        if not num_values:
+            return
 
-        # x_values = [[x.index] for x in self.last_entries]
-        # y_values = [[y.movement_value] for y in self.last_entries]
-        # movement_values = [[y.movement_value] for y in self.last_entries]
-        # regr = linear_model.LinearRegression()
-        # regr.fit(x_values, y_values)
-        # self.movement_coefficients.append(regr.coef_[0][0])
+        self.sleep_entries.extend(indexes, timestamps, movement_values)
+        self.analysis.analyze_array(movement_values, timestamps, indexes)
 
-        # if sum([x.movement_value for x in self.last_entries]) > self.min_movement_sum:
-        #     print "Analyzed: %s    History Sum: %d" % (sleep_entry, sum(self.last_entries))
+    def _hooks_add_entry(self):
+        """True if a subclass overrides add_entry"""
+        add_entry = type(self).add_entry
+        return getattr(add_entry, '__func__', add_entry) is not SleepAnalyzer.__dict__['add_entry']
 
     def show(self):
         """
@@ -233,104 +192,54 @@ class SleepAnalyzer(SleepEntryStore):
         """
         super(SleepAnalyzer, self).show()
         log.info("Max: %d" % self.max_value)
-        most_occurrences = max(self.occurrences_of)
-        log.info("Mode: %s   Occurences: %d" %
-                 ([k for k in self.occurrences_of if self.occurrences_of[k] == most_occurrences], most_occurrences))
-        log.info("Mean: %d" % numpy.mean([sleep_entry.movement_value for sleep_entry in self.sleep_entries]))
-
-    @property
-    def last_entries(self):
-        """Last X movements. Useful for analysis that needs to look at movement over the last few readings.
-        Technically you could draw this from the last X entries of self.sleep_entries, but its simpler to keep it up
-        to date here."""
-        return self.sleep_entries[(self.MOVEMENT_HISTORY_SIZE * -1):]
-
-    @property
-    def last_movement_sum_coefficients(self):
-        return self.movement_coefficients[(self.MOVEMENT_HISTORY_SIZE * -1):]
-
-class SleepReader(object):
-    """
-    Base class for input devices. Subclasses should implement the get_next_sleep_entry method, and is_ready.
-    All methods should call parent to keep sleep index updated.
-    """
-    def __init__(self, **kwargs):
-        self.next_available_index = 0
-
-    def sleep_entries(self):
-        self.next_available_index += 1
-        return
-
-    def show_progress(self):
-        pass
-
-
-class Teensy(SleepReader):
-    def __init__(self, **kwargs):
-        super(Teensy, self).__init__(**kwargs)
-        self.teensy = None
-        """Serial object"""
-
-        log.info("Searching for USB device")
-        while self.teensy is None:
-            self.teensy = self._get_teensy_usb()
-
-    def _get_teensy_usb(self):
-        """Searches, opens, and returns a serial port object connected to the Teensy.
-
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
-        :returns:
-            An initialized serial object (hopefully) connected to the Teensy
+        if self.histogram.count:
+            log.info("Mode: %s   Occurences: %d" % (self.histogram.mode, self.histogram.occurrences(self.histogram.mode)))
+            log.info("Mean: %.2f   Variance: %.2f   Median: %s   95th percentile: %s" %
+                     (self.histogram.mean, self.histogram.variance, self.histogram.median,
+                      self.histogram.percentile(95)))
+        log.info("Big movements: %d in %d episodes" % (self.movement_episodes.num_entries, len(self.movement_episodes)))
+        self.stager.finish()
+        log.info("Asleep: %.0f min   Awake: %.0f min   Phase changes: %d" %
+                 (self.stager.minutes_in(ASLEEP), self.stager.minutes_in(AWAKE),
+                  max(0, len(self.stager.transitions) - 1)))
+
+    def summary(self):
         """
-        if sys.platform.startswith('win'):
-            log.debug("Using windows system.")
-            ports = ['COM' + str(i + 1) for i in range(256)]
+        The session's analysis results boiled down to a handful of numbers, e.g. for a report covering many sessions.
+        The session is taken to be over, so the last epochs are scored (see SleepStager.finish).
+        Every statistic covers the whole session, even if only the last retain_entries entries are still kept.
 
-        elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-            # this is to exclude your current terminal "/dev/tty"
-            log.debug("Using linux system")
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-
-        elif sys.platform.startswith('darwin'):
-            log.debug("Using darwin (Apple) system")
-            ports = glob.glob('/dev/tty.*')
-
-        else:
-            log.error("Unsupported / uncrecognized platform")
-            raise EnvironmentError('Unsupported platform')
-
-        for port in ports:
-            log.debug("Found available port: %s" % port)
-
-        # Method 1: Match via ready-to-read serial ports
-        for port in ports:
-            log.debug("Checking: %s" % port)
-            try:
-                teensy = serial.Serial(port=port, timeout=1)
-                if teensy.read(4) != '':
-                    log.info("Using %s" % port)
-                    return teensy
-            except (OSError, serial.SerialException):
-                pass
+        :return: dict of summary statistics
+        """
+        summary = {'movement_sum_mean': None, 'movement_sum_max': None}
+        summary.update(self.analysis.summary())
+        summary.update(session_span(self.sleep_entries))
+        summary['session_id'] = self.session_id
+        return summary
 
-    def sleep_entries(self):
-        """Gets new data from the provided teensy object (via readline)
-        and converts it into an integer.
+    @property
+    def phase(self):
+        """Current sleep phase (staging.UNKNOWN, AWAKE or ASLEEP), a few epochs behind the latest entry"""
+        return self.stager.phase
 
-        :returns:
-            Integer value representing movement as determined by teensy, or None
-        """
-        super(Teensy, self).sleep_entries()
+    @property
+    def phase_transitions(self):
+        """(epoch start timestamp, new phase) for every change of sleep phase so far"""
+        return self.stager.transitions
 
-        for line in self.teensy:
-            raw_value = line.strip()
-            assert raw_value is not '', "Teensy returned empty string"
-            movement_value = int(raw_value)
+    def add_phase_listener(self, listener):
+        """Calls listener(epoch start timestamp, old phase, new phase) whenever the sleep phase changes"""
+        self.stager.add_listener(listener)
 
-            log.info("Read movement value: %d" % movement_value)
-            yield SleepEntry(self.next_available_index, movement_value)
+    @property
+    def last_entries(self):
+        """Last MOVEMENT_HISTORY_SIZE entries (fewer if retain_entries is smaller). Useful for analysis that needs to
+        look at movement over the last few readings."""
+        return self.sleep_entries[-self.MOVEMENT_HISTORY_SIZE:]
 
+    @property
+    def last_movement_sum_coefficients(self):
+        return self.movement_coefficients[(self.MOVEMENT_HISTORY_SIZE * -1):]
 
 class SleepFile(SleepReader):
     """Wrapper for a python file object, providing a simple interface to read sleep data from the file.
@@ -339,24 +248,62 @@ class SleepFile(SleepReader):
         The constructor is passed in a filename. After instantiation is complete, calls to get_next_sleep_entry will
         read in a new line from the file, and construct and return a SleepEntry from the data."""
 
+    CHUNK_SIZE = 4 * 1024 * 1024
+    """Number of bytes sleep_entry_arrays reads and parses at a time"""
+
     def __init__(self, filename, **kwargs):
-        """Opens the specified file, and reads the header line"""
+        """
+        Opens the specified file, and reads the header line.
+        A rotated session can be opened by its name (or any of its segments' names), and reads as one logfile.
+        """
         super(SleepFile, self).__init__(**kwargs)
 
         self.last_sleep_entry = None
         """Used mostly for debugging malformed csv files. Constantly updated with the last SleepEntry
         that was successfully read in."""
 
+        self.malformed_lines = []
+        """Line numbers (starting from 1, the header) of every line which couldn't be read by sleep_entry_arrays"""
+
+        self.segments = []
+        """Segment filenames, if the file is a rotated session"""
+        if SEGMENT_PATTERN.match(filename) or not os.path.exists(filename):
+            self.segments = session_segments(filename)
+            if self.segments:
+                filename = session_name_for(filename)
+
         try:
-            self._file = open(filename, 'r')
-            self.total_size = os.path.getsize(filename)
+            if self.segments:
+                self._file = SegmentedFile(self.segments)
+                self.total_size = self._file.size
+            else:
+                self._file = open(filename, 'r')
+                self.total_size = os.path.getsize(filename)
             header = self._file.readline().strip()
+            if not isinstance(header, str):
+                header = header.decode('ascii', 'replace')
             self.total_read = len(header)
             log.info("CSV Headers: %s" % header)
         except Exception as e:
             log.error("Couldn't open input file: %s" % e)
             sys.exit(1)
 
+        self.header = header.split(',')
+        """Column names, in the order they appear in the file"""
+        if sorted(self.header) != sorted(SleepEntry.header_names()):
+            log.warning("Unrecognized CSV headers, assuming: %s" % ','.join(SleepEntry.header_names()))
+            self.header = SleepEntry.header_names()
+
+        self.filename = filename
+
+        self.data_start = self._file.tell()
+        """Byte offset of the first line after the header"""
+
+        self.line_number = 1
+        """Number of lines read so far by sleep_entry_arrays (or skipped over by seeking), including the header"""
+
+        self._session_index = None
+
     def sleep_entries(self):
         """Probably one of the most complicated functions in this whole program. This function yields a new SleepEntry
          every time it is iterated over. WHAT? Yeah, that's what it does. It basically makes it so that you can
@@ -368,6 +315,11 @@ class SleepFile(SleepReader):
             for sleep_entry in sleep_file.sleep_entries:
                 print sleep_entry
         """
+        date_column = self.header.index('Date')
+        time_column = self.header.index('Time')
+        index_column = self.header.index('Index')
+        movement_value_column = self.header.index('Movement Value')
+
         for line in self._file:
             self.total_read += len(line)
             if line == '':
@@ -381,10 +333,10 @@ class SleepFile(SleepReader):
 
                 try:
                     # Convert numbers to integers, and dates/timeis
-                    date = values[1]
-                    time = values[2]
-                    index = int(values[0])
-                    movement_value = int(values[3])
+                    date = values[date_column]
+                    time = values[time_column]
+                    index = int(values[index_column])
+                    movement_value = int(values[movement_value_column])
 
                     self.last_sleep_entry = SleepEntry(index, movement_value, date, time)
 
@@ -394,75 +346,500 @@ class SleepFile(SleepReader):
                 except ValueError:
                     log.error("Malformed sleepfile: %s    Last correct line: %s" % (values, self.last_sleep_entry))
 
+    def sleep_entry_arrays(self, chunk_size=CHUNK_SIZE):
+        """
+        Bulk version of sleep_entries. Reads the file `chunk_size` bytes at a time, and yields the entries of each
+        chunk as numpy arrays, ready to be passed to SleepAnalyzer.analyze_array:
+
+         Example:
+            sleep_file = SleepFile('sample_file.slp.csv')
+            for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays():
+                sleep_analyzer.analyze_array(movement_values, timestamps, indexes)
+
+        Each chunk is parsed all at once by numpy. Chunks with malformed lines are parsed again line by line, so
+        that the malformed lines can be logged (and added to self.malformed_lines) and the rest of the chunk kept.
+        """
+        leftover = b''
+        while True:
+            data = self._file.read(chunk_size)
+            if not isinstance(data, bytes):
+                data = data.encode('ascii', 'replace')
+            self.total_read += len(data)
+
+            if data:
+                data = leftover + data
+                end = data.rfind(b'\n') + 1
+                if not end:
+                    leftover = data
+                    continue
+                data, leftover = data[:end], data[end:]
+            elif leftover:
+                # Last line of the file, without a newline at the end
+                data, leftover = leftover + b'\n', b''
+            else:
+                break
+
+            num_lines = data.count(b'\n')
+            arrays = self._parse_chunk(data, num_lines)
+            if arrays is None:
+                arrays = self._parse_chunk_lines(data, self.line_number)
+            self.line_number += num_lines
+            if len(arrays[0]):
+                yield arrays
+
+    def _parse_chunk(self, data, num_lines):
+        """
+        Parses a chunk of whole lines in one go, by turning every '-' and ',' into a space and reading the
+        chunk in as one long list of numbers (8 per line: month, day, year, hours, minutes, seconds, index and
+        movement value, in the order of the file's columns).
+
+        :return: (indexes, timestamps, movement_values) arrays, or None if any line in the chunk is malformed
+        """
+        characters = numpy.frombuffer(data, dtype=numpy.uint8)
+        line_ends = numpy.flatnonzero(characters == ord('\n'))
+        line_starts = numpy.concatenate(([0], line_ends[:-1] + 1))
+        is_blank = line_ends - line_starts <= 1
+        commas = numpy.add.reduceat((characters == ord(',')).view(numpy.uint8), line_starts, dtype=numpy.int32)
+        dashes = numpy.add.reduceat((characters == ord('-')).view(numpy.uint8), line_starts, dtype=numpy.int32)
+        if not numpy.all(is_blank | ((commas == 3) & (dashes == 4))):
+            return None
+
+        with warnings.catch_warnings():
+            # numpy warns when it finds something that isn't a number. That's a malformed line, handled below.
+            warnings.simplefilter('ignore')
+            numbers = numpy.fromstring(data.replace(b'-', b' ').replace(b',', b' '), dtype=numpy.int64, sep=' ')
+        num_entries = num_lines - numpy.count_nonzero(is_blank)
+        if len(numbers) != num_entries * 8:
+            return None
+        numbers = numbers.reshape(num_entries, 8)
+
+        fields = {}
+        position = 0
+        for name in self.header:
+            width = 3 if name in ('Date', 'Time') else 1
+            fields[name] = numbers[:, position:position + width]
+            position += width
+        month, day, year = fields['Date'].T
+        hours, minutes, seconds = fields['Time'].T
+
+        valid = ((month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) &
+                 (hours < 24) & (minutes < 60) & (seconds < 60))
+        if not numpy.all(valid):
+            return None
+
+        timestamps = timestamps_from_fields(year, month, day, hours, minutes, seconds)
+        return fields['Index'][:, 0], timestamps.astype(numpy.float64), fields['Movement Value'][:, 0]
+
+    def _parse_chunk_lines(self, data, line_number):
+        """
+        Slow version of _parse_chunk, for chunks with malformed lines in them. Logs each malformed line.
+
+        :param line_number: number of lines in the file before this chunk
+        :return: (indexes, timestamps, movement_values) arrays of the lines which could be read
+        """
+        indexes = []
+        timestamps = []
+        movement_values = []
+        for line in data.decode('ascii', 'replace').split('\n')[:-1]:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                index, timestamp, movement_value = self._parse_line(line)
+            except ValueError:
+                log.error("Malformed sleepfile line %d: %s" % (line_number, line.strip()))
+                self.malformed_lines.append(line_number)
+                continue
+            indexes.append(index)
+            timestamps.append(timestamp)
+            movement_values.append(movement_value)
+        return (numpy.array(indexes, dtype=numpy.int64),
+                numpy.array(timestamps, dtype=numpy.float64),
+                numpy.array(movement_values, dtype=numpy.int64))
+
+    def _parse_line(self, line):
+        """
+        :return: (index, timestamp, movement_value) of a single line of the file
+        :raises ValueError: if the line is malformed
+        """
+        values = line.strip().split(',')
+        if len(values) != len(self.header):
+            raise ValueError("expected %d columns" % len(self.header))
+        columns = dict(zip(self.header, values))
+        return (int(columns['Index']),
+                timestamp_from_strings(columns['Date'], columns['Time']),
+                int(columns['Movement Value']))
+
+    @property
+    def session_index(self):
+        """
+        The SessionIndex of this file. Loaded from the file's sidecar index if there is one (OutFile writes one
+        while logging), otherwise built by reading through the file once, and saved as the sidecar for next time.
+        """
+        if self._session_index is None:
+            index_filename = SessionIndex.filename_for(self.filename)
+            self._session_index = SessionIndex.load(index_filename, self.total_size)
+            if self._session_index is None:
+                self._session_index = self._build_session_index()
+                self._session_index.save(index_filename)
+        return self._session_index
+
+    def _build_session_index(self):
+        session_index = SessionIndex()
+        with SegmentedFile(self.segments) if self.segments else open(self.filename, 'rb') as logfile:
+            logfile.seek(self.data_start)
+            offset = self.data_start
+            line_number = 1
+            next_checkpoint = line_number + 1
+            for line in logfile:
+                line_number += 1
+                if line_number >= next_checkpoint:
+                    try:
+                        index, timestamp, movement_value = self._parse_line(line.decode('ascii', 'replace'))
+                        session_index.add(index, timestamp, offset, line_number)
+                        next_checkpoint = line_number + SessionIndex.INTERVAL
+                    except ValueError:
+                        # Malformed line. Use the next one as the checkpoint instead.
+                        pass
+                offset += len(line)
+        return session_index
+
+    def _seek(self, checkpoints, target, key):
+        """
+        Moves the file to the first entry at or after `target`, starting from the last checkpoint before it.
+
+        :param checkpoints: the session index's list of indexes or timestamps
+        :param key: position of the value to compare with `target` in the tuples returned by _parse_line
+        """
+        session_index = self.session_index
+        checkpoint = bisect_right(checkpoints, target) - 1
+        if checkpoint >= 0:
+            self._file.seek(session_index.offsets[checkpoint])
+            self.line_number = session_index.line_numbers[checkpoint] - 1
+        else:
+            self._file.seek(self.data_start)
+            self.line_number = 1
+
+        while True:
+            offset = self._file.tell()
+            line = self._file.readline()
+            if not line:
+                break
+            try:
+                if self._parse_line(line)[key] >= target:
+                    self._file.seek(offset)
+                    break
+            except ValueError:
+                pass
+            self.line_number += 1
+        self.total_read = self._file.tell()
+
+    def seek_index(self, index):
+        """
+        Moves to the first entry with an index of at least `index`, so that the next call to sleep_entries or
+        sleep_entry_arrays starts from there.
+        """
+        self._seek(self.session_index.indexes, index, 0)
+
+    def seek_time(self, timestamp):
+        """
+        Moves to the first entry taken at or after `timestamp` (see timestamp_from_strings), so that the next call to
+        sleep_entries or sleep_entry_arrays starts from there.
+        """
+        self._seek(self.session_index.timestamps, timestamp, 1)
+
+    def slice(self, start, end):
+        """
+        :return: (indexes, timestamps, movement_values) arrays of the entries with indexes from `start` up to `end`
+        """
+        self.seek_index(start)
+        return self._read_until(lambda indexes, timestamps: indexes < end, (end - start) * 32)
+
+    def slice_time(self, start, end):
+        """
+        :return: (indexes, timestamps, movement_values) arrays of the entries taken from `start` up to `end`.
+        Either can be None to start from the beginning of the file, or read to the end of it.
+        """
+        if start is None:
+            self._file.seek(self.data_start)
+            self.line_number = 1
+        else:
+            self.seek_time(start)
+        if end is None:
+            return self._read_until(lambda indexes, timestamps: numpy.ones(len(indexes), dtype=bool), self.CHUNK_SIZE)
+        return self._read_until(lambda indexes, timestamps: timestamps < end, self.CHUNK_SIZE)
+
+    def _read_until(self, keep, expected_size):
+        """
+        Reads chunks from the current position of the file for as long as `keep` is true for their entries
+
+        :param keep: function of (indexes, timestamps) arrays, returning an array of which entries to keep
+        :param expected_size: roughly how many bytes will be read, to size the chunks
+        """
+        chunks = []
+        chunk_size = int(min(self.CHUNK_SIZE, max(64 * 1024, expected_size)))
+        for indexes, timestamps, movement_values in self.sleep_entry_arrays(chunk_size=chunk_size):
+            kept = keep(indexes, timestamps)
+            if kept.all():
+                chunks.append((indexes, timestamps, movement_values))
+            else:
+                stop = numpy.argmin(kept)
+                chunks.append((indexes[:stop], timestamps[:stop], movement_values[:stop]))
+                break
+        if not chunks:
+            return (numpy.empty(0, dtype=numpy.int64),
+                    numpy.empty(0, dtype=numpy.float64),
+                    numpy.empty(0, dtype=numpy.int64))
+        return tuple(numpy.concatenate([chunk[column] for chunk in chunks]) for column in range(3))
+
     def show_progress(self):
         percentage = math.floor((float(self.total_read) / float(self.total_size)) * 100.0)
         sys.stdout.flush()
         sys.stdout.write("\r%d%%" % percentage)
 
+    def close(self):
+        self._file.close()
 
-class OutFile(object):
-    def __init__(self):
-        """
-        Creates the logfile, and writes the header row
-        """
-        self.logfile_name = 'logs/%s-%s.slp.csv' % (get_date_string(), get_time_string())
-        log.info("Logging to %s" % self.logfile_name)
-        try:
-            self.logfile = open(self.logfile_name, 'a')
-            self.logwriter = csv.writer(self.logfile)
-        except Exception as e:
-            log.error("Unable to open logfile: %s" % e)
-            sys.exit(1)
-        # Write CSV header information
-        self.logwriter.writerow(SleepEntry.header_names())
 
-    def write_entry(self, sleep_entry):
-        self.logfile.write(str(sleep_entry) + "\r\n")
+BINARY_MAGIC = b'SLPBIN\x00\x00'
+"""First 8 bytes of every binary (.slp.bin) session file"""
 
-    def close(self):
-        self.logfile.close()
-        log.info("Log saved to %s" % self.logfile_name)
+BINARY_VERSION = 1
 
+BINARY_HEADER = struct.Struct('<8sHHHxxq40s')
+"""Binary session file header: magic, version, header size, record size, (padding), start timestamp, schema"""
 
-class LightSwitch(object):
-    """Static object for turning off and on the Raspberry Pi's indicator LED.
+BINARY_RECORD = numpy.dtype([('index', '<i4'), ('time_offset', '<i4'), ('movement_value', '<i4')])
+"""One packed record per sleep entry. time_offset is the number of seconds after the start timestamp in the header."""
+
+BINARY_SCHEMA = b','.join(name.encode('ascii') for name in BINARY_RECORD.names)
+
+
+class BinarySleepFile(SleepReader):
+    """
+    Reads a binary (.slp.bin) session file written by BinaryOutFile. Has the same interface as SleepFile, but the
+    records are memory-mapped instead of parsed, so any part of the session can be read without reading the rest.
 
     Usage:
-        LightSwitch.turn_on()
-        LightSwitch.turn_off()
+        sleep_file = BinarySleepFile('logs/03-06-2015-22-00-00.slp.bin')
+        print len(sleep_file), sleep_file.entry(3600)
+        for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays():
+            sleep_analyzer.analyze_array(movement_values, timestamps, indexes)
     """
-    @staticmethod
-    def turn_on():
-        try:
-            with open(LIGHT_FILE, 'w') as f:
-                f.write('1')
-        except IOError:
-            log.warning("Unable to turn on indicator led")
+    CHUNK_SIZE = SleepFile.CHUNK_SIZE // BINARY_RECORD.itemsize
+    """Number of records sleep_entry_arrays yields at a time"""
+
+    def __init__(self, filename, **kwargs):
+        """Reads the header, and memory-maps the records"""
+        super(BinarySleepFile, self).__init__(**kwargs)
+
+        self.malformed_lines = []
+        """Always empty. Here so that BinarySleepFile can be used in place of a SleepFile."""
 
-    @staticmethod
-    def turn_off():
         try:
-            with open(LIGHT_FILE, 'w') as f:
-                f.write('0')
-        except IOError:
-            log.warning("Unable to turn off indicator led")
+            self.total_size = os.path.getsize(filename)
+            with open(filename, 'rb') as binary_file:
+                header = binary_file.read(BINARY_HEADER.size)
+            magic, version, header_size, record_size, self.start_timestamp, schema = BINARY_HEADER.unpack(header)
+        except Exception as e:
+            log.error("Couldn't open input file: %s" % e)
+            sys.exit(1)
 
+        if magic != BINARY_MAGIC or version != BINARY_VERSION or record_size != BINARY_RECORD.itemsize or \
+                schema.rstrip(b'\x00') != BINARY_SCHEMA:
+            log.error("Unsupported binary sleepfile: %s (version %s, schema %s)" % (filename, version, schema))
+            sys.exit(1)
 
-def get_date_string():
+        # A record cut short (e.g. by pulling the power while it was written) is ignored
+        num_records = (self.total_size - header_size) // record_size
+        if num_records:
+            self.records = numpy.memmap(filename, dtype=BINARY_RECORD, mode='r',
+                                        offset=header_size, shape=(num_records,))
+        else:
+            self.records = numpy.empty(0, dtype=BINARY_RECORD)
+        """Memory-mapped array of every record in the file"""
+
+        self.total_read = header_size
+
+        self.position = 0
+        """Position of the next record to be read by sleep_entries or sleep_entry_arrays"""
+
+    def __len__(self):
+        return len(self.records)
+
+    def entry(self, position):
+        """Builds a SleepEntry from the record at `position`"""
+        record = self.records[position]
+        return SleepEntry(int(record['index']), int(record['movement_value']),
+                          timestamp=self.start_timestamp + int(record['time_offset']))
+
+    def arrays(self, start=0, end=None):
+        """
+        :return: (indexes, timestamps, movement_values) arrays of the records from `start` up to `end`
+        """
+        records = self.records[start:end]
+        return (records['index'].astype(numpy.int64),
+                (records['time_offset'] + self.start_timestamp).astype(numpy.float64),
+                records['movement_value'].astype(numpy.int64))
+
+    def sleep_entries(self):
+        while self.position < len(self.records):
+            self.position += 1
+            self.total_read += BINARY_RECORD.itemsize
+            yield self.entry(self.position - 1)
+
+    def sleep_entry_arrays(self, chunk_size=CHUNK_SIZE):
+        while self.position < len(self.records):
+            arrays = self.arrays(self.position, self.position + chunk_size)
+            self.position += len(arrays[0])
+            self.total_read += len(arrays[0]) * BINARY_RECORD.itemsize
+            yield arrays
+
+    def _search(self, column, value):
+        """
+        Binary search for the position of the first record whose `column` is at least `value`.
+        Only touches the handful of records it compares against, so the rest of the file is never read.
+        """
+        low, high = 0, len(self.records)
+        while low < high:
+            middle = (low + high) // 2
+            if self.records[middle][column] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _position_of_index(self, index):
+        return self._search('index', index)
+
+    def _position_of_time(self, timestamp):
+        return self._search('time_offset', timestamp - self.start_timestamp)
+
+    def _move_to(self, position):
+        self.position = position
+        self.total_read = BINARY_HEADER.size + position * BINARY_RECORD.itemsize
+
+    def seek_index(self, index):
+        """Same as SleepFile.seek_index. No index file is needed, since every record is the same size."""
+        self._move_to(self._position_of_index(index))
+
+    def seek_time(self, timestamp):
+        """Same as SleepFile.seek_time"""
+        self._move_to(self._position_of_time(timestamp))
+
+    def slice(self, start, end):
+        """Same as SleepFile.slice"""
+        return self.arrays(self._position_of_index(start), self._position_of_index(end))
+
+    def slice_time(self, start, end):
+        """Same as SleepFile.slice_time"""
+        return self.arrays(0 if start is None else self._position_of_time(start),
+                           None if end is None else self._position_of_time(end))
+
+    def close(self):
+        pass
+
+    def show_progress(self):
+        percentage = math.floor((float(self.total_read) / float(self.total_size)) * 100.0)
+        sys.stdout.flush()
+        sys.stdout.write("\r%d%%" % percentage)
+
+
+def open_sleep_file(filename):
     """
-    :return: A string representation of the current date as mm-dd-yyyy
+    :return: a BinarySleepFile for .slp.bin files, otherwise a SleepFile
     """
-    return datetime.datetime.now().strftime("%m-%d-%Y")
+    if filename.endswith('.slp.bin'):
+        return BinarySleepFile(filename)
+    return SleepFile(filename)
 
 
-def get_time_string():
+def convert_to_binary(csv_filename, binary_filename=None):
     """
-    :return: A string representation of the current time as hh-mm-sss
+    Converts a .slp.csv logfile into a .slp.bin session file. Malformed lines are skipped (and logged).
+
+    :param binary_filename: defaults to the csv filename, with .slp.bin in place of .slp.csv
+    :return: the binary filename
     """
-    return datetime.datetime.now().strftime("%H-%M-%S")
+    if binary_filename is None:
+        binary_filename = csv_filename[:-len('.slp.csv')] if csv_filename.endswith('.slp.csv') else csv_filename
+        binary_filename += '.slp.bin'
+
+    sleep_file = SleepFile(csv_filename)
+    binary_file = None
+    for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays():
+        if binary_file is None:
+            binary_file = BinaryOutFile(binary_filename, start_timestamp=timestamps[0])
+        binary_file.write_arrays(indexes, timestamps, movement_values)
+    if binary_file is None:
+        binary_file = BinaryOutFile(binary_filename)
+    binary_file.close()
+    return binary_filename
+
+
+class BinaryOutFile(object):
+    """
+    Writes a session in the compact binary format (.slp.bin): a 64 byte header, followed by a fixed-width
+    12 byte record for every sleep entry. Unlike a .slp.csv, the file can be memory-mapped and read with no
+    parsing at all (see BinarySleepFile).
+
+    Usage:
+        logfile = BinaryOutFile()
+        logfile.write_entry(sleep_entry)
+        logfile.close()
+    """
+    def __init__(self, filename=None, start_timestamp=None):
+        """
+        Creates the logfile, and writes the header
+
+        :param filename: defaults to a timestamped file in logs/, like OutFile
+        :param start_timestamp: timestamp that every record's time is stored relative to. Defaults to now.
+        """
+        if start_timestamp is None:
+            start_timestamp = timestamp_from_strings(get_date_string(), get_time_string())
+        self.start_timestamp = int(start_timestamp)
+
+        self.logfile_name = filename or 'logs/%s-%s.slp.bin' % (get_date_string(), get_time_string())
+        log.info("Logging to %s" % self.logfile_name)
+        try:
+            self.logfile = open(self.logfile_name, 'wb')
+        except Exception as e:
+            log.error("Unable to open logfile: %s" % e)
+            sys.exit(1)
+        self.logfile.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_HEADER.size,
+                                              BINARY_RECORD.itemsize, self.start_timestamp, BINARY_SCHEMA))
 
+    def write_entry(self, sleep_entry):
+        self.logfile.write(struct.pack('<iii', sleep_entry.index,
+                                       int(sleep_entry.timestamp) - self.start_timestamp,
+                                       sleep_entry.movement_value))
+
+    def write_arrays(self, indexes, timestamps, movement_values):
+        """Writes many entries at once, given as equal-length arrays (as yielded by SleepFile.sleep_entry_arrays)"""
+        records = numpy.empty(len(indexes), dtype=BINARY_RECORD)
+        records['index'] = indexes
+        records['time_offset'] = numpy.asarray(timestamps, dtype=numpy.int64) - self.start_timestamp
+        records['movement_value'] = movement_values
+        self.logfile.write(records.tobytes())
 
-def check_correct_run_dir():
-    if os.getcwd()[-20:] != '/live-sleep-analyzer':
-        log.error("Please cd into the project directory before running any scripts!")
-        sys.exit(1)
+    def close(self):
+        self.logfile.close()
+        log.info("Log saved to %s" % self.logfile_name)
+
+
+def timestamps_from_fields(year, month, day, hours, minutes, seconds):
+    """
+    Vectorized version of timestamp_from_strings, for numpy arrays of each part of the date and time.
+    Counts days using the proleptic Gregorian calendar, the same way datetime.date does.
+
+    :return: numpy array of integer timestamps
+    """
+    # Count years from March, so that the leap day is the last day of the year
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    # 719468 is the number of days from 03-01-0000 to 01-01-1970
+    days = era * 146097 + day_of_era - 719468
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
@@ -10,41 +10,114 @@ Use Case: Analyzing realtime data live on PC (nurse with a screen scenario)
 import argparse
 import serial
 import sys
-from pysleep.utils import SleepEntryStore, Teensy, OutFile, \
-    check_correct_run_dir, log
+from pysleep.pysleeplogging import configure_logging
+from pysleep.utils import Teensy, OutFile, check_correct_run_dir, log, recover_logfiles, strings_from_timestamp
+from pysleep.pipeline import SleepEntryPipeline, DROP_OLDEST
+from pysleep.staging import EPOCH_SECONDS, WAKE_THRESHOLD, PHASE_NAMES
+from pysleep.analyzers import AnalyzerPipeline, ANALYZER_STAGES, analyzer_names
+from pysleep.columns import entry_count
 
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(prog='python realtime-analyze.py',
                                      description='Logs and performs data and garphical analysis on realtime accelerometer input')
+    parser.add_argument('-g', '--graphs',
+                        action='store_true',
+                        help='show live graphs of the session')
+
+    parser.add_argument('--frame-rate',
+                        type=float,
+                        default=5,
+                        help='most times per second to redraw the live graphs (default: 5)')
+
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=1000,
+                        help='most readings that can be waiting for each stage (logfile, analysis, graphs) '
+                             '(default: 1000)')
+
+    parser.add_argument('--epoch-seconds',
+                        type=int,
+                        default=EPOCH_SECONDS,
+                        help='length of the epochs the session is scored into asleep or awake (default: %d)' %
+                             EPOCH_SECONDS)
+
+    parser.add_argument('--wake-threshold',
+                        type=int,
+                        default=WAKE_THRESHOLD,
+                        help='weighted sum of epoch movement at which an epoch is scored awake; see the README for '
+                             'calibrating it (default: %d)' % WAKE_THRESHOLD)
+
+    parser.add_argument('-a', '--analyzers',
+                        type=analyzer_names,
+                        default=['store', 'staging'],
+                        help='comma separated analysis stages to run on each reading, from: %s '
+                             '(default: store,staging)' % ', '.join(sorted(ANALYZER_STAGES)))
+
+    parser.add_argument('-m', '--minimum-value',
+                        type=int,
+                        default=0,
+                        help='movement values above this count as big movements (default: 0)')
+
+    parser.add_argument('-r', '--retain-entries',
+                        type=entry_count,
+                        help='only keep the last RETAIN_ENTRIES readings (and per-reading analysis) in memory, for '
+                             'sessions too long to keep whole (e.g. 3600 for about an hour). Older readings are only '
+                             'in the logfile, and a summary of them is logged; the session statistics still cover '
+                             'every reading. (default: keep every reading)')
     args = parser.parse_args()
+    configure_logging()
 
     # Check user is in the right directory
     check_correct_run_dir()
 
+    # Finish off any logfile left partly written by a power loss
+    recover_logfiles('logs')
+
     sleep_reader = Teensy()
     logfile = OutFile()
-    sleep_entry_store = SleepEntryStore()
-
-    try:
-        # Read a sleep entry from the teensy
-        for sleep_entry in sleep_reader.sleep_entries():
-            # Log it
-            logfile.write_entry(sleep_entry)
+    analyzers = list(args.analyzers)
+    if args.graphs:
+        # Only import pyplot when there are graphs to show
+        from pysleep.graphs import LiveSessionGraphs
+        analyzers.extend(LiveSessionGraphs.STAGES)
+    analysis = AnalyzerPipeline(analyzers, epoch_seconds=args.epoch_seconds, wake_threshold=args.wake_threshold,
+                                min_movement_value=args.minimum_value, retain_entries=args.retain_entries)
+    if 'staging' in analysis.stages:
+        analysis.stages['staging'].stager.add_listener(lambda timestamp, old_phase, new_phase: log.info(
+            "Patient %s since %s" % (PHASE_NAMES[new_phase], '_'.join(strings_from_timestamp(timestamp)))))
+    live_session_graphs = None
+    if args.graphs:
+        live_session_graphs = LiveSessionGraphs(analysis, frame_rate=args.frame_rate)
 
-            # Store it
-            sleep_entry_store.add_entry(sleep_entry)
+    # Read from the teensy on a thread of its own. Logging and analyzing each entry happen on threads of their own,
+    # so neither holds up reading, and every entry reaches both of them.
+    pipeline = SleepEntryPipeline(sleep_reader)
+    # The idle function writes out the last readings on time even if the Teensy stops sending
+    pipeline.add_stage('logfile', logfile.write_entry, queue_size=args.queue_size, idle=logfile.flush_if_due)
+    # The graphs are drawn from the analysis' results, and have to be drawn from the main thread, so with graphs
+    # the analysis runs on the main thread too (before the graphs, each time round).
+    pipeline.add_stage('analysis', analysis.add_entry, queue_size=args.queue_size,
+                       main_thread=live_session_graphs is not None)
+    if live_session_graphs:
+        # The graphs stage only draws. If it can't keep up, skip old readings (the analysis still gets every one)
+        # rather than holding up the logfile.
+        pipeline.add_stage('graphs', live_session_graphs.add_entry, queue_size=args.queue_size,
+                           drop_policy=DROP_OLDEST, main_thread=True)
 
+    try:
+        pipeline.run()
     except KeyboardInterrupt:
         log.info("Interrupt detected. Press enter to quit...")
         raw_input()
     except serial.SerialException:
         log.info("USB Error. Closing current session")
     finally:
-        # sleep_entry_store.show()
+        if live_session_graphs and live_session_graphs.frames_drawn:
+            live_session_graphs.show()
+        analysis.show()
         logfile.close()
 
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+"""
+Use Case: Logging sleep for many patients at once, one Teensy each, from a single Pi (data collection)
+  - source: serial (every teensy plugged in)
+  - save to logfile (one per teensy)
+  x realtime graph (short-term)
+  x session graph (long-term)
+  - realtime analysis
+  x after-the-fact analysis
+"""
+import argparse
+import os
+import sys
+from pysleep.pysleeplogging import configure_logging
+from pysleep.utils import check_correct_run_dir, log, recover_logfiles
+from pysleep.hub import SleepHub
+from pysleep.columns import entry_count
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(prog='python sleep-hub.py',
+                                     description='Logs movement information from every Teensy plugged in, '
+                                                 'into a separate logfile for each')
+    parser.add_argument('-r', '--retain-entries',
+                        type=entry_count,
+                        default=SleepHub.RETAIN_ENTRIES,
+                        help='most readings of each session to keep in memory for its analysis. Older readings are '
+                             'only in the logfile; the session summaries still cover every reading. '
+                             '(default: %d, about an hour at a reading a second)' % SleepHub.RETAIN_ENTRIES)
+    args = parser.parse_args()
+    configure_logging()
+
+    # Check user is in the right directory
+    check_correct_run_dir()
+
+    if not os.path.isdir('logs'):
+        try:
+            os.mkdir('logs')
+        except OSError:
+            log.error("Can't create logs directory")
+            sys.exit(1)
+    # Finish off any logfile left partly written by a power loss
+    recover_logfiles('logs')
+
+    hub = SleepHub(retain_entries=args.retain_entries)
+    log.info("Waiting for Teensies to be plugged in")
+    try:
+        # Runs until interrupted. Devices can be plugged in and unplugged while it runs.
+        hub.run()
+    except KeyboardInterrupt:
+        log.info("Interrupt detected. Closing logfiles and quitting")
+
+
+if __name__ == "__main__":
+    main()
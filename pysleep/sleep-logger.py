@@ -11,23 +11,72 @@ import argparse
 import sys
 import serial
 import os
-from pysleep.utils import check_correct_run_dir, log, \
-    LightSwitch, Teensy, OutFile
+# Only the logging path (standard library and pyserial), so the logger starts reading quickly. See capture.py.
+from pysleep.capture import check_correct_run_dir, LightSwitch, Teensy, OutFile, recover_logfiles
+from pysleep.pysleeplogging import configure_logging, log
+from pysleep.pipeline import SleepEntryPipeline
+from pysleep.upload import LogfileUploader, load_credentials, UPLOAD_INTERVAL
 
 
 def main():
     # Parse command line arguments
-    argparse.ArgumentParser(prog='python sleep-logger.py',
-                            description='Logs movement information from accelerometer input into logfile',
-                            usage='python sleep-logger.py [-h]')
+    parser = argparse.ArgumentParser(prog='python sleep-logger.py',
+                                     description='Logs movement information from accelerometer input into logfile',
+                                     usage='python sleep-logger.py [-h] [--binary] [--queue-size QUEUE_SIZE] '
+                                           '[--flush-entries N] [--flush-seconds SECONDS] [--rotate-entries N] '
+                                           '[--rotate-minutes MINUTES] [--upload] [--upload-minutes MINUTES]')
+    parser.add_argument('--binary',
+                        action='store_true',
+                        help='also log each session to a binary .slp.bin file')
+
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=1000,
+                        help='most readings that can be waiting to be written before reading waits (default: 1000)')
+
+    parser.add_argument('--flush-entries',
+                        type=int,
+                        default=OutFile.FLUSH_ENTRIES,
+                        help='write readings to the SD card once this many are waiting (default: %d)' %
+                             OutFile.FLUSH_ENTRIES)
+
+    parser.add_argument('--flush-seconds',
+                        type=float,
+                        default=OutFile.FLUSH_SECONDS,
+                        help='write readings to the SD card once the oldest has waited this long (default: %d). '
+                             'A power loss loses at most this many seconds of readings.' % OutFile.FLUSH_SECONDS)
+
+    parser.add_argument('--rotate-entries',
+                        type=int,
+                        help='start a new logfile segment every N readings. Finished segments are gzipped.')
+
+    parser.add_argument('--rotate-minutes',
+                        type=float,
+                        help='start a new logfile segment every MINUTES minutes')
+
+    parser.add_argument('--upload',
+                        action='store_true',
+                        help='upload finished logfiles to the fileserver in the background')
+
+    parser.add_argument('--upload-minutes',
+                        type=float,
+                        default=UPLOAD_INTERVAL / 60,
+                        help='minutes between uploads (default: %d)' % (UPLOAD_INTERVAL / 60))
+
+    parser.add_argument('--log-every',
+                        type=int,
+                        help='also log every Nth reading on its own (1 for every reading). Otherwise only a summary '
+                             'of the readings is logged each minute.')
+    args = parser.parse_args()
+    configure_logging()
 
     # Check user is in the right directory
     check_correct_run_dir()
 
     try:
-        # If log file exists, run FTP upload
         os.listdir('logs')
-        # upload_new_logfiles()
+        # Finish off any logfile left partly written by a power loss
+        recover_logfiles('logs', rotate_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None)
     except OSError:
         try:
             # Log directory doesn't exist. create it.
@@ -36,38 +85,62 @@ def main():
             log.error("Can't create logs directory")
             sys.exit(1)
 
+    if args.upload:
+        credentials = load_credentials()
+        if credentials:
+            # Uploads on a thread of its own, so a slow connection never holds up logging
+            LogfileUploader(*credentials).start(interval=args.upload_minutes * 60)
+
     run = True
     # This loop runs once for every log session
     while run:
         sleep_log = None
+        binary_sleep_log = None
         try:
             # Blocking call - won't continue until a Teensy connection has been initiated
             sleep_reader = Teensy()
-            sleep_log = OutFile()
+            sleep_reader.reading_log.sample_every = args.log_every
+            sleep_log = OutFile(flush_entries=args.flush_entries, flush_seconds=args.flush_seconds,
+                                rotate_entries=args.rotate_entries,
+                                rotate_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None)
+            if args.binary:
+                # Needs numpy, so only imported when asked for
+                from pysleep.utils import BinaryOutFile
+                binary_sleep_log = BinaryOutFile()
             LightSwitch.turn_on()
 
-            for sleep_entry in sleep_reader.sleep_entries():
-
+            def write_entry(sleep_entry):
                 # Handle case where bad value is received from reader
                 if sleep_entry is None:
                     # Move on. Note: Index will still be incremented
                     LightSwitch.turn_off()
-                    continue
+                    return
                 else:
                     LightSwitch.turn_on()
 
                 sleep_log.write_entry(sleep_entry)
 
+            # Read from the Teensy on a thread of its own, so slow writes never hold up reading
+            pipeline = SleepEntryPipeline(sleep_reader)
+            # The idle function writes out the last readings on time even if the Teensy stops sending
+            pipeline.add_stage('logfile', write_entry, queue_size=args.queue_size, idle=sleep_log.flush_if_due)
+            if binary_sleep_log:
+                pipeline.add_stage('binary logfile', binary_sleep_log.write_entry, queue_size=args.queue_size)
+            pipeline.run()
+
         except KeyboardInterrupt:
             log.info("Interrupt detected. Closing logfile and quitting")
-            if sleep_log:
-                sleep_log.close()
-            LightSwitch.turn_off()
             run = False
         except serial.SerialException:
             log.info("USB Error. Closing everything")
+        finally:
+            # However the session ended (including the Teensy going quiet, which ends pipeline.run normally),
+            # write out the last batch and finish the logfiles before the next session opens new ones
             LightSwitch.turn_off()
-            sleep_log.close()
+            if sleep_log:
+                sleep_log.close()
+            if binary_sleep_log:
+                binary_sleep_log.close()
 
 
 if __name__ == "__main__":
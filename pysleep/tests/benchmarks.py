@@ -0,0 +1,457 @@
+"""
+The benchmarks benchmark.py runs: each times part of the code against a synthetic session, and checks its results
+against a simple reference calculation
+"""
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy
+from pysleep.capture import SleepReader, Teensy
+from pysleep.columns import SleepEntryColumns
+from pysleep.hub import SleepHub
+from pysleep.pysleeplogging import QueueHandler, QueueListener, ReadingLog, LOG_FORMAT
+from pysleep.upload import LogfileUploader
+from pysleep.utils import SleepAnalyzer, SleepFile, BinarySleepFile, convert_to_binary
+from tests.fixtures import LocalFTPServer, PseudoTeensy, check_same_analysis, iter_synthetic_sleep_entries, \
+    read_all_arrays, synthetic_movement_values, synthetic_sleep_entries, write_synthetic_logfile
+
+
+def time_per_call(function, items, repeat=3):
+    """
+    Calls `function` once for every item in `items`, `repeat` times over, and returns the best
+    average time per call in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        for item in items:
+            function(item)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / max(len(items), 1)
+
+
+def benchmark_rolling_window(num_entries=5000, history_sizes=(10, 100, 1000, 10000)):
+    """
+    Times SleepAnalyzer.add_entry for several MOVEMENT_HISTORY_SIZEs. With the rolling window the
+    cost per entry should stay flat as the history grows.
+
+    Also checks the movement_sums against summing the last MOVEMENT_HISTORY_SIZE entries from scratch.
+
+    :return: list of (history_size, seconds per entry)
+    """
+    sleep_entries = synthetic_sleep_entries(num_entries)
+    running_totals = [0]
+    for sleep_entry in sleep_entries:
+        running_totals.append(running_totals[-1] + sleep_entry.movement_value)
+
+    results = []
+    for history_size in history_sizes:
+        analyzer_class = type('SleepAnalyzer%d' % history_size, (SleepAnalyzer,),
+                              {'MOVEMENT_HISTORY_SIZE': history_size})
+
+        analyzer = analyzer_class()
+        for sleep_entry in sleep_entries:
+            analyzer.add_entry(sleep_entry)
+        for position, movement_sum in enumerate(analyzer.movement_sums):
+            first = max(0, position + 1 - history_size)
+            expected = running_totals[position + 1] - running_totals[first]
+            assert movement_sum == expected, \
+                "movement_sums[%d] is %s, expected %s" % (position, movement_sum, expected)
+
+        analyzer = analyzer_class()
+        seconds = time_per_call(analyzer.add_entry, sleep_entries, repeat=1)
+        results.append((history_size, seconds))
+    return results
+
+
+ONE_WEEK = 7 * 24 * 60 * 60
+"""Number of entries in a week-long session, at one reading per second"""
+
+
+def sleep_entry_size(sleep_entry):
+    """Approximate bytes of memory held by a single SleepEntry object and its date/time strings or timestamp"""
+    size = sys.getsizeof(sleep_entry)
+    for name in ('_timestamp', '_date', '_time'):
+        if getattr(sleep_entry, name) is not None:
+            size += sys.getsizeof(getattr(sleep_entry, name))
+    return size
+
+
+def benchmark_store_memory(num_entries=ONE_WEEK, sample_size=10000):
+    """
+    Compares the memory needed to hold a session as a list of SleepEntries with the memory held by
+    SleepEntryColumns. The columns are filled with the whole session; the list is estimated from the size of
+    the first `sample_size` entries, since a week of SleepEntry objects would take hundreds of megabytes.
+    Also checks that the columns give back the same entries.
+
+    :return: (num_entries, estimated bytes as a list of SleepEntries, bytes as SleepEntryColumns)
+    """
+    columns = SleepEntryColumns()
+    sample = []
+    for sleep_entry in iter_synthetic_sleep_entries(num_entries):
+        columns.append(sleep_entry)
+        if len(sample) < sample_size:
+            sample.append(sleep_entry)
+
+    for position, sleep_entry in enumerate(sample):
+        assert str(columns[position]) == str(sleep_entry), \
+            "Entry %d is %s, expected %s" % (position, columns[position], sleep_entry)
+
+    bytes_per_entry = float(sum(sleep_entry_size(sleep_entry) for sleep_entry in sample)) / len(sample)
+    list_bytes = sys.getsizeof(sample) * num_entries // len(sample) + int(bytes_per_entry * num_entries)
+    return num_entries, list_bytes, columns.nbytes
+
+
+def benchmark_batch_analysis(num_entries=100000):
+    """
+    Times SleepAnalyzer.analyze_array against feeding the same session through add_entry one entry at a time,
+    and checks that both produce the same results (including when the batch is split in two).
+
+    :return: (num_entries, seconds for add_entry, seconds for analyze_array)
+    """
+    sleep_entries = synthetic_sleep_entries(num_entries)
+    columns = SleepEntryColumns()
+    for sleep_entry in sleep_entries:
+        columns.append(sleep_entry)
+
+    started = time.time()
+    streaming = SleepAnalyzer(min_movement_value=10)
+    for sleep_entry in sleep_entries:
+        streaming.add_entry(sleep_entry)
+    streaming_seconds = time.time() - started
+
+    started = time.time()
+    batch = SleepAnalyzer(min_movement_value=10)
+    batch.analyze_array(columns.movement_values, columns.timestamps, columns.indexes)
+    batch_seconds = time.time() - started
+    check_same_analysis(streaming, batch)
+
+    split = SleepAnalyzer(min_movement_value=10)
+    half = num_entries // 2
+    split.analyze_array(columns.movement_values[:half], columns.timestamps[:half], columns.indexes[:half])
+    split.analyze_array(columns.movement_values[half:], columns.timestamps[half:], columns.indexes[half:])
+    check_same_analysis(streaming, split)
+
+    return num_entries, streaming_seconds, batch_seconds
+
+
+def benchmark_bulk_loader(num_entries=1000000):
+    """
+    Times SleepFile.sleep_entry_arrays reading a synthetic logfile. Also checks it against
+    SleepFile.sleep_entries on a smaller logfile with malformed lines in it, with a chunk size small
+    enough to split lines across chunks.
+
+    :return: (num_entries, seconds for sleep_entry_arrays)
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'malformed.slp.csv')
+        malformed_lines = write_synthetic_logfile(filename, 20000, malformed_every=997)
+        expected = [(sleep_entry.index, sleep_entry.timestamp, sleep_entry.movement_value)
+                    for sleep_entry in SleepFile(filename).sleep_entries()]
+        sleep_file = SleepFile(filename)
+        actual = []
+        for indexes, timestamps, movement_values in sleep_file.sleep_entry_arrays(chunk_size=10000):
+            actual.extend(zip(indexes.tolist(), timestamps.tolist(), movement_values.tolist()))
+        assert actual == expected, "sleep_entry_arrays and sleep_entries read different entries"
+        assert sleep_file.malformed_lines == malformed_lines, \
+            "Reported malformed lines %s, expected %s" % (sleep_file.malformed_lines, malformed_lines)
+
+        filename = os.path.join(directory, 'session.slp.csv')
+        write_synthetic_logfile(filename, num_entries)
+        started = time.time()
+        num_read = 0
+        for indexes, timestamps, movement_values in SleepFile(filename).sleep_entry_arrays():
+            num_read += len(indexes)
+        seconds = time.time() - started
+        assert num_read == num_entries, "Read %d entries, expected %d" % (num_read, num_entries)
+    finally:
+        shutil.rmtree(directory)
+    return num_entries, seconds
+
+
+def benchmark_binary_format(num_entries=1000000):
+    """
+    Converts a synthetic .slp.csv logfile into a .slp.bin session file, and compares their sizes and how long
+    each takes to load. Also times reading a single entry from the middle of the binary file, and checks that
+    both files hold the same entries.
+
+    :return: dict of results
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_filename = os.path.join(directory, 'session.slp.csv')
+        write_synthetic_logfile(csv_filename, num_entries)
+        binary_filename = convert_to_binary(csv_filename)
+
+        started = time.time()
+        csv_arrays = read_all_arrays(SleepFile(csv_filename))
+        csv_seconds = time.time() - started
+
+        started = time.time()
+        binary_arrays = read_all_arrays(BinarySleepFile(binary_filename))
+        binary_seconds = time.time() - started
+
+        for csv_column, binary_column in zip(csv_arrays, binary_arrays):
+            assert numpy.array_equal(csv_column, binary_column), "The csv and binary files hold different entries"
+
+        started = time.time()
+        middle_entry = BinarySleepFile(binary_filename).entry(num_entries // 2)
+        seek_seconds = time.time() - started
+        assert middle_entry.index == csv_arrays[0][num_entries // 2]
+
+        return {'num_entries': num_entries,
+                'csv_bytes': os.path.getsize(csv_filename),
+                'binary_bytes': os.path.getsize(binary_filename),
+                'csv_seconds': csv_seconds,
+                'binary_seconds': binary_seconds,
+                'seek_seconds': seek_seconds}
+    finally:
+        shutil.rmtree(directory)
+
+
+def benchmark_hub(num_devices=32, seconds=5, readings_per_second=10):
+    """
+    Load test for SleepHub: `num_devices` pseudo-terminals each send `readings_per_second` readings a second for
+    `seconds` seconds, while one device is unplugged and a new one plugged in part way through. Checks that every
+    reading from every device still plugged in at the end made it into that device's own logfile.
+
+    :return: dict of readings sent and logged, devices seen, and the CPU seconds used (mostly by the hub)
+    """
+    directory = tempfile.mkdtemp()
+    num_readings = seconds * readings_per_second
+    devices = [PseudoTeensy(num_readings, seed) for seed in range(num_devices)]
+    plugged_in = list(devices)
+    hub = SleepHub(find_ports=lambda: [device.port for device in plugged_in], log_dir=directory)
+    hub.SCAN_INTERVAL = 0.2
+
+    def send_readings():
+        for tick in range(num_readings):
+            if tick == num_readings // 3:
+                unplugged = plugged_in.pop(0)
+                unplugged.unplug()
+            if tick == num_readings // 2:
+                devices.append(PseudoTeensy(num_readings, len(devices)))
+                plugged_in.append(devices[-1])
+            for device in plugged_in:
+                # Opening a serial port throws away anything already waiting on it, so only count readings sent
+                # once the hub has the device open
+                if device.port in hub.devices:
+                    device.send_reading()
+            time.sleep(1.0 / readings_per_second)
+
+    try:
+        hub_thread = threading.Thread(target=hub.run)
+        started_cpu = sum(os.times()[:2])
+        hub_thread.start()
+        while len(hub.devices) < num_devices:
+            time.sleep(0.01)
+        send_readings()
+        # Give the hub a moment to read the last readings
+        time.sleep(0.5)
+        hub.stop()
+        hub_thread.join()
+        hub_cpu_seconds = sum(os.times()[:2]) - started_cpu
+
+        readings_logged = {}
+        for summary in hub.finished_sessions:
+            with open(summary['session_id']) as logfile:
+                readings_logged[summary['session_id']] = len(logfile.readlines()) - 1
+            assert summary['entries'] == readings_logged[summary['session_id']], \
+                "%s summarizes %d readings, but %d were logged" % (summary['session_id'], summary['entries'],
+                                                                 readings_logged[summary['session_id']])
+        for device in plugged_in:
+            # A device plugged in later can get the port an unplugged device had. Its session ended last.
+            session_id = [summary['session_id'] for summary in hub.finished_sessions
+                          if summary['session_id'].endswith('-%s.slp.csv' % os.path.basename(device.port))][-1]
+            assert readings_logged[session_id] == device.readings_sent, \
+                "%s sent %d readings, but %d were logged" % (device.port, device.readings_sent,
+                                                             readings_logged[session_id])
+    finally:
+        for device in plugged_in:
+            device.unplug()
+        shutil.rmtree(directory)
+    return {'devices': len(devices),
+            'sessions': len(hub.finished_sessions),
+            'readings_sent': sum(device.readings_sent for device in devices),
+            'readings_logged': sum(readings_logged.values()),
+            'hub_cpu_seconds': hub_cpu_seconds}
+
+
+def benchmark_compressed_upload(num_entries=8 * 60 * 60, bytes_per_second=250000):
+    """
+    Uploads an 8 hour session (one reading a second) to a LocalFTPServer limited to `bytes_per_second` (a weak
+    Wi-Fi connection), as it is and gzipped on the fly, and checks the gzipped copy decompresses to the logfile.
+
+    :return: (logfile bytes, dict of (bytes on the wire, seconds) for compress False and True)
+    """
+    directory = tempfile.mkdtemp()
+    results = {}
+    try:
+        template = os.path.join(directory, 'template.slp.csv')
+        write_synthetic_logfile(template, num_entries)
+        with open(template, 'rb') as logfile:
+            data = logfile.read()
+        for compress in (False, True):
+            local_directory = os.path.join(directory, 'local-%s' % compress)
+            remote_directory = os.path.join(directory, 'remote-%s' % compress)
+            os.mkdir(local_directory)
+            os.mkdir(remote_directory)
+            shutil.copy(template, os.path.join(local_directory, 'session.slp.csv'))
+
+            server = LocalFTPServer(remote_directory, bytes_per_second=bytes_per_second)
+            try:
+                uploader = LogfileUploader('127.0.0.1', server.user, server.password, directory=local_directory,
+                                           remote_directory='.', port=server.port, compress=compress, min_size=0)
+                started = time.time()
+                stats = uploader.upload_all()
+                seconds = time.time() - started
+            finally:
+                server.close()
+            assert stats['uploaded'] == 1, "Logfile wasn't uploaded: %s" % stats
+            assert server.bytes_received == stats['bytes_sent'], "Bytes sent miscounted"
+            remote_name = os.path.join(remote_directory, uploader.remote_name('session.slp.csv'))
+            with (gzip.open(remote_name, 'rb') if compress else open(remote_name, 'rb')) as uploaded:
+                assert uploaded.read() == data, "Uploaded copy differs"
+            results[compress] = (stats['bytes_sent'], seconds)
+    finally:
+        shutil.rmtree(directory)
+    return len(data), results
+
+
+def benchmark_logging(num_entries=100000):
+    """
+    Times Teensy.sleep_entries reading a session from a stand-in serial port, logging every reading to the console
+    and a logfile as it used to, logging every reading through a queue (see configure_logging), and logging a
+    summary each minute through a queue as it does now. The console is /dev/null so the terminal isn't timed, but
+    the logfile is a real file. Checks every queued reading still reaches the logfile.
+
+    :return: (num_entries, dict of seconds in the reading loop for 'every reading', 'every reading, queued' and
+             'summaries, queued')
+    """
+    lines = [b'%d\r\n' % movement_value for movement_value in synthetic_movement_values(num_entries)]
+    directory = tempfile.mkdtemp()
+    devnull = open(os.devnull, 'w')
+    results = {}
+    try:
+        for name, queued, sample_every in (('every reading', False, 1), ('every reading, queued', True, 1),
+                                           ('summaries, queued', True, None)):
+            logger = logging.getLogger('sleep-logger-benchmark-%d' % len(results))
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+            log_filename = os.path.join(directory, '%d.log' % len(results))
+            handlers = [logging.StreamHandler(devnull), logging.FileHandler(log_filename)]
+            for handler in handlers:
+                handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            listener = None
+            if queued:
+                record_queue = queue.Queue()
+                listener = QueueListener(record_queue, *handlers)
+                logger.addHandler(QueueHandler(record_queue))
+                listener.start()
+            else:
+                for handler in handlers:
+                    logger.addHandler(handler)
+
+            # A Teensy instance without running the search in __init__
+            teensy = Teensy.__new__(Teensy)
+            SleepReader.__init__(teensy)
+            teensy.teensy = lines
+            teensy.reading_log = ReadingLog(sample_every=sample_every, logger=logger)
+            started = time.time()
+            for _ in teensy.sleep_entries():
+                pass
+            results[name] = time.time() - started
+
+            if listener is not None:
+                listener.stop()
+            for handler in handlers:
+                logger.removeHandler(handler)
+                handler.close()
+            if sample_every:
+                with open(log_filename) as log_file:
+                    assert sum(1 for line in log_file if 'Read movement value' in line) == num_entries, \
+                        "%s: readings missing from the log" % name
+    finally:
+        devnull.close()
+        shutil.rmtree(directory)
+    return num_entries, results
+
+
+ENTRY_POINTS = ('sleep-logger.py', 'sleep-hub.py', 'realtime-analyze.py', 'post-analyze.py', 'convert-logfile.py',
+                'logfile-upload.py', 'benchmark.py')
+
+HEAVY_MODULES = ('numpy', 'matplotlib', 'sklearn', 'scipy')
+"""Modules slow enough to import (seconds on a Pi) that the logging path shouldn't need them"""
+
+_STARTUP_SCRIPT = """
+import runpy, sys, time
+started = time.time()
+sys.argv = [sys.argv[1], '-h']
+sys.stdout = open(__import__('os').devnull, 'w')
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write('%f %s\\n' % (time.time() - started, ','.join(sorted(set(
+    name.split('.')[0] for name in list(sys.modules) if sys.modules[name] is not None)))))
+"""
+
+
+def _slowest_imports(script, count=3):
+    """
+    :return: the `count` slowest top level imports (module, seconds including everything it imports) when running
+             `script -h`, using python -X importtime. Empty on Pythons without it (before 3.7).
+    """
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', script, '-h'], stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    _, output = process.communicate()
+    imports = []
+    for line in output.decode('ascii', 'replace').splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        module = fields[2].rstrip()
+        if not module.startswith('  ') and module.strip():
+            imports.append((module.strip(), int(fields[1]) / 1e6))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def benchmark_startup(entry_points=ENTRY_POINTS, repeat=5):
+    """
+    Times how long each entry point takes to import everything it needs and reach argument parsing (by running it
+    with -h in a fresh interpreter), and which of HEAVY_MODULES that loads.
+
+    :return: dict of entry point to (best seconds of `repeat`, heavy modules imported, slowest imports (see
+             _slowest_imports)), with the bare interpreter under 'python'
+    """
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for entry_point in ('python',) + tuple(entry_points):
+        script = os.path.join(directory, entry_point) if entry_point != 'python' else os.devnull
+        timings = []
+        for _ in range(repeat):
+            started = time.time()
+            process = subprocess.Popen([sys.executable, '-c', _STARTUP_SCRIPT, script], stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, cwd=directory)
+            _, output = process.communicate()
+            timings.append(time.time() - started)
+        modules = output.decode('ascii', 'replace').strip().splitlines()[-1].split(' ')[-1].split(',')
+        heavy = [module for module in HEAVY_MODULES if module in modules]
+        slowest = _slowest_imports(script) if entry_point != 'python' else []
+        results[entry_point] = (min(timings), heavy, slowest)
+    return results
+
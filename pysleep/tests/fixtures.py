@@ -0,0 +1,392 @@
+"""
+Helpers for the tests and benchmark.py: synthetic sessions, and local stand-ins for a Teensy and the fileserver
+"""
+import datetime
+import hashlib
+import os
+import random
+import threading
+import time
+import numpy
+from pysleep.capture import SleepEntry, OutFile, recover_logfile
+
+SYNTHETIC_SESSION_START = datetime.datetime(2015, 3, 6, 22, 0, 0)
+"""Start time used for synthetic sessions, so that generated sessions are reproducible"""
+
+
+def synthetic_movement_values(num_entries, seed=0):
+    """
+    Generates movement values that look roughly like a night of sleep: mostly small values,
+    with occasional bursts of large movement (rolling over, getting up).
+
+    :param num_entries: number of movement values to generate
+    :param seed: seed for the random generator, so runs can be repeated
+    :return: list of integer movement values
+    """
+    rng = random.Random(seed)
+    values = []
+    burst_remaining = 0
+    while len(values) < num_entries:
+        if burst_remaining:
+            burst_remaining -= 1
+            values.append(rng.randint(5, 200))
+        elif rng.random() < 0.005:
+            burst_remaining = rng.randint(5, 60)
+            values.append(rng.randint(5, 200))
+        else:
+            values.append(rng.randint(0, 2))
+    return values
+
+
+def iter_synthetic_sleep_entries(num_entries, seed=0, start=SYNTHETIC_SESSION_START, seconds_per_entry=1):
+    """
+    Yields a session of SleepEntries, one every `seconds_per_entry` seconds, starting at `start`.
+    Use this instead of synthetic_sleep_entries for sessions too long to hold as a list of SleepEntries.
+    """
+    timestamp = start
+    step = datetime.timedelta(seconds=seconds_per_entry)
+    for index, movement_value in enumerate(synthetic_movement_values(num_entries, seed)):
+        yield SleepEntry(index, movement_value,
+                         date=timestamp.strftime("%m-%d-%Y"),
+                         time=timestamp.strftime("%H-%M-%S"))
+        timestamp += step
+
+
+def synthetic_sleep_entries(num_entries, seed=0, start=SYNTHETIC_SESSION_START, seconds_per_entry=1):
+    """
+    Generates a session of SleepEntries, one every `seconds_per_entry` seconds, starting at `start`.
+
+    :return: list of SleepEntry
+    """
+    return list(iter_synthetic_sleep_entries(num_entries, seed, start, seconds_per_entry))
+
+
+def write_synthetic_logfile(filename, num_entries, seed=0, malformed_every=None):
+    """
+    Writes a synthetic session to `filename` in the same format as OutFile.
+
+    :param malformed_every: if given, every nth line is written with a movement value that isn't a number
+    :return: list of line numbers of the malformed lines
+    """
+    malformed_lines = []
+    timestamp = SYNTHETIC_SESSION_START
+    step = datetime.timedelta(seconds=1)
+    with open(filename, 'w') as logfile:
+        logfile.write(','.join(SleepEntry.header_names()) + "\r\n")
+        for index, movement_value in enumerate(synthetic_movement_values(num_entries, seed)):
+            if malformed_every and index % malformed_every == malformed_every - 1:
+                movement_value = 'x%d' % movement_value
+                malformed_lines.append(index + 2)
+            logfile.write("%02d-%02d-%04d,%02d-%02d-%02d,%d,%s\r\n" %
+                          (timestamp.month, timestamp.day, timestamp.year,
+                           timestamp.hour, timestamp.minute, timestamp.second, index, movement_value))
+            timestamp += step
+    return malformed_lines
+
+
+def read_all_arrays(sleep_file):
+    """Reads every chunk of sleep_file.sleep_entry_arrays into one (indexes, timestamps, movement_values) tuple"""
+    chunks = list(sleep_file.sleep_entry_arrays())
+    if not chunks:
+        return numpy.empty(0), numpy.empty(0), numpy.empty(0)
+    return tuple(numpy.concatenate([chunk[column] for chunk in chunks]) for column in range(3))
+
+
+
+def check_same_histogram(expected, actual):
+    """Asserts that two MovementHistograms have counted the same values"""
+    for name in ('counts', 'overflow', 'count', 'sum', 'sum_of_squares', 'min', 'max'):
+        assert getattr(expected, name) == getattr(actual, name), "histogram %s differs" % name
+
+
+def check_same_analysis(expected, actual):
+    """Asserts that two SleepAnalyzers have produced the same analysis results"""
+    for name in ('movement_sums', 'deteriorating_movement_sums', 'deteriorating_movement_sum_coefficients',
+                 'max_value'):
+        assert getattr(expected, name) == getattr(actual, name), "%s differs" % name
+    check_same_histogram(expected.histogram, actual.histogram)
+    assert expected.movement_episodes.episodes == actual.movement_episodes.episodes, "movement_episodes differ"
+    assert expected.movement_episodes.num_entries == actual.movement_episodes.num_entries, \
+        "movement_episodes entries differ"
+    for name in ('last_entries', 'sleep_entries'):
+        assert [str(x) for x in getattr(expected, name)] == [str(x) for x in getattr(actual, name)], \
+            "%s differs" % name
+
+
+
+def check_logfile_recovery(directory, sleep_entries, flush_entries=100):
+    """
+    Cuts an OutFile off part way through writing out a batch, as a power loss would, and checks that recover_logfile
+    leaves the logfile and its session index exactly as if the batch had been written in full.
+    """
+    expected = OutFile(os.path.join(directory, 'expected.slp.csv'), flush_entries=flush_entries)
+    for sleep_entry in sleep_entries:
+        expected.write_entry(sleep_entry)
+    expected.close()
+
+    crashed = OutFile(os.path.join(directory, 'crashed.slp.csv'), flush_entries=flush_entries)
+    for sleep_entry in sleep_entries[:-1]:
+        crashed.write_entry(sleep_entry)
+
+    def partial_write(data):
+        crashed.logfile.file_write(data[:len(data) // 2])
+        raise IOError("Power lost")
+
+    class TornFile(object):
+        def __init__(self, file_object):
+            self.file_object = file_object
+            self.file_write = file_object.write
+
+        def __getattr__(self, name):
+            return getattr(self.file_object, name)
+
+    crashed.logfile = TornFile(crashed.logfile)
+    crashed.logfile.write = partial_write
+    try:
+        crashed.write_entry(sleep_entries[-1])
+        assert False, "The last batch should have been cut short"
+    except IOError:
+        pass
+    for file_object in (crashed.logfile.file_object, crashed.index_file, crashed.journal):
+        file_object.close()
+
+    assert recover_logfile(crashed.logfile_name), "Nothing to recover"
+    for extension in ('', '.idx'):
+        with open(expected.logfile_name + extension) as expected_file:
+            with open(crashed.logfile_name + extension) as crashed_file:
+                assert expected_file.read() == crashed_file.read(), "Recovered %s differs" % extension
+    assert not os.path.exists(crashed.logfile_name + '.wal'), "Journal left behind"
+
+
+class PseudoTeensy(object):
+    """
+    Stands in for a Teensy plugged into the hub: a pseudo-terminal whose far end the hub opens like a serial port.
+    Closing it looks like the device being unplugged.
+    """
+    def __init__(self, num_readings, seed=0):
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        # Raw mode, so readings aren't echoed back (and left to fill up the pseudo-terminal) before the hub opens it
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.movement_values = iter(synthetic_movement_values(num_readings, seed))
+        self.readings_sent = 0
+
+    def send_reading(self):
+        os.write(self.master, ("%d\r\n" % next(self.movement_values)).encode('ascii'))
+        self.readings_sent += 1
+
+    def unplug(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def file_md5(filename):
+    """:return: hex md5 of the file"""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as file_object:
+        for block in iter(lambda: file_object.read(64 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class LocalFTPServer(object):
+    """
+    Stands in for the fileserver: just enough of an FTP server (one login, passive mode, LIST, STOR with REST,
+    SIZE and XMD5) for LogfileUploader, serving files from a local directory. Each connection is handled on a thread
+    of its own, like a real server. `latency` seconds are added before every reply, and uploads are limited to
+    `bytes_per_second` (shared between every connection), to act like a slow network.
+
+    Usage:
+        server = LocalFTPServer(directory)
+        uploader = LogfileUploader('127.0.0.1', server.user, server.password, port=server.port, remote_directory='.')
+        server.close()
+    """
+    def __init__(self, directory, user='logfiler', password='password', latency=0.0, bytes_per_second=None,
+                 xmd5=True):
+        try:
+            import SocketServer as socketserver
+        except ImportError:
+            import socketserver
+
+        self.directory = directory
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.xmd5 = xmd5
+
+        self.bytes_received = 0
+        """Bytes uploaded over every connection"""
+        self._next_receive_time = time.time()
+
+        self.commands = []
+        """Every command received, e.g. 'REST 1024', from every connection"""
+
+        self.connections = 0
+        self.max_connections = 0
+        self._open_connections = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server._connected(1)
+                try:
+                    LocalFTPSession(server, self.rfile, self.wfile).run()
+                finally:
+                    server._connected(-1)
+
+        self._server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="LocalFTPServer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _connected(self, change):
+        with self._lock:
+            self._open_connections += change
+            if change > 0:
+                self.connections += 1
+            self.max_connections = max(self.max_connections, self._open_connections)
+
+    def _received(self, num_bytes):
+        """Counts uploaded bytes, waiting as long as they would take at `bytes_per_second`"""
+        with self._lock:
+            self.bytes_received += num_bytes
+            if not self.bytes_per_second:
+                return
+            self._next_receive_time = max(self._next_receive_time, time.time()) + \
+                float(num_bytes) / self.bytes_per_second
+            wait = self._next_receive_time - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalFTPSession(object):
+    """One connection to a LocalFTPServer"""
+    def __init__(self, server, rfile, wfile):
+        self.server = server
+        self.rfile = rfile
+        self.wfile = wfile
+        self.logged_in = False
+        self.rest = 0
+        self.passive = None
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write((line + '\r\n').encode('ascii'))
+        self.wfile.flush()
+
+    def run(self):
+        self.reply('220 LocalFTPServer ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, _, argument = line.decode('ascii').strip().partition(' ')
+            command = command.upper()
+            with self.server._lock:
+                self.server.commands.append(line.decode('ascii').strip())
+            handler = getattr(self, 'ftp_' + command, None)
+            if handler is None:
+                self.reply('502 Command not implemented')
+            elif not self.logged_in and command not in ('USER', 'PASS', 'QUIT'):
+                self.reply('530 Not logged in')
+            elif handler(argument) is False:
+                break
+        if self.passive is not None:
+            self.passive.close()
+
+    def path(self, name):
+        return os.path.join(self.server.directory, os.path.basename(name))
+
+    def ftp_USER(self, argument):
+        self.reply('331 Password required')
+
+    def ftp_PASS(self, argument):
+        self.logged_in = argument == self.server.password
+        self.reply('230 Logged in' if self.logged_in else '530 Login incorrect')
+
+    def ftp_QUIT(self, argument):
+        self.reply('221 Goodbye')
+        return False
+
+    def ftp_NOOP(self, argument):
+        self.reply('200 OK')
+
+    def ftp_TYPE(self, argument):
+        self.reply('200 Type set to %s' % argument)
+
+    def ftp_CWD(self, argument):
+        self.reply('250 OK' if argument in ('.', 'logs') else '550 No such directory')
+
+    def ftp_PASV(self, argument):
+        import socket
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind(('127.0.0.1', 0))
+        self.passive.listen(1)
+        self.passive.settimeout(5)
+        port = self.passive.getsockname()[1]
+        self.reply('227 Entering Passive Mode (127,0,0,1,%d,%d)' % (port // 256, port % 256))
+
+    def ftp_REST(self, argument):
+        self.rest = int(argument)
+        self.reply('350 Restarting at %d' % self.rest)
+
+    def _data_connection(self):
+        connection, _ = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        return connection
+
+    def ftp_LIST(self, argument):
+        self.reply('150 Here comes the listing')
+        connection = self._data_connection()
+        for name in sorted(os.listdir(self.server.directory)):
+            path = self.path(name)
+            connection.sendall(('%s 1 ftp ftp %12d Mar 06 22:00 %s\r\n' %
+                                ('d' if os.path.isdir(path) else '-', os.path.getsize(path), name)).encode('ascii'))
+        connection.close()
+        self.reply('226 Transfer complete.')
+
+    def ftp_STOR(self, argument):
+        rest, self.rest = self.rest, 0
+        self.reply('150 Ok to send data')
+        connection = self._data_connection()
+        with open(self.path(argument), 'r+b' if rest and os.path.exists(self.path(argument)) else 'wb') as stored:
+            stored.truncate(rest)
+            stored.seek(rest)
+            while True:
+                data = connection.recv(64 * 1024)
+                if not data:
+                    break
+                self.server._received(len(data))
+                stored.write(data)
+        connection.close()
+        self.reply('226 Transfer complete.')
+
+    def ftp_SIZE(self, argument):
+        if os.path.isfile(self.path(argument)):
+            self.reply('213 %d' % os.path.getsize(self.path(argument)))
+        else:
+            self.reply('550 No such file')
+
+    def ftp_XMD5(self, argument):
+        if not self.server.xmd5:
+            self.reply('502 Command not implemented')
+        elif os.path.isfile(self.path(argument)):
+            self.reply('250 %s' % file_md5(self.path(argument)))
+        else:
+            self.reply('550 No such file')
+
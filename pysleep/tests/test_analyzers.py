@@ -0,0 +1,90 @@
+"""
+AnalyzerPipeline: every stage giving the same results as SleepAnalyzer, batches giving the same summary as one entry
+at a time (whether or not only the last entries are kept), summaries of plain numbers (as show logs them), and an
+untimed pipeline never timing a step
+"""
+import numbers
+import unittest
+import numpy
+from pysleep.analyzers import AnalyzerPipeline, ANALYZER_STAGES
+from pysleep.capture import SleepEntry
+from pysleep.utils import SleepAnalyzer
+
+START = 1425679200.0
+
+
+def movement_values(count):
+    return numpy.array([(index * 37) % 101 for index in range(count)], dtype=numpy.int64)
+
+
+def timestamps(count):
+    return START + numpy.arange(count, dtype=numpy.float64) * 2
+
+
+def sleep_entries(count):
+    return [SleepEntry(index, int(movement_value), timestamp=float(timestamp))
+            for index, (timestamp, movement_value) in enumerate(zip(timestamps(count), movement_values(count)))]
+
+
+class AnalyzerPipelineTest(unittest.TestCase):
+    def pipeline(self, timed=True, **kwargs):
+        return AnalyzerPipeline(sorted(ANALYZER_STAGES), min_movement_value=10, timed=timed, **kwargs)
+
+    def test_stages_match_sleep_analyzer(self):
+        expected = SleepAnalyzer(min_movement_value=10)
+        pipeline = self.pipeline()
+        for sleep_entry in sleep_entries(3000):
+            expected.add_entry(sleep_entry)
+            pipeline.add_entry(sleep_entry)
+        stages = pipeline.stages
+        self.assertEqual([str(x) for x in stages['store'].sleep_entries], [str(x) for x in expected.sleep_entries])
+        self.assertEqual(stages['big-movements'].movement_episodes.episodes, expected.movement_episodes.episodes)
+        self.assertEqual(stages['movement-sums'].movement_sums, expected.movement_sums)
+        self.assertEqual(stages['deteriorating-sums'].deteriorating_movement_sums,
+                         expected.deteriorating_movement_sums)
+        self.assertEqual(stages['deteriorating-slope'].deteriorating_movement_sum_coefficients,
+                         expected.deteriorating_movement_sum_coefficients)
+        self.assertEqual(stages['max'].max_value, expected.max_value)
+        self.assertEqual(stages['histogram'].histogram, expected.histogram)
+        self.assertEqual(pipeline.summary(), expected.summary())
+
+    def test_retained_batches_match_single_entries(self):
+        expected = self.pipeline()
+        for sleep_entry in sleep_entries(3000):
+            expected.add_entry(sleep_entry)
+        for batch_size in (1, 33, 100, 1000):
+            retained = self.pipeline(retain_entries=100)
+            for start in range(0, 3000, batch_size):
+                end = min(start + batch_size, 3000)
+                retained.analyze_array(movement_values(3000)[start:end], timestamps(3000)[start:end],
+                                       numpy.arange(start, end))
+            self.assertEqual(retained.summary(), expected.summary(), "Batches of %d" % batch_size)
+            self.assertEqual(list(retained.stages['movement-sums'].movement_sums),
+                             expected.stages['movement-sums'].movement_sums[-100:])
+
+    def test_batches_match_single_entries(self):
+        single = self.pipeline()
+        for sleep_entry in sleep_entries(500):
+            single.add_entry(sleep_entry)
+        batch = self.pipeline()
+        for start, end in ((0, 7), (7, 300), (300, 301), (301, 500)):
+            batch.analyze_array(movement_values(500)[start:end], timestamps(500)[start:end],
+                                numpy.arange(start, end))
+        self.assertEqual(batch.summary(), single.summary())
+
+    def test_summary_is_plain_statistics(self):
+        pipeline = self.pipeline()
+        pipeline.analyze_array(movement_values(500), timestamps(500))
+        for name, value in pipeline.summary().items():
+            self.assertTrue(value is None or isinstance(value, (numbers.Number, str)), "%s: %r" % (name, value))
+
+    def test_untimed_pipeline_times_nothing(self):
+        pipeline = self.pipeline(timed=False)
+        pipeline.add_entry(SleepEntry(0, 5, timestamp=START))
+        pipeline.analyze_array(movement_values(100), timestamps(100) + 2)
+        self.assertEqual(pipeline.num_entries, 101)
+        self.assertEqual(set(pipeline.seconds.values()), set([0.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+SleepEntryColumns: entries read back the same as they were stored, whichever way they are looked at, however many
+times the columns have had to grow. SleepEntryRing: only the last `size` entries are held, and every entry which
+drops out is spilled exactly once, in order, however the columns fill up
+"""
+import unittest
+import numpy
+from pysleep.capture import SleepEntry, timestamp_from_strings
+from pysleep.columns import SleepEntryColumns, SleepEntryRing
+
+START = 1425679200.0
+
+
+def sleep_entry(index):
+    return SleepEntry(index, index % 7, '03-06-2015', '22-%02d-%02d' % (index // 60 % 60, index % 60))
+
+
+def timestamped_entry(index):
+    return SleepEntry(index, index % 7, timestamp=START + index)
+
+
+class SleepEntryColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.columns = SleepEntryColumns()
+
+    def fill(self, count):
+        for index in range(count):
+            self.columns.append(sleep_entry(index))
+
+    def test_empty(self):
+        self.assertEqual(len(self.columns), 0)
+        self.assertEqual(list(self.columns), [])
+        self.assertEqual(self.columns.movement_values.tolist(), [])
+        self.assertRaises(IndexError, lambda: self.columns[0])
+        self.assertRaises(IndexError, lambda: self.columns[-1])
+
+    def test_entries_read_back_as_stored(self):
+        self.fill(100)
+        for entry, stored in zip([sleep_entry(index) for index in range(100)], self.columns):
+            self.assertEqual(str(stored), str(entry))
+
+    def test_columns_across_growth(self):
+        count = 2 * SleepEntryColumns.INITIAL_CAPACITY + 1
+        self.fill(count)
+        self.assertEqual(len(self.columns), count)
+        self.assertEqual(self.columns.indexes.tolist(), list(range(count)))
+        self.assertEqual(self.columns.movement_values.tolist(), [index % 7 for index in range(count)])
+        self.assertEqual(self.columns.timestamps[-1], sleep_entry(count - 1).timestamp)
+
+    def test_negative_index(self):
+        self.fill(10)
+        self.assertEqual(self.columns[-1].index, 9)
+        self.assertEqual(self.columns[-10].index, 0)
+        self.assertRaises(IndexError, lambda: self.columns[-11])
+        self.assertRaises(IndexError, lambda: self.columns[10])
+
+    def test_slices_match_list_slices(self):
+        self.fill(10)
+        indexes = list(range(10))
+        for key in (slice(None), slice(-3, None), slice(2, 5), slice(None, None, -2), slice(8, 20), slice(5, 2)):
+            self.assertEqual([entry.index for entry in self.columns[key]], indexes[key])
+
+    def test_timestamps_match_date_and_time(self):
+        self.fill(3)
+        self.assertEqual(self.columns.timestamps.tolist(),
+                         [timestamp_from_strings('03-06-2015', '22-00-%02d' % index) for index in range(3)])
+
+
+class SpillCollector(object):
+    """SleepEntryRing spill which keeps (index, timestamp, movement_value) of every entry spilled"""
+    def __init__(self):
+        self.entries = []
+        self.calls = 0
+
+    def __call__(self, indexes, timestamps, movement_values):
+        # The arrays are views of the ring's columns, which are about to be overwritten
+        self.entries.extend(zip(indexes.tolist(), timestamps.tolist(), movement_values.tolist()))
+        self.calls += 1
+
+    @property
+    def indexes(self):
+        return [index for index, timestamp, movement_value in self.entries]
+
+
+class SleepEntryRingTest(unittest.TestCase):
+    def setUp(self):
+        self.spilled = SpillCollector()
+        self.ring = SleepEntryRing(4, spill=self.spilled)
+
+    def assertHolds(self, indexes):
+        self.assertEqual(self.ring.indexes.tolist(), indexes)
+        self.assertEqual(self.ring.timestamps.tolist(), [START + index for index in indexes])
+        self.assertEqual(self.ring.movement_values.tolist(), [index % 7 for index in indexes])
+        self.assertEqual([entry.index for entry in self.ring], indexes)
+
+    def test_holds_last_size_entries(self):
+        for index in range(10):
+            self.ring.append(timestamped_entry(index))
+        self.assertHolds([6, 7, 8, 9])
+        self.assertEqual(len(self.ring), 4)
+        self.assertEqual(self.ring.num_added, 10)
+        self.assertEqual(self.ring.dropped, 6)
+        self.assertEqual(self.ring.first_timestamp, START)
+        self.assertEqual(self.ring[-1].index, 9)
+        self.assertEqual([entry.index for entry in self.ring[-2:]], [8, 9])
+
+    def test_nothing_spilled_until_columns_are_full(self):
+        # The columns have room for 2 * size entries
+        for index in range(8):
+            self.ring.append(timestamped_entry(index))
+        self.assertEqual(self.spilled.entries, [])
+        self.assertHolds([4, 5, 6, 7])
+
+    def test_compaction_spills_dropped_entries(self):
+        for index in range(9):
+            self.ring.append(timestamped_entry(index))
+        self.assertEqual(self.spilled.entries, [(index, START + index, index % 7) for index in range(4)])
+        self.assertHolds([5, 6, 7, 8])
+
+    def test_every_dropped_entry_spilled_once_in_order(self):
+        for index in range(100):
+            self.ring.append(timestamped_entry(index))
+        self.ring.flush()
+        self.assertEqual(self.spilled.indexes, list(range(96)))
+        self.assertHolds([96, 97, 98, 99])
+        # Flushing again has nothing left to spill
+        calls = self.spilled.calls
+        self.ring.flush()
+        self.assertEqual(self.spilled.calls, calls)
+
+    def test_flush_without_drops_spills_nothing(self):
+        for index in range(3):
+            self.ring.append(timestamped_entry(index))
+        self.ring.flush()
+        self.assertEqual(self.spilled.entries, [])
+        self.assertHolds([0, 1, 2])
+
+    def test_extend_across_capacity(self):
+        index = 0
+        for batch_size in (1, 3, 2, 5, 4, 1, 7, 3, 2, 6, 1, 1, 3):
+            indexes = numpy.arange(index, index + batch_size)
+            self.ring.extend(indexes, START + indexes.astype(numpy.float64), indexes % 7)
+            index += batch_size
+            self.assertHolds(list(range(max(0, index - 4), index)))
+            self.assertEqual(self.ring.num_added, index)
+            # Every entry is either still held or has been (or is about to be) spilled, never both
+            self.assertEqual(self.spilled.indexes, list(range(len(self.spilled.indexes))))
+            self.assertTrue(len(self.spilled.indexes) <= index - len(self.ring))
+        self.ring.flush()
+        self.assertEqual(self.spilled.indexes, list(range(index - 4)))
+
+    def test_extend_bigger_than_ring(self):
+        for index in range(3):
+            self.ring.append(timestamped_entry(index))
+        indexes = numpy.arange(3, 13)
+        self.ring.extend(indexes, START + indexes.astype(numpy.float64), indexes % 7)
+        self.assertHolds([9, 10, 11, 12])
+        self.assertEqual(self.spilled.indexes, list(range(9)))
+        self.assertEqual(self.ring.dropped, 9)
+        self.assertEqual(self.ring.first_timestamp, START)
+
+    def test_append_and_extend_interleaved(self):
+        index = 0
+        for step in range(40):
+            if step % 3:
+                self.ring.append(timestamped_entry(index))
+                index += 1
+            else:
+                indexes = numpy.arange(index, index + step % 6)
+                self.ring.extend(indexes, START + indexes.astype(numpy.float64), indexes % 7)
+                index += len(indexes)
+        self.assertHolds(list(range(index - 4, index)))
+        self.ring.flush()
+        self.assertEqual(self.spilled.indexes, list(range(index - 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+EpisodeIndex: a run of big movements split across batches (or between add and add_arrays) is still one episode
+"""
+import unittest
+import numpy
+from pysleep.episodes import EpisodeIndex, MovementEpisode
+
+MIN_MOVEMENT_VALUE = 10
+
+VALUES = [0, 20, 30, 5, 40, 40, 50, 0, 11, 12, 13, 0, 0, 99, 99, 1, 15]
+"""Movement values with runs of big movements (over MIN_MOVEMENT_VALUE) of several lengths, including ties for the
+peak, and one at each end"""
+
+
+def arrays(values, first_index=0, indexes=None):
+    indexes = numpy.arange(first_index, first_index + len(values)) if indexes is None else numpy.array(indexes)
+    return indexes, 1425679200.0 + indexes.astype(numpy.float64), numpy.array(values)
+
+
+def one_at_a_time(indexes, timestamps, movement_values):
+    episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+    for index, timestamp, movement_value in zip(indexes.tolist(), timestamps.tolist(), movement_values.tolist()):
+        episodes.add(index, timestamp, movement_value)
+    return episodes
+
+
+def in_batches(indexes, timestamps, movement_values, splits):
+    episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+    bounds = [0] + list(splits) + [len(indexes)]
+    for start, end in zip(bounds, bounds[1:]):
+        episodes.add_arrays(indexes[start:end], timestamps[start:end], movement_values[start:end])
+    return episodes
+
+
+class EpisodeMergingTest(unittest.TestCase):
+    def assertSameEpisodes(self, expected, actual, message=None):
+        self.assertEqual(actual.episodes, expected.episodes, message)
+        self.assertEqual(actual.num_entries, expected.num_entries, message)
+        # The bisect keys are kept up to date as the last episode is extended
+        self.assertEqual(actual._starts, [episode.start for episode in actual.episodes], message)
+        self.assertEqual(actual._ends, [episode.end for episode in actual.episodes], message)
+
+    def test_expected_episodes(self):
+        indexes, timestamps, movement_values = arrays(VALUES)
+        episodes = one_at_a_time(indexes, timestamps, movement_values)
+        self.assertEqual([(episode.start_index, episode.end_index, episode.peak, episode.peak_index, episode.integral)
+                          for episode in episodes],
+                         [(1, 2, 30, 2, 50), (4, 6, 50, 6, 130), (8, 10, 13, 10, 36), (13, 14, 99, 13, 198),
+                          (16, 16, 15, 16, 15)])
+
+    def test_every_split_into_two_batches(self):
+        data = arrays(VALUES)
+        expected = one_at_a_time(*data)
+        for split in range(len(VALUES) + 1):
+            self.assertSameEpisodes(expected, in_batches(data[0], data[1], data[2], [split]), "Split at %d" % split)
+
+    def test_every_split_into_three_batches(self):
+        data = arrays(VALUES)
+        expected = one_at_a_time(*data)
+        for first in range(len(VALUES) + 1):
+            for second in range(first, len(VALUES) + 1):
+                self.assertSameEpisodes(expected, in_batches(data[0], data[1], data[2], [first, second]),
+                                        "Split at %d and %d" % (first, second))
+
+    def test_one_entry_batches(self):
+        data = arrays(VALUES)
+        self.assertSameEpisodes(one_at_a_time(*data), in_batches(data[0], data[1], data[2], range(1, len(VALUES))))
+
+    def test_peak_tie_across_batches_keeps_first(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([40, 20], first_index=2))
+        self.assertEqual(episodes.episodes,
+                         [MovementEpisode(1, 3, 1425679201.0, 1425679203.0, 40, 1, 100)])
+
+    def test_higher_peak_in_later_batch(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([50, 50], first_index=2))
+        self.assertEqual(len(episodes), 1)
+        self.assertEqual((episodes[0].peak, episodes[0].peak_index, episodes[0].integral), (50, 2, 140))
+
+    def test_small_value_at_start_of_batch_ends_episode(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([10, 40], first_index=2))
+        self.assertEqual([(episode.start_index, episode.end_index) for episode in episodes], [(1, 1), (3, 3)])
+
+    def test_batch_without_big_movements_ends_episode(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([0, 1], first_index=2))
+        episodes.add_arrays(*arrays([40], first_index=4))
+        self.assertEqual([(episode.start_index, episode.end_index) for episode in episodes], [(1, 1), (4, 4)])
+
+    def test_missing_index_at_batch_boundary_starts_new_episode(self):
+        # A reading lost between the batches (e.g. dropped by a full queue) breaks the run
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([40, 40], first_index=3))
+        self.assertEqual([(episode.start_index, episode.end_index) for episode in episodes], [(1, 1), (3, 4)])
+
+    def test_missing_index_within_batch_starts_new_episode(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([40, 40, 40, 40], indexes=[0, 1, 3, 4]))
+        self.assertEqual([(episode.start_index, episode.end_index) for episode in episodes], [(0, 1), (3, 4)])
+
+    def test_empty_batch_keeps_episode_open(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40]))
+        episodes.add_arrays(*arrays([]))
+        episodes.add_arrays(*arrays([40], first_index=2))
+        self.assertEqual([(episode.start_index, episode.end_index) for episode in episodes], [(1, 2)])
+
+    def test_add_and_add_arrays_carry_on_each_others_episodes(self):
+        indexes, timestamps, movement_values = arrays(VALUES)
+        expected = one_at_a_time(indexes, timestamps, movement_values)
+        for split in range(len(VALUES) + 1):
+            for first_batch in (True, False):
+                episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+                for start, end, batch in ((0, split, first_batch), (split, len(VALUES), not first_batch)):
+                    if batch:
+                        episodes.add_arrays(indexes[start:end], timestamps[start:end], movement_values[start:end])
+                    else:
+                        for position in range(start, end):
+                            episodes.add(int(indexes[position]), float(timestamps[position]),
+                                         int(movement_values[position]))
+                self.assertSameEpisodes(expected, episodes, "Split at %d" % split)
+
+    def test_queries_see_merged_episode(self):
+        episodes = EpisodeIndex(MIN_MOVEMENT_VALUE)
+        episodes.add_arrays(*arrays([0, 40, 40]))
+        episodes.add_arrays(*arrays([40, 40, 0], first_index=3))
+        self.assertEqual(episodes.at(1425679204.0), episodes[0])
+        self.assertEqual(episodes.query(min_duration=3), [episodes[0]])
+        self.assertEqual(episodes.within(1425679201.0, 1425679203.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+LiveSessionGraphs (drawn off screen): lines drawn from the pipeline's own analysis, the same whether or not it only
+keeps the last entries, and frames capped however fast entries arrive. Needs matplotlib.
+"""
+import unittest
+from pysleep.analyzers import AnalyzerPipeline
+from tests.fixtures import synthetic_sleep_entries
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from pysleep.graphs import LiveSessionGraphs
+except ImportError:
+    LiveSessionGraphs = None
+
+
+@unittest.skipIf(LiveSessionGraphs is None, "needs matplotlib")
+class LiveSessionGraphsTest(unittest.TestCase):
+    def graphs(self, session_id, **kwargs):
+        analysis = AnalyzerPipeline(LiveSessionGraphs.STAGES, session_id=session_id, timed=False, **kwargs)
+        return analysis, LiveSessionGraphs(analysis, frame_rate=5)
+
+    def add_entries(self, analysis, live_session_graphs, sleep_entries):
+        for sleep_entry in sleep_entries:
+            analysis.add_entry(sleep_entry)
+            live_session_graphs.add_entry(sleep_entry)
+
+    def test_needs_the_stages_it_draws(self):
+        self.assertRaises(ValueError, LiveSessionGraphs, AnalyzerPipeline(('store',), timed=False))
+
+    def test_retained_analysis_draws_the_same_lines(self):
+        sleep_entries = synthetic_sleep_entries(3000)
+        analysis, whole = self.graphs('whole')
+        self.add_entries(analysis, whole, sleep_entries)
+        # A session of its own, so it gets a figure of its own
+        analysis, retained = self.graphs('retained', retain_entries=whole.history_size)
+        self.add_entries(analysis, retained, sleep_entries)
+        whole.draw_frame()
+        retained.draw_frame()
+        for name in ('movement_line', 'sums_line'):
+            self.assertEqual([list(values) for values in getattr(retained, name).get_data()],
+                             [list(values) for values in getattr(whole, name).get_data()], name)
+        self.assertEqual(list(whole.movement_line.get_data()[0]), list(range(3000 - whole.history_size, 3000)))
+
+    def test_frames_capped_however_fast_entries_arrive(self):
+        analysis, live_session_graphs = self.graphs('capped')
+        self.add_entries(analysis, live_session_graphs, synthetic_sleep_entries(2000))
+        stats = live_session_graphs.frame_stats()
+        self.assertTrue(0 < stats['frames_drawn'] < 2000)
+        self.assertTrue(stats['entries_coalesced'] >= 2000 - stats['frames_drawn'] - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+MovementHistogram: the same counts one value at a time as in one go, statistics matching numpy over the raw values,
+and sessions' histograms merging into the histogram of all of them
+"""
+import math
+import unittest
+import numpy
+from pysleep.histogram import MovementHistogram
+from tests.fixtures import synthetic_movement_values
+
+
+def histogram_of(movement_values, **kwargs):
+    histogram = MovementHistogram(**kwargs)
+    histogram.add_array(movement_values)
+    return histogram
+
+
+class MovementHistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.movement_values = numpy.array(synthetic_movement_values(20000))
+
+    def test_add_matches_add_array(self):
+        histogram = MovementHistogram()
+        for movement_value in self.movement_values.tolist():
+            histogram.add(movement_value)
+        self.assertEqual(histogram, histogram_of(self.movement_values))
+
+    def test_statistics_match_numpy(self):
+        histogram = histogram_of(self.movement_values)
+        in_order = numpy.sort(self.movement_values)
+        self.assertEqual(histogram.mode, int(numpy.argmax(numpy.bincount(self.movement_values))))
+        self.assertAlmostEqual(histogram.mean, self.movement_values.mean(), places=9)
+        self.assertAlmostEqual(histogram.variance, self.movement_values.var(), places=6)
+        for percent in (0, 5, 25, 50, 75, 95, 99, 100):
+            self.assertEqual(histogram.percentile(percent),
+                             in_order[int(math.floor(percent / 100.0 * (len(in_order) - 1)))], "%d%%" % percent)
+
+    def test_overflow_percentiles_give_the_largest_value(self):
+        histogram = histogram_of(self.movement_values, num_bins=10)
+        self.assertEqual(histogram.overflow, int((self.movement_values >= 10).sum()))
+        self.assertEqual(histogram.percentile(100), self.movement_values.max())
+
+    def test_sessions_merge_into_the_whole(self):
+        merged = MovementHistogram()
+        for session in numpy.array_split(self.movement_values, 7):
+            merged.merge(histogram_of(session))
+        self.assertEqual(merged, histogram_of(self.movement_values))
+        halves = numpy.array_split(self.movement_values, 2)
+        self.assertEqual(histogram_of(halves[0]) + histogram_of(halves[1]), merged)
+
+    def test_empty(self):
+        histogram = MovementHistogram()
+        histogram.add_array([])
+        self.assertEqual((histogram.mode, histogram.mean, histogram.percentile(50)), (None, None, None))
+        self.assertEqual(histogram.merge(MovementHistogram()), MovementHistogram())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+SleepHub: readings are logged once their line is complete, however they are split up on the way, and ports which
+don't act like a Teensy are left alone until they are plugged back in (Linux and OS X only, as it uses pseudo-terminals)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from pysleep.hub import SleepHub
+
+try:
+    import pty
+    import tty
+except ImportError:
+    pty = None
+
+
+@unittest.skipIf(pty is None, "needs pseudo-terminals")
+class SleepHubTest(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.ports = [self.port]
+        self.hub = SleepHub(find_ports=lambda: self.ports, log_dir=self.log_dir)
+        self.hub.scan()
+        self.device = self.hub.devices[self.port]
+
+    def tearDown(self):
+        for port in list(self.hub.devices):
+            self.hub.close_device(port, "test over")
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        shutil.rmtree(self.log_dir)
+
+    def send(self, data):
+        os.write(self.master, data.encode('ascii'))
+        return self.hub.poll(1)
+
+    def logged_values(self):
+        with open(self.device.logfile.logfile_name) as logfile:
+            return [int(line.strip().split(',')[3]) for line in logfile.readlines()[1:]]
+
+    def test_readings_split_across_reads(self):
+        self.assertEqual(self.send('12\r\n3'), 1)
+        self.assertEqual(self.send('4\r'), 0)
+        self.assertEqual(self.send('\n5\r\n'), 2)
+        self.hub.close_device(self.port, "test over")
+        self.assertEqual(self.logged_values(), [12, 34, 5])
+        self.assertEqual(self.device.next_available_index, 3)
+
+    def test_analysis_keeps_only_retained_readings(self):
+        self.assertEqual(self.device.retain_entries, SleepHub.RETAIN_ENTRIES)
+        # The analyzer is made by the first reading
+        self.device.retain_entries = 2
+        self.assertEqual(self.send('1\r\n9\r\n3\r\n'), 3)
+        self.assertEqual(len(self.device.sleep_analyzer.sleep_entries), 2)
+        summary = self.device.sleep_analyzer.summary()
+        self.assertEqual((summary['entries'], summary['max']), (3, 9))
+
+    def test_malformed_readings_skipped(self):
+        self.assertEqual(self.send('7\r\nxyz\r\n\r\n8\r\n'), 2)
+        self.hub.close_device(self.port, "test over")
+        self.assertEqual(self.logged_values(), [7, 8])
+        self.assertEqual(self.device.malformed_readings, 1)
+
+    def test_silent_port_ignored_until_plugged_back_in(self):
+        self.hub.SILENT_TIMEOUT = 0
+        self.hub.poll(0)
+        self.assertNotIn(self.port, self.hub.devices)
+        self.assertIsNone(self.device.logfile)
+
+        self.hub.scan()
+        self.assertNotIn(self.port, self.hub.devices)
+
+        self.ports = []
+        self.hub.scan()
+        self.ports = [self.port]
+        self.hub.scan()
+        self.assertIn(self.port, self.hub.devices)
+
+    def test_session_ends_when_unplugged(self):
+        self.send('5\r\n')
+        os.close(self.master)
+        self.hub.poll(1)
+        self.assertNotIn(self.port, self.hub.devices)
+        self.assertEqual(len(self.hub.finished_sessions), 1)
+        self.assertEqual(self.logged_values(), [5])
+
+
+if __name__ == '__main__':
+    unittest.main()
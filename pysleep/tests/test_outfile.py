@@ -0,0 +1,147 @@
+"""
+OutFile's journal: a batch cut short by a power loss is finished off (or cleanly dropped) by recover_logfile.
+OutFile's batches: waiting entries are written out once they are old enough, even if no more entries arrive
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from pysleep.capture import OutFile, recover_logfile, recover_logfiles, journal_filename_for
+from tests.fixtures import check_logfile_recovery, synthetic_sleep_entries
+
+
+def read_file(filename):
+    with open(filename, 'rb') as file_object:
+        return file_object.read()
+
+
+def abandon(outfile):
+    """Closes an OutFile's files without finishing the session, as if the power went"""
+    for file_object in (outfile.logfile, outfile.index_file, outfile.journal):
+        file_object.close()
+
+
+class RecoverLogfileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sleep_entries = synthetic_sleep_entries(250)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def outfile(self, name, num_entries, flush_entries=50):
+        outfile = OutFile(os.path.join(self.directory, name), flush_entries=flush_entries, fsync=False)
+        for sleep_entry in self.sleep_entries[:num_entries]:
+            outfile.write_entry(sleep_entry)
+        return outfile
+
+    def test_torn_logfile_write_is_replayed(self):
+        # The journal has the whole batch, but only half of it reached the logfile
+        check_logfile_recovery(self.directory, self.sleep_entries, flush_entries=50)
+
+    def test_torn_batch_on_batch_boundary(self):
+        # The cut off batch is the session's first one
+        check_logfile_recovery(self.directory, self.sleep_entries[:50], flush_entries=50)
+
+    def test_torn_journal_drops_the_partial_batch(self):
+        outfile = self.outfile('torn-journal.slp.csv', 100)
+        abandon(outfile)
+        written = read_file(outfile.logfile_name)
+        # The power went while the next batch was going into the journal, before any of it reached the logfile,
+        # then the logfile's last line was cut short anyway (e.g. by the filesystem)
+        with open(outfile.journal_name, 'wb') as journal:
+            journal.write(b'%d,%d,0,0\n3-06-2015,22-0' % (len(written), 2000))
+        with open(outfile.logfile_name, 'ab') as logfile:
+            logfile.write(b'03-06-2015,22-01-40,10')
+
+        self.assertTrue(recover_logfile(outfile.logfile_name))
+        self.assertEqual(read_file(outfile.logfile_name), written)
+        self.assertFalse(os.path.exists(outfile.journal_name))
+
+    def test_empty_journal_leaves_logfile_alone(self):
+        # Every batch was written out in full before the power went
+        outfile = self.outfile('between-batches.slp.csv', 100)
+        abandon(outfile)
+        written = read_file(outfile.logfile_name)
+        self.assertEqual(os.path.getsize(outfile.journal_name), 0)
+
+        self.assertTrue(recover_logfile(outfile.logfile_name))
+        self.assertEqual(read_file(outfile.logfile_name), written)
+        self.assertEqual(written.count(b'\n'), 101)
+        self.assertFalse(os.path.exists(outfile.journal_name))
+
+    def test_replaying_twice_does_no_harm(self):
+        self.outfile('expected.slp.csv', 100).close()
+        outfile = self.outfile('replayed.slp.csv', 100)
+        abandon(outfile)
+        # The batch did reach the logfile in full, but the journal wasn't cleared
+        logfile_offset = len(read_file(outfile.logfile_name)) - 1000
+        with open(outfile.logfile_name, 'rb') as logfile:
+            logfile.seek(logfile_offset)
+            batch = logfile.read()
+        with open(outfile.journal_name, 'wb') as journal:
+            journal.write(b'%d,%d,0,0\n' % (logfile_offset, len(batch)) + batch)
+
+        self.assertTrue(recover_logfile(outfile.logfile_name))
+        self.assertEqual(read_file(outfile.logfile_name),
+                         read_file(os.path.join(self.directory, 'expected.slp.csv')))
+
+    def test_nothing_to_recover(self):
+        outfile = self.outfile('finished.slp.csv', 100)
+        outfile.close()
+        self.assertFalse(recover_logfile(outfile.logfile_name))
+
+    def test_journal_without_logfile_is_removed(self):
+        journal_name = journal_filename_for(os.path.join(self.directory, 'gone.slp.csv'))
+        with open(journal_name, 'wb') as journal:
+            journal.write(b'0,10,0,0\n')
+        self.assertFalse(recover_logfile(journal_name[:-len('.wal')]))
+        self.assertFalse(os.path.exists(journal_name))
+
+    def test_recover_logfiles_finishes_every_logfile(self):
+        self.outfile('expected.slp.csv', 100).close()
+        outfiles = [self.outfile('crashed-%d.slp.csv' % number, 100) for number in range(3)]
+        for outfile in outfiles:
+            abandon(outfile)
+            with open(outfile.logfile_name, 'ab') as logfile:
+                logfile.write(b'03-06-2015,22-01-40,10')
+
+        recover_logfiles(self.directory)
+        expected = read_file(os.path.join(self.directory, 'expected.slp.csv'))
+        for outfile in outfiles:
+            self.assertEqual(read_file(outfile.logfile_name), expected)
+            self.assertFalse(os.path.exists(outfile.journal_name))
+
+
+class OutFileFlushTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.outfile = OutFile(os.path.join(self.directory, 'session.slp.csv'), flush_entries=50, flush_seconds=60,
+                               fsync=False)
+        self.header = read_file(self.outfile.logfile_name)
+
+    def tearDown(self):
+        self.outfile.close()
+        shutil.rmtree(self.directory)
+
+    def test_waiting_entries_written_once_due_without_more_entries(self):
+        for sleep_entry in synthetic_sleep_entries(3):
+            self.outfile.write_entry(sleep_entry)
+        first_pending_time = self.outfile._first_pending_time
+
+        self.outfile.flush_if_due(first_pending_time + 59)
+        self.assertEqual(read_file(self.outfile.logfile_name), self.header)
+        self.assertEqual(self.outfile.write_stats()['pending'], 3)
+
+        self.outfile.flush_if_due(first_pending_time + 60)
+        self.assertEqual(self.outfile.write_stats()['pending'], 0)
+        self.assertEqual(self.outfile.flushes, 1)
+        self.assertEqual(len(read_file(self.outfile.logfile_name).splitlines()), 4)
+
+    def test_nothing_waiting_writes_nothing(self):
+        self.outfile.flush_if_due()
+        self.assertEqual(self.outfile.flushes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+SleepEntryPipeline's stages: every entry handled in order (or counted as dropped) however slow a stage is, and the
+idle function called while entries stop coming
+"""
+import time
+import unittest
+from pysleep.capture import SleepEntry, SleepReader
+from pysleep.pipeline import SleepEntryPipeline, Stage, DROP_OLDEST, DROP_NEWEST
+
+
+class PausingReader(SleepReader):
+    """Yields a few entries, waits, then yields a few more"""
+    def __init__(self, pause_seconds, **kwargs):
+        super(PausingReader, self).__init__(**kwargs)
+        self.pause_seconds = pause_seconds
+
+    def sleep_entries(self):
+        for index in range(6):
+            if index == 3:
+                time.sleep(self.pause_seconds)
+            yield SleepEntry(index, index)
+
+
+class ListReader(SleepReader):
+    """Yields `num_entries` entries as fast as they are taken"""
+    def __init__(self, num_entries, **kwargs):
+        super(ListReader, self).__init__(**kwargs)
+        self.num_entries = num_entries
+
+    def sleep_entries(self):
+        for index in range(self.num_entries):
+            yield SleepEntry(index, index % 7)
+
+
+def stalling_handler(handled, stall_every=100, stall_seconds=0.05):
+    """Handler which adds each entry's index onto `handled`, stalling now and again as a busy SD card might"""
+    def handle(sleep_entry):
+        handled.append(sleep_entry.index)
+        if len(handled) % stall_every == 0:
+            time.sleep(stall_seconds)
+    return handle
+
+
+class PipelineStageTest(unittest.TestCase):
+    def test_blocking_stage_handles_every_entry_in_order(self):
+        handled = []
+        pipeline = SleepEntryPipeline(ListReader(500))
+        stage = pipeline.add_stage('stalling', stalling_handler(handled), queue_size=10)
+        pipeline.run()
+        self.assertEqual(handled, list(range(500)))
+        self.assertEqual((stage.handled, stage.dropped), (500, 0))
+
+    def test_dropping_stages_count_what_they_drop(self):
+        for drop_policy in (DROP_OLDEST, DROP_NEWEST):
+            handled = []
+            pipeline = SleepEntryPipeline(ListReader(500))
+            lossy = pipeline.add_stage('lossy', stalling_handler(handled), queue_size=10, drop_policy=drop_policy)
+            pipeline.run()
+            self.assertEqual(lossy.handled + lossy.dropped, 500, drop_policy)
+            self.assertEqual(lossy.handled, len(handled))
+            self.assertEqual(handled, sorted(handled), "%s reordered entries" % drop_policy)
+
+    def test_slow_stage_doesnt_hold_up_the_others(self):
+        everything, lossy_handled = [], []
+        pipeline = SleepEntryPipeline(ListReader(500))
+        pipeline.add_stage('everything', everything.append)
+        pipeline.add_stage('lossy', stalling_handler(lossy_handled, stall_every=10), queue_size=5,
+                           drop_policy=DROP_OLDEST)
+        pipeline.run()
+        self.assertEqual([sleep_entry.index for sleep_entry in everything], list(range(500)))
+        self.assertTrue(len(lossy_handled) < 500)
+
+
+class StageIdleTest(unittest.TestCase):
+    def test_idle_called_once_queue_runs_empty(self):
+        calls = []
+        stage = Stage('test', calls.append, idle=lambda: calls.append('idle'))
+        for index in range(2):
+            stage.put(time.time(), index)
+        self.assertTrue(stage.handle_waiting(timeout=0))
+        self.assertEqual(calls, [0, 1, 'idle'])
+        self.assertTrue(stage.handle_waiting(timeout=0))
+        self.assertEqual(calls, [0, 1, 'idle', 'idle'])
+
+    def test_failing_idle_fails_the_stage(self):
+        def idle():
+            raise IOError("disk full")
+        stage = Stage('test', lambda sleep_entry: None, idle=idle)
+        self.assertFalse(stage.handle_waiting(timeout=0))
+        self.assertIsInstance(stage.error, IOError)
+
+    def test_idle_called_while_reader_pauses(self):
+        Stage.IDLE_SECONDS = 0.05
+        try:
+            calls = []
+            pipeline = SleepEntryPipeline(PausingReader(0.5))
+            pipeline.add_stage('test', lambda sleep_entry: calls.append(sleep_entry.index),
+                               idle=lambda: calls.append('idle'))
+            pipeline.run()
+        finally:
+            del Stage.IDLE_SECONDS
+        self.assertEqual([call for call in calls if call != 'idle'], list(range(6)))
+        # Called over and over during the pause, between the first three entries and the rest
+        pause = calls[calls.index(2) + 1:calls.index(3)]
+        self.assertTrue(len(pause) >= 3 and set(pause) == set(['idle']), calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+ReadingLog: summaries cover every reading, including the last few before the Teensy stops sending
+"""
+import logging
+import unittest
+from pysleep.capture import SleepReader, Teensy
+from pysleep.pysleeplogging import ReadingLog
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def teensy_reading(lines, reading_log):
+    """A Teensy reading `lines`, without searching for a real one"""
+    teensy = Teensy.__new__(Teensy)
+    SleepReader.__init__(teensy)
+    teensy.teensy = lines
+    teensy.reading_log = reading_log
+    return teensy
+
+
+class ReadingLogTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('test_reading_log')
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        self.reading_log = ReadingLog(summary_seconds=3600, logger=self.logger)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_last_readings_summarized_when_reading_stops(self):
+        teensy = teensy_reading(['3\r\n', '9\r\n', '6\r\n'], self.reading_log)
+        self.assertEqual([sleep_entry.movement_value for sleep_entry in teensy.sleep_entries()], [3, 9, 6])
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].startswith("Read 3 movement values"), self.handler.messages)
+        self.assertTrue(self.handler.messages[0].endswith("(min 3, mean 6.0, max 9)"), self.handler.messages)
+
+    def test_summarized_when_caller_stops_early(self):
+        teensy = teensy_reading(['3\r\n', '9\r\n', '6\r\n'], self.reading_log)
+        sleep_entries = teensy.sleep_entries()
+        next(sleep_entries)
+        sleep_entries.close()
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertTrue(self.handler.messages[0].startswith("Read 1 movement values"), self.handler.messages)
+
+    def test_nothing_logged_without_readings(self):
+        self.assertEqual(list(teensy_reading([], self.reading_log).sleep_entries()), [])
+        self.assertEqual(self.handler.messages, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+"""
+decimate: a long series thinned down to the plot's width keeps every bin's highest and lowest value
+"""
+import unittest
+import numpy
+from pysleep.render import decimate
+from tests.fixtures import synthetic_movement_values
+
+
+class DecimateTest(unittest.TestCase):
+    def test_short_series_left_alone(self):
+        x_values, y_values = decimate(range(10), range(10, 20), 5)
+        self.assertEqual(x_values.tolist(), list(range(10)))
+        self.assertEqual(y_values.tolist(), list(range(10, 20)))
+
+    def test_every_bin_keeps_its_lowest_and_highest(self):
+        movement_values = numpy.array(synthetic_movement_values(100000), dtype=numpy.float64)
+        x_values, y_values = decimate(numpy.arange(len(movement_values)), movement_values, 800)
+        self.assertTrue(len(y_values) <= 2 * 800)
+        self.assertEqual(y_values.max(), movement_values.max())
+        self.assertEqual(y_values.min(), movement_values.min())
+        starts = x_values[::2].astype(numpy.int64).tolist() + [len(movement_values)]
+        for position, (start, end) in enumerate(zip(starts[:-1], starts[1:])):
+            self.assertEqual(y_values[2 * position], movement_values[start:end].min())
+            self.assertEqual(y_values[2 * position + 1], movement_values[start:end].max())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Summarizing many logfiles: the same summaries across a process pool as one after another, files which can't be read
+reported rather than raised, and the combined row's statistics covering every reading
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from pysleep.report import summarize_files, combine_summaries
+from tests.fixtures import synthetic_movement_values, write_synthetic_logfile
+
+
+class SummarizeFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for seed in range(3):
+            self.filenames.append(os.path.join(self.directory, 'session%d.slp.csv' % seed))
+            write_synthetic_logfile(self.filenames[-1], 5000 + 1000 * seed, seed=seed)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parallel_matches_one_at_a_time(self):
+        serial = summarize_files(self.filenames, jobs=1, min_movement_value=10)
+        parallel = summarize_files(self.filenames, jobs=2, min_movement_value=10)
+        self.assertEqual(parallel, serial)
+        self.assertEqual([summary['session_id'] for summary in parallel], self.filenames)
+        self.assertEqual([summary['entries'] for summary in parallel], [5000, 6000, 7000])
+
+    def test_unreadable_file_reported_in_summary(self):
+        missing = os.path.join(self.directory, 'missing.slp.csv')
+        summaries = summarize_files(self.filenames[:1] + [missing], jobs=2)
+        self.assertFalse(summaries[0].get('error'))
+        self.assertEqual(summaries[1]['session_id'], missing)
+        self.assertTrue(summaries[1]['error'])
+
+    def test_combined_statistics_cover_every_reading(self):
+        combined = combine_summaries(summarize_files(self.filenames, jobs=1))
+        movement_values = numpy.concatenate([synthetic_movement_values(5000 + 1000 * seed, seed)
+                                             for seed in range(3)])
+        self.assertEqual(combined['entries'], len(movement_values))
+        self.assertEqual(combined['max'], movement_values.max())
+        self.assertAlmostEqual(combined['mean'], movement_values.mean(), places=9)
+        self.assertAlmostEqual(combined['variance'], movement_values.var(), places=6)
+        self.assertEqual(combined['median'], numpy.sort(movement_values)[(len(movement_values) - 1) // 2])
+        self.assertNotIn('histogram', combined)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+RollingSlope and rolling_slopes: the same slope as fitting a least-squares line over the whole window.
+RetainedSeries: a bounded series of per-entry results, sliced the way code written for a list slices it
+"""
+import unittest
+import numpy
+from pysleep.rolling import RetainedSeries, RollingSlope, deteriorating_sums, entry_series, rolling_slopes
+from tests.fixtures import synthetic_movement_values
+
+
+def fitted_slope(window):
+    """The slope LinearRegression (or numpy.polyfit) fits to a window, with each value's position as its x"""
+    if len(window) < 2:
+        return 0.0
+    return numpy.polyfit(numpy.arange(len(window)), window, 1)[0]
+
+
+class RollingSlopeTest(unittest.TestCase):
+    def setUp(self):
+        self.values = deteriorating_sums(synthetic_movement_values(3000)).tolist()
+
+    def assertSlopesFitted(self, slopes, size):
+        for position, slope in enumerate(slopes):
+            expected = fitted_slope(self.values[max(0, position + 1 - size):position + 1])
+            self.assertTrue(abs(slope - expected) <= 1e-9 * max(1.0, abs(expected)),
+                            "Slope over %d values at %d is %s, expected %s" % (size, position, slope, expected))
+
+    def test_push_matches_fitted_line(self):
+        for size in (1, 2, 10, 500):
+            rolling_slope = RollingSlope(size)
+            slopes = []
+            for value in self.values:
+                rolling_slope.push(value)
+                slopes.append(rolling_slope.slope)
+            self.assertSlopesFitted(slopes, size)
+
+    def test_batches_match_push(self):
+        for size in (2, 10, 500):
+            rolling_slope = RollingSlope(size)
+            expected = []
+            for value in self.values:
+                rolling_slope.push(value)
+                expected.append(rolling_slope.slope)
+            for split in (0, 1, size - 1, size, 1234):
+                slopes = rolling_slopes(self.values[:split], size).tolist()
+                slopes += rolling_slopes(self.values[split:], size, previous=self.values[:split]).tolist()
+                self.assertEqual(slopes, expected, "Split at %d of a window of %d" % (split, size))
+
+
+class RetainedSeriesTest(unittest.TestCase):
+    def test_entry_series(self):
+        self.assertEqual(type(entry_series()), list)
+        series = entry_series(3, range(5))
+        self.assertTrue(isinstance(series, RetainedSeries))
+        self.assertEqual(list(series), [2, 3, 4])
+
+    def test_slices_match_list_slices(self):
+        for length in (0, 1, 2, 7, 10):
+            series = RetainedSeries(range(100), maxlen=length)
+            expected = list(range(100 - length, 100)) if length else []
+            for start in (None, -12, -10, -7, -3, -1, 0, 1, 3, 6, 9, 12):
+                for stop in (None, -12, -8, -2, -1, 0, 2, 5, 10, 12):
+                    for step in (None, 1, 2, 3, -1, -2):
+                        key = slice(start, stop, step)
+                        self.assertEqual(series[key], expected[key], "%r of %d values" % (key, length))
+
+    def test_slices_are_lists(self):
+        series = RetainedSeries(range(10), maxlen=5)
+        self.assertEqual(type(series[-3:]), list)
+        self.assertEqual(type(series[::-1]), list)
+
+    def test_indexing_still_works(self):
+        series = RetainedSeries(range(10), maxlen=5)
+        self.assertEqual((series[0], series[-1]), (5, 9))
+        self.assertRaises(IndexError, lambda: series[5])
+
+    def test_slice_after_dropping_values(self):
+        series = RetainedSeries(maxlen=1000)
+        for value in range(2500):
+            series.append(value)
+            if value % 250 == 0:
+                self.assertEqual(series[-100:], list(range(max(0, value - 99, value - 999), value + 1)))
+        self.assertEqual(series[-1000:], list(range(1500, 2500)))
+        self.assertEqual(series[:3], [1500, 1501, 1502])
+
+
+if __name__ == '__main__':
+    unittest.main()
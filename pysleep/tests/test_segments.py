@@ -0,0 +1,162 @@
+"""
+SegmentedFile reads a rotated session's segments (gzipped or not) as one logfile, wherever it is seeked to.
+recover_logfiles only gzips segments which are finished, never one which may still be being written
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy
+from pysleep.capture import OutFile, recover_logfiles
+from pysleep.segments import SegmentedFile, compress_segment, segment_filename, session_segments
+from pysleep.utils import SleepFile
+from tests.fixtures import read_all_arrays, synthetic_sleep_entries
+
+HEADER = b'Date,Time,Index,Movement Value\r\n'
+
+
+def entry_lines(first, count):
+    return b''.join(b'03-06-2015,22-%02d-%02d,%d,%d\r\n' % (index // 60, index % 60, index, index % 5)
+                    for index in range(first, first + count))
+
+
+class SegmentedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session_name = os.path.join(self.directory, '03-06-2015-22-00-00.slp.csv')
+        # A gzipped segment, one left uncompressed by a power loss, a one line segment, and one still being written
+        self.segments = []
+        self.expected = HEADER
+        first = 0
+        for number, (count, compressed) in enumerate(((5, True), (4, False), (1, True), (6, False)), 1):
+            segment = segment_filename(self.session_name, number)
+            with open(segment, 'wb') as segment_file:
+                segment_file.write(HEADER + entry_lines(first, count))
+            if compressed:
+                segment = compress_segment(segment)
+            self.segments.append(segment)
+            self.expected += entry_lines(first, count)
+            first += count
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def segment_boundaries(self):
+        """:return: positions in the combined file where each segment after the first starts"""
+        boundaries = [len(HEADER) + len(entry_lines(0, 5))]
+        boundaries.append(boundaries[-1] + len(entry_lines(5, 4)))
+        boundaries.append(boundaries[-1] + len(entry_lines(9, 1)))
+        return boundaries
+
+    def test_reads_as_one_logfile(self):
+        self.assertEqual(session_segments(self.session_name), self.segments)
+        with SegmentedFile(self.segments) as combined:
+            self.assertEqual(combined.size, len(self.expected))
+            self.assertEqual(combined.read(), self.expected)
+            self.assertEqual(combined.tell(), len(self.expected))
+            self.assertEqual(combined.read(), b'')
+
+    def test_seek_to_every_position(self):
+        with SegmentedFile(self.segments) as combined:
+            for position in range(len(self.expected) + 1):
+                combined.seek(position)
+                self.assertEqual(combined.tell(), position)
+                # Long enough to cross into the next segment from near the end of one
+                self.assertEqual(combined.read(40), self.expected[position:position + 40],
+                                 "Read wrongly from %d" % position)
+                self.assertEqual(combined.tell(), min(len(self.expected), position + 40))
+
+    def test_seek_backwards_across_segments(self):
+        with SegmentedFile(self.segments) as combined:
+            for position in reversed(range(0, len(self.expected), 7)):
+                combined.seek(position)
+                self.assertEqual(combined.read(3), self.expected[position:position + 3])
+
+    def test_readline_across_segment_boundaries(self):
+        with SegmentedFile(self.segments) as combined:
+            for boundary in self.segment_boundaries():
+                # Just before a segment ends: the rest of its last line, then the next segment's first entry
+                combined.seek(boundary - 3)
+                self.assertEqual(combined.readline(), self.expected[boundary - 3:boundary])
+                line_end = self.expected.index(b'\n', boundary) + 1
+                self.assertEqual(combined.readline(), self.expected[boundary:line_end])
+                self.assertNotEqual(self.expected[boundary:line_end], HEADER)
+                self.assertEqual(combined.tell(), line_end)
+
+                combined.seek(boundary)
+                self.assertEqual(b''.join(combined), self.expected[boundary:])
+
+    def test_seek_past_the_end(self):
+        with SegmentedFile(self.segments) as combined:
+            combined.seek(len(self.expected) + 10)
+            self.assertEqual(combined.read(), b'')
+            self.assertEqual(combined.readline(), b'')
+
+    def test_plain_copy_preferred_while_compressing(self):
+        # A segment gzipped before the power went, but whose plain copy wasn't removed yet
+        plain = self.segments[0][:-len('.gz')]
+        with open(plain, 'wb') as segment_file:
+            segment_file.write(HEADER + entry_lines(0, 5))
+        self.assertEqual(session_segments(self.session_name), [plain] + self.segments[1:])
+        with SegmentedFile(session_segments(self.session_name)) as combined:
+            self.assertEqual(combined.read(), self.expected)
+
+    def test_compress_segment_leaves_no_temporary_file(self):
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith('.tmp')])
+
+    def test_sleep_file_slices_across_segments(self):
+        sleep_entries = synthetic_sleep_entries(1000)
+        plain = OutFile(os.path.join(self.directory, 'plain.slp.csv'), fsync=False)
+        rotated = OutFile(os.path.join(self.directory, 'rotated.slp.csv'), fsync=False, rotate_entries=130)
+        for sleep_entry in sleep_entries:
+            plain.write_entry(sleep_entry)
+            rotated.write_entry(sleep_entry)
+        plain.close()
+        rotated.close()
+        self.assertEqual(len(rotated.segments), 8)
+
+        expected = read_all_arrays(SleepFile(plain.logfile_name))
+        for expected_column, actual_column in zip(expected, read_all_arrays(SleepFile(rotated.logfile_name))):
+            self.assertTrue(numpy.array_equal(expected_column, actual_column))
+        # Slices starting and ending either side of the boundaries between segments
+        for start, end in ((129, 131), (130, 260), (125, 400), (0, 1000), (259, 261)):
+            start_time, end_time = sleep_entries[start].timestamp, sleep_entries[min(end, 999)].timestamp
+            expected_slice = SleepFile(plain.logfile_name).slice_time(start_time, end_time)
+            actual_slice = SleepFile(rotated.logfile_name).slice_time(start_time, end_time)
+            self.assertEqual(len(actual_slice[0]), min(end, 999) - start)
+            for expected_column, actual_column in zip(expected_slice, actual_slice):
+                self.assertTrue(numpy.array_equal(expected_column, actual_column),
+                                "Sliced %d to %d differently" % (start, end))
+
+
+class RecoverSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session_name = os.path.join(self.directory, '03-06-2015-22-00-00.slp.csv')
+        self.segments = []
+        for number in (1, 2, 3):
+            segment = segment_filename(self.session_name, number)
+            with open(segment, 'wb') as segment_file:
+                segment_file.write(HEADER + entry_lines(0, 3))
+            self.segments.append(segment)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_last_segment_left_alone(self):
+        recover_logfiles(self.directory)
+        self.assertEqual(session_segments(self.session_name),
+                         [self.segments[0] + '.gz', self.segments[1] + '.gz', self.segments[2]])
+
+    def test_last_segment_compressed_once_older_than_a_segment_lasts(self):
+        recover_logfiles(self.directory, rotate_seconds=60)
+        self.assertEqual(session_segments(self.session_name)[-1], self.segments[2])
+        last_written = time.time() - 61
+        os.utime(self.segments[2], (last_written, last_written))
+        recover_logfiles(self.directory, rotate_seconds=60)
+        self.assertEqual(session_segments(self.session_name), [segment + '.gz' for segment in self.segments])
+
+
+if __name__ == '__main__':
+    unittest.main()
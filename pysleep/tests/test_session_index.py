@@ -0,0 +1,75 @@
+"""
+Session index: slicing a logfile by index or time through its index reads exactly the entries reading the whole
+logfile would, whether the index was written while logging, built on first use, or loaded from its sidecar
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from pysleep.capture import OutFile, SessionIndex
+from pysleep.utils import SleepFile, BinarySleepFile, convert_to_binary
+from tests.fixtures import read_all_arrays, synthetic_sleep_entries, write_synthetic_logfile
+
+NUM_ENTRIES = 5500
+
+SLICES = ((0, 10), (995, 1005), (1000, 2000), (2500, 4321), (5490, 5500), (5000, 6000))
+"""Index ranges starting and ending either side of the index's checkpoints, and past the end of the logfile"""
+
+
+class SessionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'session.slp.csv')
+        write_synthetic_logfile(self.filename, NUM_ENTRIES)
+        self.expected = read_all_arrays(SleepFile(self.filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSlicesMatch(self, sleep_file_class, filename):
+        for start, end in SLICES:
+            actual = sleep_file_class(filename).slice(start, end)
+            self.assertEqual(actual[0].tolist(), list(range(start, min(end, NUM_ENTRIES))))
+            for expected_column, actual_column in zip(self.expected, actual):
+                self.assertTrue(numpy.array_equal(expected_column[start:end], actual_column),
+                                "Sliced %d to %d differently" % (start, end))
+
+            timestamps = self.expected[1]
+            end_time = timestamps[end] if end < NUM_ENTRIES else None
+            actual = sleep_file_class(filename).slice_time(timestamps[start], end_time)
+            for expected_column, actual_column in zip(self.expected, actual):
+                self.assertTrue(numpy.array_equal(expected_column[start:end], actual_column),
+                                "Sliced %d to %d by time differently" % (start, end))
+
+    def test_index_built_and_saved_on_first_use(self):
+        index_filename = SessionIndex.filename_for(self.filename)
+        self.assertFalse(os.path.exists(index_filename))
+        self.assertSlicesMatch(SleepFile, self.filename)
+        self.assertTrue(os.path.exists(index_filename))
+        loaded = SessionIndex.load(index_filename, os.path.getsize(self.filename))
+        self.assertEqual(loaded.indexes, list(range(0, NUM_ENTRIES, SessionIndex.INTERVAL)))
+        self.assertSlicesMatch(SleepFile, self.filename)
+
+    def test_index_written_while_logging(self):
+        outfile = OutFile(os.path.join(self.directory, 'logged.slp.csv'), fsync=False)
+        for sleep_entry in synthetic_sleep_entries(NUM_ENTRIES):
+            outfile.write_entry(sleep_entry)
+        outfile.close()
+        self.assertTrue(os.path.exists(SessionIndex.filename_for(outfile.logfile_name)))
+        self.assertSlicesMatch(SleepFile, outfile.logfile_name)
+
+    def test_checkpoints_past_the_end_ignored(self):
+        SleepFile(self.filename).session_index
+        # The logfile lost its last lines (e.g. to a power cut) after the index was written
+        with open(self.filename, 'rb+') as logfile:
+            logfile.truncate(os.path.getsize(self.filename) * 3 // 4)
+        loaded = SessionIndex.load(SessionIndex.filename_for(self.filename), os.path.getsize(self.filename))
+        self.assertTrue(loaded.offsets and max(loaded.offsets) < os.path.getsize(self.filename))
+
+    def test_binary_file_slices_the_same(self):
+        self.assertSlicesMatch(BinarySleepFile, convert_to_binary(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+SleepEntry: printed the same however its time was given (and when copied).
+SleepEntry ordering: entries sort, compare equal and hash by when they were taken, however their time was given
+"""
+import unittest
+from pysleep.capture import SleepEntry, timestamp_from_strings
+from tests.fixtures import synthetic_sleep_entries
+
+START = timestamp_from_strings('03-06-2015', '22-00-00')
+
+
+class SleepEntryFormatTest(unittest.TestCase):
+    def test_timestamp_prints_as_date_and_time(self):
+        # Two days, so the session crosses midnight
+        for sleep_entry in synthetic_sleep_entries(2 * 24 * 60, seconds_per_entry=73):
+            line = "%s,%s,%s,%s" % (sleep_entry._date, sleep_entry._time, sleep_entry.index,
+                                    sleep_entry.movement_value)
+            from_timestamp = SleepEntry(sleep_entry.index, sleep_entry.movement_value, timestamp=sleep_entry.timestamp)
+            self.assertEqual(str(sleep_entry), line)
+            self.assertEqual(str(from_timestamp), line)
+            self.assertEqual(from_timestamp.datetime.strftime("%m-%d-%Y,%H-%M-%S"), line.rsplit(',', 2)[0])
+
+    def test_copies_print_the_same(self):
+        from_strings = SleepEntry(7, 12, '03-06-2015', '23-59-59')
+        from_timestamp = SleepEntry(7, 12, timestamp=from_strings.timestamp)
+        for sleep_entry in (from_strings, from_timestamp):
+            self.assertEqual(str(SleepEntry.copy(sleep_entry)), "03-06-2015,23-59-59,7,12")
+            self.assertEqual(str(SleepEntry.copy(sleep_entry, movement_value=1000)), "03-06-2015,23-59-59,7,1000")
+
+
+class SleepEntryOrderingTest(unittest.TestCase):
+    def test_ordered_by_timestamp(self):
+        earlier = SleepEntry(5, 100, timestamp=START)
+        later = SleepEntry(0, 1, timestamp=START + 1)
+        self.assertTrue(earlier < later and earlier <= later and later > earlier and later >= earlier)
+        self.assertFalse(later < earlier or later <= earlier or earlier > later or earlier >= later)
+        self.assertEqual(sorted([later, earlier]), [earlier, later])
+        self.assertEqual(later - earlier, 1)
+
+    def test_equal_and_hash_match_ordering(self):
+        from_strings = SleepEntry(0, 1, '03-06-2015', '22-00-00')
+        from_timestamp = SleepEntry(1, 2, timestamp=START)
+        self.assertTrue(from_strings == from_timestamp and from_strings <= from_timestamp and
+                        from_strings >= from_timestamp)
+        self.assertFalse(from_strings != from_timestamp)
+        self.assertEqual(hash(from_strings), hash(from_timestamp))
+        self.assertEqual(len(set([from_strings, from_timestamp, SleepEntry(2, 3, timestamp=START + 1)])), 2)
+
+    def test_not_equal_to_other_types(self):
+        sleep_entry = SleepEntry(0, 1, timestamp=START)
+        self.assertNotEqual(sleep_entry, START)
+        self.assertNotEqual(sleep_entry, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
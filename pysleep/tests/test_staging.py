@@ -0,0 +1,147 @@
+"""
+SleepStager at the edges of epochs: which epoch a reading counts towards, when each epoch is scored, and batches
+split anywhere scoring the same as one reading at a time
+"""
+import unittest
+import numpy
+from pysleep.staging import SleepStager, epoch_number, AWAKE, ASLEEP, UNKNOWN
+
+RESULTS = ('epoch_starts', 'counts', 'scores', 'phases', 'transitions')
+
+
+def small_stager():
+    """Weights the epoch before, the epoch itself and the epoch after equally, awake at 10 or more"""
+    return SleepStager(60, weights=(1, 1, 1), future_epochs=1, wake_threshold=10)
+
+
+class StagingEpochTest(unittest.TestCase):
+    def test_epochs_line_up_with_the_clock(self):
+        self.assertEqual(epoch_number(119.999, 60), 1)
+        self.assertEqual(epoch_number(120.0, 60), 2)
+        self.assertEqual(epoch_number(179.5, 60), 2)
+        self.assertEqual(epoch_number(180.0, 60), 3)
+
+    def test_reading_on_an_epoch_boundary_starts_the_next_epoch(self):
+        stager = small_stager()
+        for timestamp, movement_value in ((120.0, 4), (179.5, 3), (180.0, 5), (300.0, 1)):
+            stager.add_reading(timestamp, movement_value)
+        stager.finish()
+        self.assertEqual(stager.epoch_starts, [120, 180, 240, 300])
+        # The epoch with no readings counts as no movement
+        self.assertEqual(stager.counts, [7, 5, 0, 1])
+        # The epochs before the first and after the last count as no movement too
+        self.assertEqual(stager.scores, [12, 12, 6, 1])
+        self.assertEqual(stager.phases, [AWAKE, AWAKE, ASLEEP, ASLEEP])
+        self.assertEqual(stager.transitions, [(120, AWAKE), (240, ASLEEP)])
+
+    def test_epoch_scored_once_the_epochs_after_it_are_complete(self):
+        stager = small_stager()
+        changes = []
+        stager.add_listener(lambda timestamp, old_phase, new_phase: changes.append((timestamp, old_phase, new_phase)))
+        stager.add_reading(120.0, 20)
+        stager.add_reading(180.0, 0)
+        # The first epoch is complete, but the one after it isn't yet
+        self.assertEqual((stager.phase, stager.phases), (UNKNOWN, []))
+        stager.add_reading(239.999, 0)
+        self.assertEqual(stager.phases, [])
+        stager.add_reading(240.0, 0)
+        self.assertEqual((stager.phase, stager.epoch_starts), (AWAKE, [120]))
+        self.assertEqual(changes, [(120, UNKNOWN, AWAKE)])
+        stager.finish()
+        self.assertEqual(stager.epoch_starts, [120, 180, 240])
+        self.assertEqual(changes, [(120, UNKNOWN, AWAKE), (240, AWAKE, ASLEEP)])
+
+    def test_reading_from_an_earlier_epoch_counts_towards_the_current_one(self):
+        # e.g. the clock going back an hour at the end of daylight saving time
+        readings = [(120.0, 1), (190.0, 2), (170.0, 4), (250.0, 8), (100.0, 16)]
+        live = small_stager()
+        for timestamp, movement_value in readings:
+            live.add_reading(timestamp, movement_value)
+        live.finish()
+        self.assertEqual(live.counts, [1, 6, 24])
+
+        batch = small_stager()
+        batch.add_arrays(numpy.array([timestamp for timestamp, _ in readings]),
+                         numpy.array([movement_value for _, movement_value in readings]))
+        batch.finish()
+        for name in RESULTS:
+            self.assertEqual(getattr(batch, name), getattr(live, name), name)
+
+    def test_finish_scores_the_last_epochs(self):
+        stager = SleepStager(60)
+        stager.add_reading(0.0, 1)
+        self.assertEqual(stager.phases, [])
+        stager.finish()
+        self.assertEqual((stager.epoch_starts, stager.phases), ([0], [ASLEEP]))
+        stager.finish()
+        self.assertEqual(stager.epoch_starts, [0])
+        self.assertRaises(AssertionError, stager.add_reading, 60.0, 1)
+        self.assertRaises(AssertionError, stager.add_arrays, numpy.array([60.0]), numpy.array([1]))
+
+    def test_finish_without_readings(self):
+        stager = SleepStager(60)
+        stager.finish()
+        self.assertEqual((stager.epoch_starts, stager.phase), ([], UNKNOWN))
+
+
+class StagingBatchTest(unittest.TestCase):
+    """add_arrays, as SleepAnalyzer.analyze_array uses it, against add_reading"""
+    def setUp(self):
+        # Readings just before, on and just after epoch boundaries, gaps of several epochs, and enough movement to
+        # be scored awake with the Cole-Kripke weights
+        timestamps = []
+        movement_values = []
+        for epoch in (0, 1, 2, 3, 5, 6, 7, 11, 12, 13, 14, 15, 16, 25):
+            for offset, movement_value in ((-0.5, 3), (0.0, 5), (0.5, 7), (30.0, 2)):
+                timestamps.append(epoch * 60 + offset + 6000)
+                movement_values.append(movement_value * (20000 if 5 <= epoch <= 13 else 1))
+        self.timestamps = numpy.array(timestamps)
+        self.movement_values = numpy.array(movement_values)
+
+    def live(self, stager):
+        for timestamp, movement_value in zip(self.timestamps.tolist(), self.movement_values.tolist()):
+            stager.add_reading(timestamp, movement_value)
+        stager.finish()
+        return stager
+
+    def batches(self, stager, splits):
+        bounds = [0] + list(splits) + [len(self.timestamps)]
+        for start, end in zip(bounds, bounds[1:]):
+            stager.add_arrays(self.timestamps[start:end], self.movement_values[start:end])
+        stager.finish()
+        return stager
+
+    def assertSameStaging(self, expected, actual, message):
+        for name in RESULTS:
+            self.assertEqual(getattr(actual, name), getattr(expected, name), "%s differ: %s" % (name, message))
+
+    def test_both_phases_scored(self):
+        self.assertEqual(set(self.live(SleepStager(60)).phases), set([AWAKE, ASLEEP]))
+
+    def test_every_split_into_two_batches(self):
+        for make_stager in (small_stager, SleepStager):
+            expected = self.live(make_stager())
+            for split in range(len(self.timestamps) + 1):
+                self.assertSameStaging(expected, self.batches(make_stager(), [split]), "split at %d" % split)
+
+    def test_every_split_into_three_batches(self):
+        expected = self.live(SleepStager(60))
+        for first in range(len(self.timestamps) + 1):
+            for second in range(first, len(self.timestamps) + 1, 3):
+                self.assertSameStaging(expected, self.batches(SleepStager(60), [first, second]),
+                                       "split at %d and %d" % (first, second))
+
+    def test_one_reading_batches(self):
+        self.assertSameStaging(self.live(SleepStager(60)),
+                               self.batches(SleepStager(60), range(1, len(self.timestamps))), "one reading batches")
+
+    def test_batches_told_about_every_transition(self):
+        stager = SleepStager(60)
+        changes = []
+        stager.add_listener(lambda timestamp, old_phase, new_phase: changes.append((timestamp, new_phase)))
+        self.batches(stager, [5, 17, 30])
+        self.assertEqual(changes, self.live(SleepStager(60)).transitions)
+
+
+if __name__ == '__main__':
+    unittest.main()
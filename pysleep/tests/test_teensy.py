@@ -0,0 +1,60 @@
+"""
+Finding the Teensy: probing every port at once finds the one sending readings, and remembers the silent ones (Linux
+and OS X only, as it uses pseudo-terminals)
+"""
+import threading
+import time
+import unittest
+from pysleep.capture import Teensy
+from tests.fixtures import PseudoTeensy
+
+try:
+    import pty
+except ImportError:
+    pty = None
+
+
+@unittest.skipIf(pty is None, "needs pseudo-terminals")
+class ProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.devices = [PseudoTeensy(1000, seed) for seed in range(5)]
+        self.ports = [device.port for device in self.devices]
+        # A Teensy instance without running the search in __init__
+        self.teensy = Teensy.__new__(Teensy)
+        self.teensy._silent_ports = set()
+        self.sending = threading.Event()
+        self.sender = None
+
+    def tearDown(self):
+        self.sending.clear()
+        if self.sender is not None:
+            self.sender.join()
+        for device in self.devices:
+            device.unplug()
+
+    def send_readings(self, device):
+        def send():
+            while self.sending.is_set():
+                device.send_reading()
+                time.sleep(0.05)
+        self.sending.set()
+        self.sender = threading.Thread(target=send)
+        self.sender.start()
+
+    def test_finds_the_port_sending_readings(self):
+        self.send_readings(self.devices[3])
+        started = time.time()
+        found = self.teensy._probe(self.ports)
+        # Every port is probed at once, rather than one PROBE_TIMEOUT after another
+        self.assertTrue(time.time() - started < 2 * Teensy.PROBE_TIMEOUT + 1)
+        self.assertEqual(found.port, self.devices[3].port)
+        found.close()
+        self.assertEqual(self.teensy._silent_ports, set(self.ports) - set([self.devices[3].port]))
+
+    def test_nothing_found_when_every_port_is_silent(self):
+        self.assertIsNone(self.teensy._probe(self.ports))
+        self.assertEqual(self.teensy._silent_ports, set(self.ports))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+LogfileUploader resuming a transfer cut short: only the rest of the logfile is sent (with REST), and the server's copy
+is checked before the logfile is removed. Uploading many logfiles over a pool of connections, and uncompressed.
+"""
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from pysleep.segments import compress_segment, segment_filename
+from pysleep.upload import LogfileUploader, UploadReader
+from tests.fixtures import LocalFTPServer, write_synthetic_logfile
+
+
+def read_file(filename):
+    with open(filename, 'rb') as file_object:
+        return file_object.read()
+
+
+class ResumedUploadTest(unittest.TestCase):
+    xmd5 = True
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local_directory = os.path.join(self.directory, 'local')
+        self.remote_directory = os.path.join(self.directory, 'remote')
+        os.mkdir(self.local_directory)
+        os.mkdir(self.remote_directory)
+        self.logfile = os.path.join(self.local_directory, '03-06-2015-22-00-00.slp.csv')
+        write_synthetic_logfile(self.logfile, 20000)
+        self.logfile_data = read_file(self.logfile)
+        with UploadReader(self.logfile) as reader:
+            self.compressed = reader.read()
+        self.server = LocalFTPServer(self.remote_directory, xmd5=self.xmd5)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def upload_all(self):
+        uploader = LogfileUploader('127.0.0.1', self.server.user, self.server.password, directory=self.local_directory,
+                                   remote_directory='.', port=self.server.port, connections=1, min_size=0)
+        return uploader.upload_all()
+
+    def remote_file(self, name):
+        return os.path.join(self.remote_directory, name)
+
+    def put_remote(self, name, data):
+        with open(self.remote_file(name), 'wb') as remote:
+            remote.write(data)
+
+    def assertUploaded(self):
+        with gzip.open(self.remote_file('03-06-2015-22-00-00.slp.csv.gz'), 'rb') as uploaded:
+            self.assertEqual(uploaded.read(), self.logfile_data)
+        self.assertFalse(os.path.exists(self.logfile), "Uploaded logfile wasn't removed")
+
+    def test_resumes_where_upload_stopped(self):
+        cut_at = len(self.compressed) // 3
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', self.compressed[:cut_at])
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['resumed'], stats['failed']), (1, 1, 0))
+        self.assertEqual(stats['bytes_sent'], len(self.compressed) - cut_at)
+        self.assertIn('REST %d' % cut_at, self.server.commands)
+        self.assertEqual(self.server.bytes_received, len(self.compressed) - cut_at)
+        self.assertUploaded()
+
+    def test_resumes_from_one_byte_short(self):
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', self.compressed[:-1])
+        stats = self.upload_all()
+        self.assertEqual(stats['bytes_sent'], 1)
+        self.assertUploaded()
+
+    def test_complete_copy_is_only_checked(self):
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', self.compressed)
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['resumed'], stats['bytes_sent']), (1, 1, 0))
+        self.assertFalse([command for command in self.server.commands if command.startswith('STOR')])
+        self.assertUploaded()
+
+    def test_mismatched_copy_is_sent_again_in_full(self):
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', b'x' * 1000)
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['failed']), (1, 0))
+        # The resumed upload fails its check, then the whole logfile is sent
+        self.assertEqual(stats['bytes_sent'], len(self.compressed) - 1000 + len(self.compressed))
+        self.assertUploaded()
+
+    def test_longer_copy_is_sent_again_in_full(self):
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', self.compressed + b'extra')
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['failed'], stats['bytes_sent']), (1, 0, len(self.compressed)))
+        self.assertUploaded()
+
+    def test_resumes_gzipped_segment(self):
+        # Segments are gzipped already, so they are sent (and resumed) as they are, under their own name
+        os.remove(self.logfile)
+        segment = segment_filename(self.logfile, 1)
+        write_synthetic_logfile(segment, 20000, seed=1)
+        segment = compress_segment(segment)
+        segment_data = read_file(segment)
+        cut_at = len(segment_data) // 2
+        self.put_remote(os.path.basename(segment), segment_data[:cut_at])
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['resumed'], stats['bytes_sent']),
+                         (1, 1, len(segment_data) - cut_at))
+        self.assertEqual(read_file(self.remote_file(os.path.basename(segment))), segment_data)
+        self.assertFalse(os.path.exists(segment))
+
+
+class ResumedUploadWithoutXMD5Test(ResumedUploadTest):
+    """Same, against a server which can only be checked by the size of its copy"""
+    xmd5 = False
+
+    def test_mismatched_copy_is_sent_again_in_full(self):
+        # A copy of the wrong length is still caught
+        self.put_remote('03-06-2015-22-00-00.slp.csv.gz', b'x' * (len(self.compressed) + 1))
+        stats = self.upload_all()
+        self.assertEqual((stats['uploaded'], stats['failed'], stats['bytes_sent']), (1, 0, len(self.compressed)))
+        self.assertUploaded()
+
+
+class UploadPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.local_directory = os.path.join(self.directory, 'local')
+        self.remote_directory = os.path.join(self.directory, 'remote')
+        os.mkdir(self.local_directory)
+        os.mkdir(self.remote_directory)
+        self.logfile_data = {}
+        for number in range(8):
+            name = 'session-%02d.slp.csv' % number
+            write_synthetic_logfile(os.path.join(self.local_directory, name), 2000, seed=number)
+            self.logfile_data[name] = read_file(os.path.join(self.local_directory, name))
+        # Slow replies, so uploads overlap
+        self.server = LocalFTPServer(self.remote_directory, latency=0.01)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def upload_all(self, **kwargs):
+        uploader = LogfileUploader('127.0.0.1', self.server.user, self.server.password, directory=self.local_directory,
+                                   remote_directory='.', port=self.server.port, min_size=0, **kwargs)
+        return uploader, uploader.upload_all()
+
+    def test_every_logfile_uploaded_over_a_few_connections(self):
+        uploader, stats = self.upload_all(connections=3)
+        self.assertEqual((stats['uploaded'], stats['failed']), (8, 0))
+        self.assertTrue(1 < self.server.max_connections <= 3, self.server.max_connections)
+        for name, data in self.logfile_data.items():
+            with gzip.open(os.path.join(self.remote_directory, uploader.remote_name(name)), 'rb') as uploaded:
+                self.assertEqual(uploaded.read(), data)
+        self.assertFalse(os.listdir(self.local_directory))
+
+    def test_uncompressed_upload(self):
+        uploader, stats = self.upload_all(compress=False)
+        self.assertEqual(stats['uploaded'], 8)
+        self.assertEqual(stats['bytes_sent'], sum(len(data) for data in self.logfile_data.values()))
+        self.assertEqual(self.server.bytes_received, stats['bytes_sent'])
+        for name, data in self.logfile_data.items():
+            self.assertEqual(read_file(os.path.join(self.remote_directory, uploader.remote_name(name))), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
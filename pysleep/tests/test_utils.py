@@ -0,0 +1,59 @@
+"""
+SleepAnalyzer keeping only the last retain_entries entries (and per-entry results) of a session: everything a live
+session reads still works, and matches an analyzer which keeps the whole session
+"""
+import unittest
+import numpy
+from pysleep.utils import SleepAnalyzer
+from tests.fixtures import synthetic_sleep_entries
+
+RETAIN_ENTRIES = SleepAnalyzer.MOVEMENT_HISTORY_SIZE
+
+
+class RetainedAnalysisTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sleep_entries = synthetic_sleep_entries(3 * RETAIN_ENTRIES + 123)
+        cls.whole = SleepAnalyzer()
+        cls.retained = SleepAnalyzer(retain_entries=RETAIN_ENTRIES)
+        for sleep_entry in cls.sleep_entries:
+            cls.whole.add_entry(sleep_entry)
+            cls.retained.add_entry(sleep_entry)
+
+    def test_recent_results_match_whole_session(self):
+        for name in ('movement_sums', 'deteriorating_movement_sums', 'deteriorating_movement_sum_coefficients'):
+            whole, retained = getattr(self.whole, name), getattr(self.retained, name)
+            self.assertEqual(len(retained), min(len(whole), RETAIN_ENTRIES), name)
+            self.assertEqual(retained[-100:], whole[-100:], name)
+            self.assertEqual(list(retained), whole[-len(retained):], name)
+
+    def test_last_movement_sum_coefficients(self):
+        self.assertEqual(self.retained.last_movement_sum_coefficients, self.whole.last_movement_sum_coefficients)
+
+    def test_last_entries(self):
+        self.assertEqual([str(sleep_entry) for sleep_entry in self.retained.last_entries],
+                         [str(sleep_entry) for sleep_entry in self.sleep_entries[-RETAIN_ENTRIES:]])
+
+    def test_only_retained_entries_kept(self):
+        self.assertEqual(len(self.retained.sleep_entries), RETAIN_ENTRIES)
+        self.assertEqual(self.retained.num_values_recorded, len(self.sleep_entries))
+
+    def test_summary_covers_whole_session(self):
+        self.assertEqual(self.retained.summary(), self.whole.summary())
+
+    def test_analyze_array_matches_add_entry(self):
+        batch = SleepAnalyzer(retain_entries=RETAIN_ENTRIES)
+        indexes = numpy.array([sleep_entry.index for sleep_entry in self.sleep_entries])
+        timestamps = numpy.array([sleep_entry.timestamp for sleep_entry in self.sleep_entries])
+        movement_values = numpy.array([sleep_entry.movement_value for sleep_entry in self.sleep_entries])
+        # Batches smaller and bigger than what is retained
+        for start, end in ((0, 700), (700, 2500), (2500, len(self.sleep_entries))):
+            batch.analyze_array(movement_values[start:end], timestamps[start:end], indexes[start:end])
+        for name in ('movement_sums', 'deteriorating_movement_sums', 'deteriorating_movement_sum_coefficients'):
+            self.assertEqual(list(getattr(batch, name)), list(getattr(self.retained, name)), name)
+        self.assertEqual(batch.last_movement_sum_coefficients, self.retained.last_movement_sum_coefficients)
+        self.assertEqual(batch.summary(), self.whole.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()